@@ -0,0 +1,97 @@
+"""
+Static batching of the scene graph.
+
+Every TexturedPhongMesh costs a program switch, its uniforms, a texture
+bind and a draw call. Once the builders have run, StaticBatcher.batch()
+bakes the world transforms of the meshes that never move into merged
+vertex arrays, one per (shader, texture, material constants) group, each
+drawn by a single TexturedPhongMesh. Subtrees under animated nodes are
+left alone, as are meshes switching levels of detail. Meshes with layers
+of the same texture array (see texturepack) share a group, their layer
+is baked per vertex.
+"""
+# External, non built-in modules
+import numpy as np
+
+from keyframe import KeyFrameControlNode
+from mesh import TexturedPhongMesh
+from node import Node
+from procedural_anime import ProceduralAnimation, ProceduralInstances
+from skinning import SkinningControlNode
+from transform import identity
+from vertexarray import mesh_layout, LAYER_LOCATION
+
+ANIMATED = (KeyFrameControlNode, ProceduralAnimation, ProceduralInstances, SkinningControlNode)
+
+
+def merge_meshes(meshes, transforms):
+    """ [positions, uvs, normals] and faces of meshes with their transforms
+        baked in, normals by the inverse transpose, plus their texture
+        layers at LAYER_LOCATION when they use a texture array """
+    positions, uvs, normals, faces, offset = [], [], [], [], 0
+    for mesh, transform in zip(meshes, transforms):
+        vertices, texture_coords, vertex_normals = (np.asarray(data, np.float32) for data in mesh.attributes)
+        positions.append(vertices @ transform[:3, :3].T + transform[:3, 3])
+        rotated = vertex_normals @ np.linalg.inv(transform[:3, :3])
+        normals.append(rotated / np.maximum(np.linalg.norm(rotated, axis=1, keepdims=True), 1e-12))
+        uvs.append(texture_coords)
+        faces.append(np.asarray(mesh.faces, np.int64) + offset)
+        offset += len(vertices)
+    attributes = [np.concatenate(data).astype(np.float32) for data in (positions, uvs, normals)]
+    if hasattr(meshes[0].texture, 'array'):  # a TextureLayer
+        layers = np.repeat([mesh.texture.layer for mesh in meshes], [len(mesh.attributes[0]) for mesh in meshes])
+        attributes += [None] * (LAYER_LOCATION - len(attributes)) + [layers.astype(np.uint8)[:, None]]
+    return attributes, np.concatenate(faces).astype(np.uint32)
+
+
+class StaticBatcher:
+    """ Merges static TexturedPhongMeshes of a scene graph by shader,
+        texture and material, skipping subtrees under exclude node types """
+
+    def __init__(self, exclude=ANIMATED):
+        self.exclude = exclude
+        self.meshes, self.batches = 0, 0
+
+    def collect(self, node, transform, groups):
+        """ static meshes below node as {group key: [(parent, mesh, transform)]},
+            transform being the model matrix node's children are drawn with """
+        for child in node.children:
+            if isinstance(child, self.exclude):
+                continue
+            if type(child) is TexturedPhongMesh:
+                texture = getattr(child.texture, 'array', child.texture)  # layers of an array group together
+                key = (child.shader, texture, tuple(child.k_a), tuple(child.k_d), tuple(child.k_s), child.s)
+                groups.setdefault(key, []).append((node, child, transform))
+            elif type(child) is Node:
+                self.collect(child, transform @ child.transform, groups)
+
+    def batch(self, root):
+        """ replace the static meshes below root by one merged mesh per
+            group of at least two, added to root """
+        groups = {}
+        self.collect(root, identity(), groups)
+        for (shader, _, k_a, k_d, k_s, s), members in groups.items():
+            if len(members) < 2:
+                continue
+            attributes, faces = merge_meshes([mesh for _, mesh, _ in members],
+                                             [transform for _, _, transform in members])
+            for parent, mesh, _ in members:
+                parent.children.remove(mesh)
+            texture = members[0][1].texture
+            root.add(TexturedPhongMesh(shader, texture, attributes, faces, k_a=k_a, k_d=k_d, k_s=k_s, s=s,
+                                       layout=mesh_layout(attributes)))
+            self.meshes += len(members)
+            self.batches += 1
+        self.prune(root)
+        return self
+
+    def prune(self, node):
+        """ drop the plain Nodes left without children by batching """
+        for child in list(node.children):
+            if type(child) is Node:
+                self.prune(child)
+                if not child.children:
+                    node.children.remove(child)
+
+    def report(self):
+        return 'Batching: %d static meshes merged into %d draws' % (self.meshes, self.batches)
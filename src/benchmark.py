@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+CPU side benchmarks of the asset pipeline, no OpenGL context needed.
+Run from the src folder, same as main.py:
+
+    python3 benchmark.py terrain rays bones meshes
+"""
+# Python built-in modules
+import os
+import sys
+import time
+
+# External, non built-in modules
+import numpy as np
+from PIL import Image
+
+from heightfield import HeightField
+from meshopt import optimize_mesh, lod_levels
+from skinning import vertex_bones, MAX_BONES, MAX_VERTEX_BONES
+from texturedplane import grid_attributes
+from transform import normalized
+
+HMAP_FILES = ["./../resources/map/hmap_2_mounds_256px.png",
+              "./../resources/map/hmap_2_mounds_1000px.png",
+              "./../resources/map/hmap_2_mounds_4096px.png"]
+
+
+def timed(function, *args):
+    """ run function once, return (result, elapsed seconds) """
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+# -------------- Terrain attribute generation ---------------------------------
+def reference_attributes(size, hmap_tex, max_height=30, max_pixel_color=256):
+    """ Per-pixel loop TexturedPlane.create_attributes used to run """
+    def get_height(x, z):
+        if x < 0 or x >= hmap_tex.shape[0] or z < 0 or z >= hmap_tex.shape[0]:
+            return 0
+        return hmap_tex[x, z, 0] / max_pixel_color * max_height
+
+    vertices, normals, texture_coords = [], [], []
+    for i in range(0, size):
+        for j in range(0, size):
+            vertices.append([(j / (size - 1)) * 1000, get_height(i, j), (i / (size - 1)) * 1000])
+            normals.append(normalized(np.array([get_height(j - 1, i) - get_height(j + 1, i), 2.0,
+                                                get_height(j, i - 1) - get_height(j, i + 1)])))
+            texture_coords.append([j / (size - 1), i / (size - 1)])
+
+    indices = []
+    for gz in range(0, size - 1):
+        for gx in range(0, size - 1):
+            top_left = (gz * size) + gx
+            bottom_left = ((gz + 1) * size) + gx
+            indices.append([top_left, bottom_left, top_left + 1, top_left + 1, bottom_left, bottom_left + 1])
+
+    return np.array(vertices), np.array(texture_coords), np.array(normals), np.array(indices)
+
+
+def bench_terrain(reference_max_size=256):
+    """ vectorized grid_attributes on every heightmap, checked against the
+        per-pixel loop (as uploaded: float32 / int32) on the small ones """
+    for hmap_file in HMAP_FILES:
+        hmap_tex = np.asarray(Image.open(hmap_file).convert('RGB'))
+        size = hmap_tex.shape[0]
+        heights = hmap_tex[:, :, 0] / 256 * 30
+        arrays, elapsed = timed(grid_attributes, heights)
+        vertex_count, triangle_count = arrays[0].shape[0], arrays[3].size // 3
+        line = '%5dpx  %9d vertices  %9d triangles  vectorized %7.3fs' % (
+            size, vertex_count, triangle_count, elapsed)
+
+        if size <= reference_max_size:
+            expected, ref_elapsed = timed(reference_attributes, size, hmap_tex)
+            for name, got, want, dtype in zip(('vertices', 'uvs', 'normals', 'indices'), arrays, expected,
+                                              (np.float32, np.float32, np.float32, np.int32)):
+                assert np.array_equal(got, want.astype(dtype)), 'terrain %s differ at %dpx' % (name, size)
+            line += '  loop %7.3fs  (x%.0f, identical)' % (ref_elapsed, ref_elapsed / elapsed)
+        print(line)
+        del arrays
+
+
+# -------------- Ray / terrain intersection ----------------------------------
+def bench_rays(single_rays=1000, batched_rays=100000):
+    """ scalar and batched pyramid ray marching on every heightmap, random
+        rays from above the map towards it, both variants must agree """
+    random = np.random.RandomState(0)
+    for hmap_file in HMAP_FILES:
+        heightfield = HeightField(hmap_file, extent=1000, origin=(-500, -1, -500), mmap=False)
+        _, build_elapsed = timed(lambda: heightfield.pyramid)
+        origins = np.column_stack((random.uniform(-700, 700, batched_rays), random.uniform(0, 80, batched_rays),
+                                   random.uniform(-700, 700, batched_rays)))
+        targets = np.column_stack((random.uniform(-500, 500, batched_rays), random.uniform(-1, 30, batched_rays),
+                                   random.uniform(-500, 500, batched_rays)))
+        directions = (targets - origins) / np.linalg.norm(targets - origins, axis=1, keepdims=True)
+
+        hits, batched_elapsed = timed(heightfield.intersect_rays, origins, directions)
+        singles, single_elapsed = timed(lambda: [heightfield.intersect_ray(origins[i], directions[i])
+                                                 for i in range(single_rays)])
+        singles = np.array([np.inf if hit is None else hit for hit in singles])
+        assert np.allclose(singles, hits[:single_rays]), 'scalar and batched rays differ'
+        print('%5dpx  pyramid %6.3fs  scalar %6.1fus/ray  batched %5.2fus/ray  (%d%% hits)' % (
+            heightfield.size, build_elapsed, single_elapsed / single_rays * 1e6,
+            batched_elapsed / batched_rays * 1e6, 100 * np.isfinite(hits).mean()))
+
+
+# -------------- Skinned mesh bone weights -----------------------------------
+SKINNED_FILES = ["./../resources/characters/farmer/farmer.FBX"]
+
+
+def reference_vertex_bones(bones, vertex_count):
+    """ Dense (vertex, MAX_BONES) weight sort the skinned loader used to run """
+    v_bone = np.array([[(0, 0)] * MAX_BONES] * vertex_count, dtype=[('weight', 'f4'), ('id', 'u4')])
+    for bone_id, bone in enumerate(bones[:MAX_BONES]):
+        v_bone['weight'][bone.vertex_ids, bone_id] = bone.weights
+        v_bone['id'][bone.vertex_ids, bone_id] = bone_id
+    v_bone.sort(order='weight')
+    v_bone = v_bone[:, -MAX_VERTEX_BONES:]
+    return v_bone['id'], v_bone['weight']
+
+
+def influences(bone_ids, bone_weights, bone_count):
+    """ normalized (vertex, bone) influence matrix, whatever the slot order """
+    matrix = np.zeros((len(bone_ids), bone_count))
+    np.add.at(matrix, (np.arange(len(bone_ids))[:, None], bone_ids.astype(np.intp)), bone_weights)
+    total = matrix.sum(axis=1, keepdims=True)
+    return np.divide(matrix, total, out=matrix, where=total > 0)
+
+
+def bench_bones():
+    """ sparse vertex_bones on every skinned model mesh, checked against the
+        dense per vertex sort: same influences once renormalized """
+    import assimpcy  # only needed here, for the import flags
+    from modelcache import import_scene  # needs assimpcy, the terrain and rays benchmarks do not
+    flags = assimpcy.aiPostProcessSteps.aiProcess_Triangulate | assimpcy.aiPostProcessSteps.aiProcess_GenSmoothNormals
+    for model_file in SKINNED_FILES:
+        scene = import_scene(model_file, flags)
+        for mesh_index, mesh in enumerate(scene.mMeshes):
+            bone_count = min(len(mesh.mBones), MAX_BONES)
+            (ids, weights), elapsed = timed(vertex_bones, mesh.mBones, mesh.mNumVertices)
+            (ref_ids, ref_weights), ref_elapsed = timed(reference_vertex_bones, mesh.mBones, mesh.mNumVertices)
+            assert np.allclose(influences(ids, weights, bone_count), influences(ref_ids, ref_weights, bone_count),
+                               atol=1e-6), 'bone weights differ on mesh %d' % mesh_index
+            print('mesh %d  %7d vertices  %3d bones  sparse %7.4fs %6.2fMB  dense %7.4fs %6.2fMB  (x%.0f)' % (
+                mesh_index, mesh.mNumVertices, len(mesh.mBones), elapsed, (ids.nbytes + weights.nbytes) / 2 ** 20,
+                ref_elapsed, mesh.mNumVertices * MAX_BONES * 8 / 2 ** 20, ref_elapsed / elapsed))
+
+
+# -------------- Mesh welding and reordering ---------------------------------
+STATIC_FILES = ["./../resources/castle/castle_cull_fixed.fbx",
+                "./../resources/church/church.FBX",
+                "./../resources/graveyard/graveyardpack/Demo_Scene.obj"]
+
+
+def bench_meshes():
+    """ optimize_mesh on the meshes of the big static models, as imported
+        by the loaders: vertex count and ACMR before and after, then the
+        triangle counts of their levels of detail """
+    import assimpcy  # only needed here, for the import flags
+    from modelcache import import_scene  # needs assimpcy, the terrain and rays benchmarks do not
+    flags = assimpcy.aiPostProcessSteps.aiProcess_Triangulate | assimpcy.aiPostProcessSteps.aiProcess_FlipUVs
+    for model_file in STATIC_FILES:
+        scene = import_scene(model_file, flags, optimize=False)
+        for mesh_index, mesh in enumerate(scene.mMeshes):
+            attributes = [mesh.mVertices, mesh.mNormals, mesh.mTextureCoords[0]]
+            (attributes, faces, _, stats), elapsed = timed(optimize_mesh, attributes, mesh.mFaces)
+            assert len(faces) == mesh.mNumFaces, 'triangles lost optimizing %s' % model_file
+            print('%-22s mesh %2d  %7d tris  %7d -> %7d vertices  ACMR %.2f -> %.2f  %6.2fs' % (
+                os.path.basename(model_file), mesh_index, mesh.mNumFaces, *stats['vertices'], *stats['acmr'],
+                elapsed))
+            levels, elapsed = timed(lod_levels, attributes, faces)
+            if levels:
+                print('%33s lods %s  %6.2fs' % ('', ' '.join('%d (error %.3g)' % (len(lod_faces), error)
+                                                                 for _, lod_faces, error in levels), elapsed))
+
+
+BENCHMARKS = {'terrain': bench_terrain, 'rays': bench_rays, 'bones': bench_bones, 'meshes': bench_meshes}
+
+
+def main():
+    """ run the benchmarks named on the command line, or all of them """
+    for name in sys.argv[1:] or BENCHMARKS:
+        print('--- %s' % name)
+        BENCHMARKS[name]()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+"""
+On-disk cache of generated numpy arrays.
+
+Each entry is a single binary file: a small JSON header describing the
+arrays, followed by their raw bytes (64 byte aligned), so a cache hit is
+just a few np.memmap views that VertexArray can upload without copying.
+Entries are named <prefix>-<key>.v<CACHE_VERSION>.bin where key hashes
+the source file contents and every generation parameter, storing an
+entry deletes the other entries with the same prefix, and once per run
+the entries of other cache versions, so stale files never pile up.
+"""
+# Python built-in modules
+import glob
+import hashlib
+import json
+import os
+import struct
+import threading
+
+# External, non built-in modules
+import numpy as np
+
+CACHE_DIR = "./../cache"
+CACHE_VERSION = 2  # bump when a generator changes its output
+MAGIC = b'3DGCACHE'
+ALIGNMENT = 64
+COLLECTED = set()  # directories whose other versions' entries were deleted this run
+COLLECT_LOCK = threading.Lock()
+
+
+def file_digest(file_name):
+    """ sha1 of a file contents, read in chunks """
+    digest = hashlib.sha1()
+    with open(file_name, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cache_key(*parts):
+    """ short hash of any repr-able generation parameters """
+    return hashlib.sha1(repr((CACHE_VERSION,) + parts).encode()).hexdigest()[:16]
+
+
+def save_arrays(file_name, arrays):
+    """ write a dict of arrays as header + aligned raw data, atomically """
+    arrays = {name: np.ascontiguousarray(array) for name, array in arrays.items()}
+    header, offset = {}, 0
+    for name, array in arrays.items():
+        header[name] = (array.dtype.str, array.shape, offset)
+        offset += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+    header_bytes = json.dumps(header).encode()
+    start = -(-(len(MAGIC) + 8 + len(header_bytes)) // ALIGNMENT) * ALIGNMENT
+
+    os.makedirs(os.path.dirname(file_name) or '.', exist_ok=True)
+    temp_name = '%s.%d.%d.tmp' % (file_name, os.getpid(), threading.get_ident())
+    with open(temp_name, 'wb') as file:
+        file.write(MAGIC + struct.pack('<Q', len(header_bytes)) + header_bytes)
+        for name, array in arrays.items():
+            file.seek(start + header[name][2])
+            file.write(array.tobytes())
+        file.truncate(start + offset)
+    os.replace(temp_name, file_name)
+
+
+def remove_file(file_name):
+    """ delete file_name, if another thread or process did not already """
+    try:
+        os.remove(file_name)
+    except OSError:
+        pass
+
+
+def remove_old_versions(directory):
+    """ delete the entries of other cache versions in directory, once per run """
+    with COLLECT_LOCK:
+        if directory in COLLECTED:
+            return
+        COLLECTED.add(directory)
+    suffix = '.v%d.bin' % CACHE_VERSION
+    for entry in glob.glob(os.path.join(glob.escape(directory), '*.bin')):
+        if not entry.endswith(suffix):
+            remove_file(entry)
+
+
+def load_arrays(file_name):
+    """ read-only memory mapped views of the arrays saved in file_name """
+    with open(file_name, 'rb') as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            raise ValueError('%s is not a cache file' % file_name)
+        header_size, = struct.unpack('<Q', file.read(8))
+        header = json.loads(file.read(header_size).decode())
+    start = -(-(len(MAGIC) + 8 + header_size) // ALIGNMENT) * ALIGNMENT
+    arrays = {}
+    for name, (dtype, shape, offset) in header.items():
+        if int(np.prod(shape)) == 0:
+            arrays[name] = np.empty(shape, dtype)
+        else:
+            arrays[name] = np.memmap(file_name, dtype, 'r', start + offset, tuple(shape))
+    return arrays
+
+
+class ArrayCache:
+    """ Named group of cache entries, e.g. one per generated terrain """
+
+    def __init__(self, prefix, directory=CACHE_DIR):
+        self.prefix = prefix
+        self.directory = directory
+
+    def path(self, key):
+        return os.path.join(self.directory, '%s-%s.v%d.bin' % (self.prefix, key, CACHE_VERSION))
+
+    def load(self, key):
+        """ cached arrays for key, or None when missing or unreadable """
+        try:
+            return load_arrays(self.path(key))
+        except (OSError, ValueError):
+            return None
+
+    def store(self, key, arrays):
+        """ save arrays under key and drop the prefix's now stale entries """
+        path = self.path(key)
+        try:
+            save_arrays(path, arrays)
+        except OSError as exception:
+            print('WARNING: unable to write cache file %s: %s' % (path, exception))
+            return
+        pattern = glob.escape(self.prefix) + '-' + '?' * len(key) + '.v%d.bin' % CACHE_VERSION
+        for stale in glob.glob(os.path.join(glob.escape(self.directory), pattern)):
+            if stale != path:
+                remove_file(stale)  # concurrent stores of the prefix race for it
+        remove_old_versions(self.directory)
+
+    def get(self, key, generate):
+        """ cached arrays for key, calling generate() and storing on a miss """
+        arrays = self.load(key)
+        if arrays is None:
+            arrays = generate()
+            self.store(key, arrays)
+        return arrays
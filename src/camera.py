@@ -1,13 +1,12 @@
 import copy
 import numpy as np
 import glfw
-from PIL import Image
 
 from transform import normalized
 
 
 class Camera:
-    def __init__(self):
+    def __init__(self, heightfield=None):
         # Define camera specific variables
         self.camera_pos = np.array((0.0, 4.0, 0.0))
         # self.camera_target = np.array((1.0, 0.0, 0.0))
@@ -27,13 +26,14 @@ class Camera:
         self.sensitivity = 0.04
         # self.update_camera_vectors()
 
-        # High resolution heightmap image for smoother collision detection
-        self.hmap_file = "./../resources/map/hmap_2_mounds_4096px.png"
-        self.hmap_tex = np.asarray(Image.open(self.hmap_file).convert('RGB'))
+        # Shared heightfield for ground following (terrain collision detection)
+        self.heightfield = heightfield
 
     def process_keyboard_input(self, window, delta_time):
         camera_speed = 30 * delta_time
-        self.camera_pos[1] = self.scale_xz_to_hmap() + 3
+        if self.heightfield is not None:
+            # eye 4 units above the ground
+            self.camera_pos[1] = self.heightfield.height_at(self.camera_pos[0], self.camera_pos[2]) + 4
         # print(self.camera_pos[0], ", ", self.camera_pos[1], ", ", self.camera_pos[2])
         if glfw.get_key(window=window, key=glfw.KEY_W):
             temp = copy.deepcopy(self.camera_front)
@@ -95,26 +95,6 @@ class Camera:
                 self.camera_front[1] -= self.sensitivity
                 # self.camera_front = normalized(self.camera_front)
 
-    def scale_xz_to_hmap(self):
-        # Scale the current coordinates to the high resolution (4096px)
-        # heightmap's range.
-        # +500 offset because because our world (grass area) is from [-500 to +500]
-        x_coord = int(((self.camera_pos[2] + 500) / 1000) * self.hmap_tex.shape[0])
-        z_coord = int(((self.camera_pos[0] + 500) / 1000) * self.hmap_tex.shape[0])
-        height = self.get_height(x_coord, z_coord, self.hmap_tex)
-        return height
-
-    def get_height(self, x, z, image):
-        if x < 0 or x >= image.shape[0] or z < 0 or z >= image.shape[0]:
-            return 0
-        height = image[x, z, 0]
-        # [0 to 1] range
-        height /= 256
-        # [0 to MAX_HEIGHT] range
-        height *= 30
-
-        return height
-
     def get_camera_pos(self):
         return self.camera_pos
 
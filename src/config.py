@@ -9,6 +9,23 @@ from fog import FogColour
 fog_colour = FogColour()
 
 
+# Merge static meshes sharing shader, texture and material into single draws
+# (see batching.StaticBatcher), meshes under animated nodes are left alone
+static_batching = False
+
+# Pack same sized mesh textures into texture arrays (see texturepack), so
+# meshes using them bind one texture and batch together
+texture_arrays = False
+
+# Skip the scene graph subtrees and terrain tiles outside the view frustum
+# (see culling), nodes without bounds are always drawn
+frustum_culling = True
+
+# Stream the terrain in tiles generated around the camera (see streamedterrain)
+# instead of drawing the ChunkedTerrain, for worlds larger than one heightmap
+streamed_terrain = False
+
+
 # Enable/disable sound
 sound = True
 if sound==True:
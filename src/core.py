@@ -7,14 +7,19 @@ import random
 import math
 
 # External, non built-in modules
-from mesh import TexturedPhongMesh, TexturedPhongMeshSkinned
-from skinning import SkinningControlNode, MAX_VERTEX_BONES, MAX_BONES
-from texture import Texture
+from mesh import TexturedPhongMesh, TexturedPhongMeshSkinned, LODMesh, InstancedMesh
+from modelcache import import_scene
+from fileindex import find_file
+from skinning import SkinningControlNode, vertex_bones
+from texture import load_texture
+from vertexarray import mesh_layout
 from node import Node
-from texturedplane import TexturedPlane
+from terrain import ChunkedTerrain
+from streamedterrain import StreamedTerrain
 from keyframe import KeyFrameControlNode
-from procedural_anime import ProceduralAnimation
-from transform import quaternion, rotate, translate, scale, vec, quaternion_from_axis_angle
+from procedural_anime import ProceduralInstances
+from transform import quaternion, rotate, translate, scale, vec, quaternion_from_axis_angle, identity
+import config
 
 
 # --------------------------------------------------------
@@ -22,12 +27,33 @@ from transform import quaternion, rotate, translate, scale, vec, quaternion_from
 # (multi-textured, single textured, and skeletal-based)
 # --------------------------------------------------------
 
-def multi_load_textured(file, shader, tex_file, k_a, k_d, k_s, s):
-    """ load resources from file using assimp, return list of TexturedMesh """
+def geometry_key(file, flags, mesh_index):
+    """ key under which loaded meshes share their vertex arrays (see vertexarray.GEOMETRY) """
+    return os.path.abspath(file), int(flags), mesh_index
+
+
+def lod_mesh(mesh, lods, bounds, key, **arguments):
+    """ LODMesh of mesh (a TexturedPhongMesh) and TexturedPhongMeshes of its
+        coarser lods (see modelcache), sharing the arguments, or mesh if
+        there are none """
+    if not lods:
+        return mesh
+    levels = [mesh]
+    for level, lod in enumerate(lods, 1):
+        attributes = [lod.mVertices, lod.mTextureCoords[0], lod.mNormals]
+        levels.append(TexturedPhongMesh(attributes=attributes, faces=lod.mFaces, key=key + (level,),
+                                        layout=mesh_layout(attributes), **arguments))
+    return LODMesh(levels, [lod.error for lod in lods], *bounds)
+
+
+def multi_load_textured(file, shader, tex_file, k_a, k_d, k_s, s, instances=None):
+    """ load resources from file using assimp, return list of TexturedMesh,
+        or of InstancedMesh drawing them at each of the instances transforms
+        (shader must then be an instanced one) """
     try:
         pp = assimpcy.aiPostProcessSteps
         flags = pp.aiProcess_Triangulate | pp.aiProcess_FlipUVs
-        scene = assimpcy.aiImportFile(file, flags)
+        scene = import_scene(file, flags)  # cached, assimp only runs when file changed
     except assimpcy.all.AssimpError as exception:
         print('ERROR loading', file + ': ', exception.args[0].decode())
         return []
@@ -38,35 +64,43 @@ def multi_load_textured(file, shader, tex_file, k_a, k_d, k_s, s):
         if not tex_file and 'TEXTURE_BASE' in mat.properties:  # texture token
             name = os.path.basename(mat.properties['TEXTURE_BASE'])
             # search texture in file's whole subdir since path often screwed up
-            paths = os.walk(path, followlinks=True)
-            found = [os.path.join(d, f) for d, _, n in paths for f in n
-                     if name.startswith(f) or f.startswith(name)]
+            found = find_file(path, name)
             assert found, 'Cannot find texture %s in %s subtree' % (name, path)
-            tex_file = found[0]
+            tex_file = found
         if tex_file:
             # print("Index: ", index)
-            mat.properties['diffuse_map'] = Texture(tex_file=tex_file[index])
+            mat.properties['diffuse_map'] = load_texture(tex_file=tex_file[index])
 
     # prepare textured mesh
     meshes = []
-    for mesh in scene.mMeshes:
+    for mesh_index, mesh in enumerate(scene.mMeshes):
         mat = scene.mMaterials[mesh.mMaterialIndex].properties
         assert mat['diffuse_map'], "Trying to map using a textureless material"
         attributes = [mesh.mVertices, mesh.mTextureCoords[0], mesh.mNormals]
+        key = geometry_key(file, flags, mesh_index)
+        lods, bounds = mesh.lods, mesh.bounds
+        if instances is not None:
+            meshes.append(InstancedMesh(shader, mat['diffuse_map'], attributes, mesh.mFaces, instances,
+                                        k_d=k_d, k_a=k_a, k_s=k_s, s=s, key=key, layout=mesh_layout(attributes)))
+            continue
         mesh = TexturedPhongMesh(shader, mat['diffuse_map'], attributes, mesh.mFaces,
-                                 k_d=k_d, k_a=k_a, k_s=k_s, s=s)
-        meshes.append(mesh)
+                                 k_d=k_d, k_a=k_a, k_s=k_s, s=s, key=key,
+                                 layout=mesh_layout(attributes))
+        meshes.append(lod_mesh(mesh, lods, bounds, key, shader=shader, tex=mat['diffuse_map'],
+                               k_d=k_d, k_a=k_a, k_s=k_s, s=s))
 
     size = sum((mesh.mNumFaces for mesh in scene.mMeshes))
     # print('Loaded %s\t(%d meshes, %d faces)' % (file, len(meshes), size))
     return meshes
 
 
-def load_textured_phong_mesh(file, shader, tex_file, k_a, k_d, k_s, s):
+def load_textured_phong_mesh(file, shader, tex_file, k_a, k_d, k_s, s, instances=None):
+    """ load resources from file using assimp, return list of TexturedMesh,
+        or of InstancedMesh as in multi_load_textured """
     try:
         pp = assimpcy.aiPostProcessSteps
         flags = pp.aiProcess_Triangulate | pp.aiProcess_FlipUVs
-        scene = assimpcy.aiImportFile(file, flags)
+        scene = import_scene(file, flags)  # cached, assimp only runs when file changed
     except assimpcy.all.AssimpError as exception:
         print('ERROR loading', file + ': ', exception.args[0].decode())
         return []
@@ -77,23 +111,29 @@ def load_textured_phong_mesh(file, shader, tex_file, k_a, k_d, k_s, s):
         if not tex_file and 'TEXTURE_BASE' in mat.properties:  # texture token
             name = os.path.basename(mat.properties['TEXTURE_BASE'])
             # search texture in file's whole subdir since path often screwed up
-            paths = os.walk(path, followlinks=True)
-            found = [os.path.join(d, f) for d, _, n in paths for f in n
-                     if name.startswith(f) or f.startswith(name)]
+            found = find_file(path, name)
             assert found, 'Cannot find texture %s in %s subtree' % (name, path)
-            tex_file = found[0]
+            tex_file = found
         if tex_file:
-            mat.properties['diffuse_map'] = Texture(tex_file=tex_file)
+            mat.properties['diffuse_map'] = load_texture(tex_file=tex_file)
 
     meshes = []
-    for mesh in scene.mMeshes:
+    for mesh_index, mesh in enumerate(scene.mMeshes):
         mat = scene.mMaterials[mesh.mMaterialIndex].properties
         assert mat['diffuse_map'], "Trying to map using a textureless material"
         attributes = [mesh.mVertices, mesh.mTextureCoords[0], mesh.mNormals]
+        key = geometry_key(file, flags, mesh_index)
+        lods, bounds = mesh.lods, mesh.bounds
+        if instances is not None:
+            meshes.append(InstancedMesh(shader, mat['diffuse_map'], attributes, mesh.mFaces, instances,
+                                        k_d=k_d, k_a=k_a, k_s=k_s, s=s, key=key, layout=mesh_layout(attributes)))
+            continue
         mesh = TexturedPhongMesh(shader=shader, tex=mat['diffuse_map'], attributes=attributes,
                                  faces=mesh.mFaces,
-                                 k_d=k_d, k_a=k_a, k_s=k_s, s=s)
-        meshes.append(mesh)
+                                 k_d=k_d, k_a=k_a, k_s=k_s, s=s, key=key,
+                                 layout=mesh_layout(attributes))
+        meshes.append(lod_mesh(mesh, lods, bounds, key, shader=shader, tex=mat['diffuse_map'],
+                               k_d=k_d, k_a=k_a, k_s=k_s, s=s))
 
         size = sum((mesh.mNumFaces for mesh in scene.mMeshes))
         # print('Loaded %s\t(%d meshes, %d faces)' % (file, len(meshes), size))
@@ -104,7 +144,7 @@ def load_textured_phong_mesh_skinned(file, shader, tex_file, k_a, k_d, k_s, s, d
     try:
         pp = assimpcy.aiPostProcessSteps
         flags = pp.aiProcess_Triangulate | pp.aiProcess_GenSmoothNormals
-        scene = assimpcy.aiImportFile(file, flags)
+        scene = import_scene(file, flags)  # cached, assimp only runs when file changed
     except assimpcy.all.AssimpError as exception:
         print('ERROR loading', file + ': ', exception.args[0].decode())
         return []
@@ -115,18 +155,17 @@ def load_textured_phong_mesh_skinned(file, shader, tex_file, k_a, k_d, k_s, s, d
         if not tex_file and 'TEXTURE_BASE' in mat.properties:  # texture token
             name = os.path.basename(mat.properties['TEXTURE_BASE'])
             # search texture in file's whole subdir since path often screwed up
-            paths = os.walk(path, followlinks=True)
-            found = [os.path.join(d, f) for d, _, n in paths for f in n
-                     if name.startswith(f) or f.startswith(name)]
+            found = find_file(path, name)
             assert found, 'Cannot find texture %s in %s subtree' % (name, path)
-            tex_file = found[0]
+            tex_file = found
         if tex_file:
-            mat.properties['diffuse_map'] = Texture(tex_file=tex_file)
+            mat.properties['diffuse_map'] = load_texture(tex_file=tex_file)
 
     # ----- load animations
-    def conv(assimp_keys, ticks_per_second):
-        """ Conversion from assimp key struct to our dict representation """
-        return {key.mTime / ticks_per_second: key.mValue for key in assimp_keys}
+    def conv(keys, ticks_per_second):
+        """ Conversion from (times, values) key arrays to our dict representation """
+        times, values = keys
+        return {time / ticks_per_second: value for time, value in zip(times.tolist(), values)}
 
     # load first animation in scene file (could be a loop over all animations)
     transform_keyframes = {}
@@ -135,9 +174,9 @@ def load_textured_phong_mesh_skinned(file, shader, tex_file, k_a, k_d, k_s, s, d
         for channel in anim.mChannels:
             # for each animation bone, store TRS dict with {times: transforms}
             transform_keyframes[channel.mNodeName] = (
-                conv(channel.mPositionKeys, anim.mTicksPerSecond),
-                conv(channel.mRotationKeys, anim.mTicksPerSecond),
-                conv(channel.mScalingKeys, anim.mTicksPerSecond)
+                conv(channel.position_keys, anim.mTicksPerSecond),
+                conv(channel.rotation_keys, anim.mTicksPerSecond),
+                conv(channel.scaling_keys, anim.mTicksPerSecond)
             )
 
     # ---- prepare scene graph nodes
@@ -162,16 +201,9 @@ def load_textured_phong_mesh_skinned(file, shader, tex_file, k_a, k_d, k_s, s, d
 
     # ---- create SkinnedMesh objects
     for mesh_id, mesh in enumerate(scene.mMeshes):
-        # -- skinned mesh: weights given per bone => convert per vertex for GPU
-        # first, populate an array with MAX_BONES entries per vertex
-        v_bone = np.array([[(0, 0)] * MAX_BONES] * mesh.mNumVertices,
-                          dtype=[('weight', 'f4'), ('id', 'u4')])
-        for bone_id, bone in enumerate(mesh.mBones[:MAX_BONES]):
-            for entry in bone.mWeights:  # weight,id pairs necessary for sorting
-                v_bone[entry.mVertexId][bone_id] = (entry.mWeight, bone_id)
-
-        v_bone.sort(order='weight')  # sort rows, high weights last
-        v_bone = v_bone[:, -MAX_VERTEX_BONES:]  # limit bone size, keep highest
+        # -- skinned mesh: weights given per bone => convert per vertex for GPU,
+        # keeping the MAX_VERTEX_BONES highest weights of each vertex
+        bone_ids, bone_weights = vertex_bones(mesh.mBones, mesh.mNumVertices)
 
         # prepare bone lookup array & offset matrix, indexed by bone index (id)
         bone_nodes = [nodes[bone.mName] for bone in mesh.mBones]
@@ -182,13 +214,14 @@ def load_textured_phong_mesh_skinned(file, shader, tex_file, k_a, k_d, k_s, s, d
         # assert mat['diffuse_map'], "Trying to map using a textureless material"
 
     # meshes = []
-    for mesh in scene.mMeshes:
+    for mesh_index, mesh in enumerate(scene.mMeshes):
         mat = scene.mMaterials[mesh.mMaterialIndex].properties
         assert mat['diffuse_map'], "Trying to map using a textureless material"
-        attributes = [mesh.mVertices, mesh.mTextureCoords[0], mesh.mNormals, v_bone['id'], v_bone['weight']]
+        attributes = [mesh.mVertices, mesh.mTextureCoords[0], mesh.mNormals, bone_ids, bone_weights]
         mesh = TexturedPhongMeshSkinned(shader=shader, tex=mat['diffuse_map'], attributes=attributes,
                                         faces=mesh.mFaces, bone_nodes=bone_nodes, bone_offsets=bone_offsets,
-                                        k_d=k_d, k_a=k_a, k_s=k_s, s=s)
+                                        k_d=k_d, k_a=k_a, k_s=k_s, s=s, key=geometry_key(file, flags, mesh_index),
+                                        layout=mesh_layout(attributes))
         # meshes.append(mesh)
 
         for node in nodes_per_mesh_id[mesh_id]:
@@ -413,37 +446,25 @@ def build_graveyard(viewer, shader):
     viewer.add(angelofdeath_node)
 
 
-def build_tree(viewer, shader):
-    # Pathway trees
+def build_tree(viewer, shader, instanced_shader):
+    # Pathway trees, on both sides of the path, drawn instanced
     tex_list = ["./../resources/nature/tree/CommonTree/bark_decidious.jpg",
                 "./../resources/nature/tree/CommonTree/leaves_256px.jpg"]
     tree_size = 4.0
-    for i in range(-70, 100, 40):
-        tree_node = Node(
-            transform=translate(10, -1, i) @ scale(tree_size, tree_size, tree_size) @ rotate((1, 0, 0), -90))
-        mesh_list = multi_load_textured(file="./../resources/nature/tree/CommonTree/CommonTree_1.fbx", shader=shader,
-                                        tex_file=tex_list,
-                                        k_a=(.4, .4, .4),
-                                        k_d=(1.2, 1.2, 1.2),
-                                        k_s=(.2, .2, .2),
-                                        s=4
-                                        )
-        for mesh in mesh_list:
-            tree_node.add(mesh)
-        viewer.add(tree_node)
-
-        tree_node = Node(
-            transform=translate(-10, -1, i) @ scale(tree_size, tree_size, tree_size) @ rotate((1, 0, 0), -90))
-        mesh_list = multi_load_textured(file="./../resources/nature/tree/CommonTree/CommonTree_1.fbx", shader=shader,
-                                        tex_file=tex_list,
-                                        k_a=(.4, .4, .4),
-                                        k_d=(1.2, 1.2, 1.2),
-                                        k_s=(.2, .2, .2),
-                                        s=4
-                                        )
-        for mesh in mesh_list:
-            tree_node.add(mesh)
-        viewer.add(tree_node)
+    tree_transforms = [translate(x_pos, -1, i) @ scale(tree_size, tree_size, tree_size) @ rotate((1, 0, 0), -90)
+                       for i in range(-70, 100, 40) for x_pos in [10, -10]]
+    tree_node = Node()
+    mesh_list = multi_load_textured(file="./../resources/nature/tree/CommonTree/CommonTree_1.fbx",
+                                    shader=instanced_shader,
+                                    tex_file=tex_list,
+                                    k_a=(.4, .4, .4),
+                                    k_d=(1.2, 1.2, 1.2),
+                                    k_s=(.2, .2, .2),
+                                    s=4, instances=tree_transforms
+                                    )
+    for mesh in mesh_list:
+        tree_node.add(mesh)
+    viewer.add(tree_node)
 
     # Rocks
     rock_node = Node(
@@ -460,7 +481,7 @@ def build_tree(viewer, shader):
     viewer.add(rock_node)
 
 
-def build_castle(viewer, shader):
+def build_castle(viewer, shader, instanced_shader):
     # Castle
     # Load castle's multiple textures one by one
     tex_list = ["./../resources/castle/Texture/Castle Exterior Texture.jpg",
@@ -479,21 +500,22 @@ def build_castle(viewer, shader):
         castle_node.add(mesh)
     viewer.add(castle_node)
 
-    # Wall cannon (low poly cannon)
-    for x_pos in [29.4, 17.9, 6.7, -4.5, -15.6, -27]:
-        cannon_3_node = Node(
-            transform=translate(x_pos, 16, 158) @ scale(.03, .03, .03) @ rotate((0, 1, 0), 180))
-        mesh_list = load_textured_phong_mesh(file="./../resources/cannon/Cannon_3/low-poly-cannon.fbx", shader=shader,
-                                             tex_file="./../resources/cannon/Cannon_3/Textures/plate.jpg",
-                                             k_a=(.5, .5, .5),
-                                             k_d=(1, 1, 1),
-                                             k_s=(.1, .1, .1),
-                                             s=64
-                                             )
-
-        for mesh in mesh_list:
-            cannon_3_node.add(mesh)
-        viewer.add(cannon_3_node)
+    # Wall cannon (low poly cannon), drawn instanced
+    cannon_3_node = Node()
+    mesh_list = load_textured_phong_mesh(file="./../resources/cannon/Cannon_3/low-poly-cannon.fbx",
+                                         shader=instanced_shader,
+                                         tex_file="./../resources/cannon/Cannon_3/Textures/plate.jpg",
+                                         k_a=(.5, .5, .5),
+                                         k_d=(1, 1, 1),
+                                         k_s=(.1, .1, .1),
+                                         s=64,
+                                         instances=[translate(x_pos, 16, 158) @ scale(.03, .03, .03) @
+                                                    rotate((0, 1, 0), 180)
+                                                    for x_pos in [29.4, 17.9, 6.7, -4.5, -15.6, -27]]
+                                         )
+    for mesh in mesh_list:
+        cannon_3_node.add(mesh)
+    viewer.add(cannon_3_node)
 
     # Ground cannon (Cannon_3)
     tex_list2 = ["./../resources/cannon/Cannon_3/Textures/body_wood.jpg",
@@ -503,38 +525,38 @@ def build_castle(viewer, shader):
                  "./../resources/cannon/Cannon_3/Textures/body_wood.jpg",
                  "./../resources/cannon/Cannon_3/Textures/body_wood.jpg"
                  ]
-    for x_pos in [30, 15, -15, -30]:
-        cannon_3_node = Node(
-            transform=translate(x_pos, -1, 145) @ scale(3, 3, 3) @ rotate((0, 1, 0), 90))
-        mesh_list = multi_load_textured(file="./../resources/cannon/Cannon_3/cannon_3_reduced.obj", shader=shader,
-                                        tex_file=tex_list2,
-                                        k_a=(.5, .5, .5),
-                                        k_d=(1, 1, 1),
-                                        k_s=(.1, .1, .1),
-                                        s=64
-                                        )
-
-        for mesh in mesh_list:
-            cannon_3_node.add(mesh)
-        viewer.add(cannon_3_node)
+    cannon_3_node = Node()
+    mesh_list = multi_load_textured(file="./../resources/cannon/Cannon_3/cannon_3_reduced.obj",
+                                    shader=instanced_shader,
+                                    tex_file=tex_list2,
+                                    k_a=(.5, .5, .5),
+                                    k_d=(1, 1, 1),
+                                    k_s=(.1, .1, .1),
+                                    s=64,
+                                    instances=[translate(x_pos, -1, 145) @ scale(3, 3, 3) @ rotate((0, 1, 0), 90)
+                                               for x_pos in [30, 15, -15, -30]]
+                                    )
+    for mesh in mesh_list:
+        cannon_3_node.add(mesh)
+    viewer.add(cannon_3_node)
 
     # Tower Cannon (Cannon_1)
-    for x_pos in [46, -45]:
-        cannon_1_node = Node(
-            transform=translate(x_pos, 17, 151) @ scale(1, 1, 1) @ rotate((0, 1, 0), 180))
-        mesh_list = load_textured_phong_mesh(file="./../resources/cannon/Cannon_1/cannon_2.obj", shader=shader,
-                                             tex_file="./../resources/cannon/Cannon_1/cannon_1_texture.jpg",
-                                             k_a=(.4, .4, .4),
-                                             k_d=(1.2, 1.2, 1.2),
-                                             k_s=(.2, .2, .2),
-                                             s=4
-                                             )
-        for mesh in mesh_list:
-            cannon_1_node.add(mesh)
-        viewer.add(cannon_1_node)
+    cannon_1_node = Node()
+    mesh_list = load_textured_phong_mesh(file="./../resources/cannon/Cannon_1/cannon_2.obj", shader=instanced_shader,
+                                         tex_file="./../resources/cannon/Cannon_1/cannon_1_texture.jpg",
+                                         k_a=(.4, .4, .4),
+                                         k_d=(1.2, 1.2, 1.2),
+                                         k_s=(.2, .2, .2),
+                                         s=4,
+                                         instances=[translate(x_pos, 17, 151) @ scale(1, 1, 1) @ rotate((0, 1, 0), 180)
+                                                    for x_pos in [46, -45]]
+                                         )
+    for mesh in mesh_list:
+        cannon_1_node.add(mesh)
+    viewer.add(cannon_1_node)
 
 
-def build_terrain(viewer, shader):
+def build_terrain(viewer, shader, heightfield):
     # Grass, pavement and soil
 
     background_texture_file = "./../resources/textures/grass.png"
@@ -542,10 +564,17 @@ def build_terrain(viewer, shader):
     road2_texture_file = "./../resources/textures/fertile-loam-soil.jpg"
     blendmap_file = "./../resources/map/blend_map_t_point_local_road.png"
 
-    grass_node = Node(transform=translate(-500, -1, -500) @ rotate((1, 0, 0), 0))
-    plane = TexturedPlane(background_texture_file, road_texture_file, road2_texture_file,
-                          blendmap_file, shader, size=1000,
-                          hmap_file="./../resources/map/hmap_2_mounds_256px.png")
+    if config.streamed_terrain:
+        # tiles generated around the camera, in world coordinates (shader must be the shaders/terrain.vert one)
+        viewer.add(StreamedTerrain(background_texture_file, road_texture_file, road2_texture_file,
+                                   blendmap_file, shader, heightfield=heightfield))
+        return
+
+    # Render a 1025 x 1025 vertex grid (16 x 16 tiles) resampled from the shared heightfield,
+    # uploaded as heights only (shader must be the shaders/terrain_heights.vert one)
+    grass_node = Node(transform=translate(*heightfield.origin) @ rotate((1, 0, 0), 0))
+    plane = ChunkedTerrain(background_texture_file, road_texture_file, road2_texture_file,
+                           blendmap_file, shader, heightfield=heightfield, resolution=1025, height_only=True)
     grass_node.add(plane)
     viewer.add(grass_node)
 
@@ -643,7 +672,7 @@ def add_characters(viewer, shader):
     viewer.add(keyframe_templar_node)
 
 
-def add_animations(viewer, shader):
+def add_animations(viewer, shader, instanced_shader):
     # Key Frame animation for Tower Cannon Ball (Cannon_1)
     translate_keys = {0: vec(-48, 0, 30), 4: vec(-48, 19, 148)}
     rotate_keys = {0: quaternion(), 4: quaternion()}
@@ -674,70 +703,41 @@ def add_animations(viewer, shader):
         transformation = translate(x, y, z) @ rotate((0, 1, 0), angle)
         return transformation
 
-    # Bird
+    # Birds, drawn instanced, each instance moved along its own circle
+    bird_arguments = []
     for i in range(5):
         radius = int(random.randrange(start=10, stop=100, step=10))
         x_offset = int(random.randrange(start=10, stop=50, step=5))
         y_offset = int(random.randrange(start=0, stop=10, step=2))
         z_offset = int(random.randrange(start=10, stop=50, step=5))
         direction = int(random.randrange(start=0, stop=2, step=1))
+        bird_arguments.append((radius, x_offset, y_offset, z_offset, direction))
 
-        bird_node = ProceduralAnimation(circular_motion,
-                                        radius=radius,
-                                        x_offset=x_offset,
-                                        y_offset=y_offset,
-                                        z_offset=z_offset,
-                                        direction=direction)
-        mesh_list = load_textured_phong_mesh(file="./../resources/bird/Bird_2.obj", shader=shader,
-                                             tex_file="./../resources/bird/black.jpg",
-                                             k_a=(.4, .4, .4),
-                                             k_d=(1.2, 1.2, 1.2),
-                                             k_s=(.2, .2, .2),
-                                             s=4
-                                             )
-        for mesh in mesh_list:
-            bird_node.add(mesh)
-        viewer.add(bird_node)
-
-
-def add_lamps(viewer, shader):
-    # Lamp 1
-    lamp_node = Node(
-        transform=translate(10, -1, -10) @ scale(0.7, 0.7, 0.7))
-    lamp_mesh_list = load_textured_phong_mesh(file="./../resources/lamp/lamp_ThinMatrix.obj", shader=shader,
-                                              tex_file="./../resources/lamp/lamp_ThinMatrix_bnw.jpeg",
-                                              k_a=(.1, .1, .1),
-                                              k_d=(5, 5, 5),
-                                              k_s=(.1, .1, .1),
-                                              s=2
-                                              )
-    for mesh in lamp_mesh_list:
-        lamp_node.add(mesh)
-    viewer.add(lamp_node)
+    bird_node = ProceduralInstances(circular_motion, bird_arguments)
+    mesh_list = load_textured_phong_mesh(file="./../resources/bird/Bird_2.obj", shader=instanced_shader,
+                                         tex_file="./../resources/bird/black.jpg",
+                                         k_a=(.4, .4, .4),
+                                         k_d=(1.2, 1.2, 1.2),
+                                         k_s=(.2, .2, .2),
+                                         s=4, instances=[identity()] * len(bird_arguments)
+                                         )
+    for mesh in mesh_list:
+        bird_node.add(mesh)
+    viewer.add(bird_node)
 
-    # Lamp 2
-    lamp_node = Node(
-        transform=translate(15, -1, 55) @ scale(0.7, 0.7, 0.7))
-    lamp_mesh_list = load_textured_phong_mesh(file="./../resources/lamp/lamp_ThinMatrix.obj", shader=shader,
-                                              tex_file="./../resources/lamp/lamp_ThinMatrix_bnw.jpeg",
-                                              k_a=(.1, .1, .1),
-                                              k_d=(5, 5, 5),
-                                              k_s=(.1, .1, .1),
-                                              s=2
-                                              )
-    for mesh in lamp_mesh_list:
-        lamp_node.add(mesh)
-    viewer.add(lamp_node)
 
-    # Graveyard lamp
-    lamp_node = Node(
-        transform=translate(-60, -1, -30) @ scale(0.7, 0.7, 0.7))
-    lamp_mesh_list = load_textured_phong_mesh(file="./../resources/lamp/lamp_ThinMatrix.obj", shader=shader,
+def add_lamps(viewer, shader, instanced_shader):
+    # Lamps near the houses (1, 2) and in the graveyard, drawn instanced
+    lamp_node = Node()
+    lamp_mesh_list = load_textured_phong_mesh(file="./../resources/lamp/lamp_ThinMatrix.obj", shader=instanced_shader,
                                               tex_file="./../resources/lamp/lamp_ThinMatrix_bnw.jpeg",
                                               k_a=(.1, .1, .1),
                                               k_d=(5, 5, 5),
                                               k_s=(.1, .1, .1),
-                                              s=2
+                                              s=2,
+                                              instances=[translate(10, -1, -10) @ scale(0.7, 0.7, 0.7),
+                                                         translate(15, -1, 55) @ scale(0.7, 0.7, 0.7),
+                                                         translate(-60, -1, -30) @ scale(0.7, 0.7, 0.7)]
                                               )
     for mesh in lamp_mesh_list:
         lamp_node.add(mesh)
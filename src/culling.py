@@ -0,0 +1,110 @@
+"""
+Hierarchical view frustum culling.
+
+Once the scene is built, compute_bounds() gives every node the Bounds of
+what it draws, in the frame of the model matrix it is drawn with: leaves
+from their vertices (see mesh and terrain), plain Nodes from the union of
+their children's, moved by their transform. Nodes whose transform changes
+every frame (see batching.ANIMATED) keep no bounds, and neither do their
+ancestors, but the static subtrees below them do. Each frame, the Viewer
+extracts the frustum planes of projection @ view into CULLING, and
+Node.draw skips the children whose bounding sphere, then box, is outside.
+"""
+# External, non built-in modules
+import numpy as np
+
+
+class Bounds:
+    """ Axis aligned box (low, high corners) and bounding sphere (center of
+        the box, radius) of some geometry """
+
+    def __init__(self, low, high, radius=None):
+        self.low, self.high = np.asarray(low, np.float64), np.asarray(high, np.float64)
+        self.center, self.extent = (self.low + self.high) / 2, (self.high - self.low) / 2
+        self.radius = float(np.linalg.norm(self.extent)) if radius is None else radius
+
+    def transformed(self, matrix):
+        """ Bounds of the box moved by a 4x4 matrix """
+        corners = self.center + self.extent * np.array([[x, y, z] for x in (-1, 1) for y in (-1, 1) for z in (-1, 1)])
+        moved = corners @ matrix[:3, :3].T + matrix[:3, 3]
+        return Bounds(moved.min(axis=0), moved.max(axis=0))
+
+
+def vertex_bounds(vertices):
+    """ Bounds of an array of positions, None if empty """
+    vertices = np.asarray(vertices, np.float64).reshape(-1, 3)
+    if not len(vertices):
+        return None
+    bounds = Bounds(vertices.min(axis=0), vertices.max(axis=0))
+    bounds.radius = float(np.linalg.norm(vertices - bounds.center, axis=1).max())  # tighter than the box's
+    return bounds
+
+
+def union(all_bounds):
+    """ Bounds enclosing all of them, None if one of them is unknown """
+    if not all_bounds or any(bounds is None for bounds in all_bounds):
+        return None
+    return Bounds(np.min([bounds.low for bounds in all_bounds], axis=0),
+                  np.max([bounds.high for bounds in all_bounds], axis=0))
+
+
+def compute_bounds(node):
+    """ set the bounds of node and of its descendants, and return them.
+        Leaves keep the bounds they computed at load time. """
+    from batching import ANIMATED  # only needed here
+    from node import Node
+    children = [compute_bounds(child) for child in getattr(node, 'children', ())]
+    if isinstance(node, ANIMATED):
+        node.bounds = None  # moves every frame
+    elif type(node) is Node:
+        merged = union(children)
+        node.bounds = merged and merged.transformed(node.transform)
+    return getattr(node, 'bounds', None)
+
+
+def frustum_planes(clip):
+    """ 6 planes (a, b, c, d) of the frustum of a clip matrix (projection @
+        view), normals pointing inside and normalized: points (x, y, z) are
+        inside when a x + b y + c z + d >= 0 for all of them """
+    planes = np.array([clip[3] + clip[0], clip[3] - clip[0], clip[3] + clip[1],
+                       clip[3] - clip[1], clip[3] + clip[2], clip[3] - clip[2]], np.float64)
+    return planes / np.linalg.norm(planes[:, :3], axis=1, keepdims=True)
+
+
+def box_outside(planes, center, extent):
+    """ True if the box (center, half extents) is entirely outside a plane """
+    return bool(np.any(planes[:, :3] @ center + planes[:, 3] + np.abs(planes[:, :3]) @ extent < 0))
+
+
+class Culler:
+    """ View frustum of the frame being drawn and culled / drawn counters """
+
+    def __init__(self):
+        self.planes = None  # no culling
+        self.drawn = self.culled = self.tiles_drawn = self.tiles_culled = 0
+
+    def begin(self, clip=None):
+        """ cull the next frame against the frustum of clip, if any """
+        self.planes = None if clip is None else frustum_planes(clip)
+        self.drawn = self.culled = self.tiles_drawn = self.tiles_culled = 0
+
+    def visible(self, node, model):
+        """ whether node, drawn with the model matrix, may be in view """
+        bounds = getattr(node, 'bounds', None)
+        if self.planes is not None and bounds is not None:
+            center = model[:3, :3] @ bounds.center + model[:3, 3]
+            distances = self.planes[:, :3] @ center + self.planes[:, 3]
+            radius = bounds.radius * np.linalg.norm(model[:3, :3], axis=0).max()
+            if np.any(distances < -radius) or (np.any(distances < radius) and
+                                               box_outside(self.planes, center, np.abs(model[:3, :3]) @ bounds.extent)):
+                self.culled += 1
+                return False
+        self.drawn += 1
+        return True
+
+    def report(self):
+        return 'Culling: %d nodes drawn, %d culled, %d terrain tiles drawn, %d culled' % (
+            self.drawn, self.culled, self.tiles_drawn, self.tiles_culled)
+
+
+CULLING = Culler()  # frustum of the frame the Viewer is drawing
@@ -0,0 +1,85 @@
+"""
+Index of the files under a directory, for the texture lookups of the model
+loaders: materials name their texture loosely (another path, a truncated
+or extended name), so the loaders search the model's whole subtree for a
+file whose name is a prefix of the wanted one or the other way around.
+The subtree is scanned once into a name -> paths dictionary and a sorted
+name list, lookups are then dictionary hits and a bisection. An index is
+rebuilt when one of its directories changed (files added, removed or
+renamed change their directory's mtime), checked at most every max_age
+seconds.
+"""
+# Python built-in modules
+import bisect
+import os
+import threading
+import time
+
+
+class FileIndex:
+    """ Files of the root directory subtree, in os.walk order """
+
+    def __init__(self, root, max_age=1.0):
+        self.root = os.path.normpath(root)
+        self.max_age = max_age
+        self.build()
+
+    def build(self):
+        self.paths = {}  # file name -> [(walk order, path)]
+        self.directories = {}  # directory -> mtime when indexed
+        order = 0
+        for directory, _, names in os.walk(self.root, followlinks=True):
+            self.directories[directory] = os.stat(directory).st_mtime_ns
+            for name in names:
+                self.paths.setdefault(name, []).append((order, os.path.join(directory, name)))
+                order += 1
+        self.names = sorted(self.paths)
+        self.checked = time.monotonic()
+
+    def refresh(self):
+        """ rebuild the index if a directory changed since it was built """
+        if time.monotonic() - self.checked < self.max_age:
+            return
+        self.checked = time.monotonic()
+        for directory, mtime in self.directories.items():
+            try:
+                changed = os.stat(directory).st_mtime_ns != mtime
+            except OSError:
+                changed = True
+            if changed:
+                self.build()
+                return
+
+    def find(self, name, within=None):
+        """ first file in walk order (optionally below directory `within`)
+            whose name is a prefix of name or starts with name, None if none """
+        self.refresh()
+        candidates = [path for length in range(1, len(name) + 1) for path in self.paths.get(name[:length], ())]
+        start = bisect.bisect_left(self.names, name)
+        for file_name in self.names[start:]:
+            if not file_name.startswith(name):
+                break
+            candidates.extend(self.paths[file_name])
+        if within is not None and os.path.normpath(within) != self.root:
+            prefix = os.path.join(os.path.normpath(within), '')
+            candidates = [(order, path) for order, path in candidates if path.startswith(prefix)]
+        return min(candidates)[1] if candidates else None
+
+
+_indices = {}  # root directory -> FileIndex
+_lock = threading.Lock()
+
+
+def find_file(root, name):
+    """ Path of the first file of the root subtree (os.walk order) whose
+        name is a prefix of name or starts with it, None if there is none.
+        Indices are shared: a root already covered by the index of one of
+        its parents is looked up in that index. """
+    root = os.path.normpath(root)
+    with _lock:
+        index = _indices.get(root)
+        if index is None:
+            parents = [index for index_root, index in _indices.items()
+                       if root.startswith(os.path.join(index_root, ''))]
+            index = _indices[root] = max(parents, key=lambda parent: len(parent.root)) if parents else FileIndex(root)
+        return index.find(name, within=root)
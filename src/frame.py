@@ -0,0 +1,56 @@
+"""
+Per-frame uniform buffer.
+
+The view and projection matrices, camera position, fog colour and lights
+are the same for every object of a frame. Rather than uploading them per
+mesh, the shaders declare them in the std140 uniform block Frame (same
+declaration at the top of each of them), filled once per frame by
+Viewer.run through FrameUniforms.update. Shader binds its Frame block to
+FRAME_BINDING, where FrameUniforms keeps its buffer.
+"""
+# External, non built-in modules
+import OpenGL.GL as GL
+import numpy as np
+
+from shader import UNIFORM_BLOCKS
+import config
+
+NUM_LIGHT_SRC = 4  # as in the shaders
+FRAME_BINDING = UNIFORM_BLOCKS['Frame']
+
+# std140 layout of the Frame block, row_major so numpy matrices go as they are:
+# vec3 take 16 bytes as members and as array elements
+FRAME_LAYOUT = np.dtype({'names': ['view', 'projection', 'w_camera_position', 'fog_colour',
+                                   'light_position', 'atten_factor'],
+                         'formats': [(np.float32, (4, 4)), (np.float32, (4, 4)), (np.float32, 3), (np.float32, 3),
+                                     (np.float32, (NUM_LIGHT_SRC, 4)), (np.float32, (NUM_LIGHT_SRC, 4))],
+                         'offsets': [0, 64, 128, 144, 160, 160 + 16 * NUM_LIGHT_SRC],
+                         'itemsize': 160 + 32 * NUM_LIGHT_SRC})
+
+
+class FrameUniforms:
+    """ Uniform buffer holding the Frame block of the shaders, bound to
+        FRAME_BINDING, to be created and updated on the GL thread """
+
+    def __init__(self):
+        self.data = np.zeros(1, FRAME_LAYOUT)
+        self.glid = GL.glGenBuffers(1)
+        GL.glBindBuffer(GL.GL_UNIFORM_BUFFER, self.glid)
+        GL.glBufferData(GL.GL_UNIFORM_BUFFER, FRAME_LAYOUT.itemsize, None, GL.GL_DYNAMIC_DRAW)
+        GL.glBindBufferBase(GL.GL_UNIFORM_BUFFER, FRAME_BINDING, self.glid)
+        GL.glBindBuffer(GL.GL_UNIFORM_BUFFER, 0)
+
+    def update(self, projection, view):
+        """ camera of this frame, fog colour and lights from config.fog_colour """
+        self.data['view'], self.data['projection'] = view, projection
+        self.data['w_camera_position'] = np.linalg.inv(view)[:3, 3]
+        self.data['fog_colour'] = config.fog_colour.get_colour()
+        count = config.fog_colour.num_light_src
+        self.data['light_position'][0, :count, :3] = config.fog_colour.light_pos[:count]
+        self.data['atten_factor'][0, :count, :3] = config.fog_colour.get_atten()[:count]
+        GL.glBindBuffer(GL.GL_UNIFORM_BUFFER, self.glid)
+        GL.glBufferSubData(GL.GL_UNIFORM_BUFFER, 0, FRAME_LAYOUT.itemsize, self.data)
+        GL.glBindBuffer(GL.GL_UNIFORM_BUFFER, 0)
+
+    def __del__(self):
+        GL.glDeleteBuffers(1, [self.glid])
@@ -0,0 +1,260 @@
+import math
+import os
+
+import numpy as np
+from PIL import Image
+
+from cache import ArrayCache, cache_key, file_digest
+
+
+# -------------- Heightfield shared by terrain, camera and object placement ---
+class HeightField:
+    """ Single channel heightmap covering extent x extent world units, with
+        its (0, 0) pixel at world position origin. Pixels are kept as the
+        source uint8 grid (memory mapped from the on-disk cache when mmap is
+        set, so only the first run decodes the image) and scaled on lookup:
+        height = origin_y + pixel / max_pixel_color * max_height.
+        Row i of the image runs along world z, column j along world x. """
+
+    def __init__(self, hmap_file, extent=1000, origin=(0, 0, 0), max_height=30, max_pixel_color=256,
+                 mmap=True):
+        self.hmap_file = hmap_file
+        self.extent = extent
+        self.origin = np.array(origin, np.float64)
+        self.max_height = max_height
+        self.max_pixel_color = max_pixel_color
+        self.digest = file_digest(hmap_file)
+
+        if mmap:
+            cache = ArrayCache('HeightField-%s' % os.path.splitext(os.path.basename(hmap_file))[0])
+            self.pixels = cache.get(cache_key(self.digest), self.decode)['pixels']
+        else:
+            self.pixels = self.decode()['pixels']
+        self.size = self.pixels.shape[0]
+        self.spacing = extent / (self.size - 1)
+        self._pyramid = None
+
+    def decode(self):
+        """ first channel of the heightmap image, the only one we use """
+        image = Image.open(self.hmap_file)
+        channel = image.convert('L') if image.mode == 'P' else image.getchannel(0)
+        return {'pixels': np.asarray(channel, np.uint8)}
+
+    def grid(self, resolution=None):
+        """ resolution x resolution map of heights (without origin_y), the
+            raw pixels when resolution is the image size, else resampled """
+        if resolution is None or resolution == self.size:
+            return self.pixels / self.max_pixel_color * self.max_height
+        steps = np.arange(resolution) * (self.extent / (resolution - 1))
+        xs, zs = np.meshgrid(steps + self.origin[0], steps + self.origin[2])
+        return self.heights_at(xs, zs) - self.origin[1]
+
+    def heights_at(self, xs, zs):
+        """ bilinear interpolated world heights at arrays of world x, z
+            positions, origin_y outside of the map """
+        col = (np.asarray(xs, np.float64) - self.origin[0]) / self.spacing
+        row = (np.asarray(zs, np.float64) - self.origin[2]) / self.spacing
+        inside = (col >= 0) & (col <= self.size - 1) & (row >= 0) & (row <= self.size - 1)
+        col, row = np.clip(col, 0, self.size - 1), np.clip(row, 0, self.size - 1)
+        col0 = np.minimum(col.astype(np.intp), self.size - 2)
+        row0 = np.minimum(row.astype(np.intp), self.size - 2)
+        fcol, frow = col - col0, row - row0
+
+        pixels = self.pixels
+        top = pixels[row0, col0] * (1 - fcol) + pixels[row0, col0 + 1] * fcol
+        bottom = pixels[row0 + 1, col0] * (1 - fcol) + pixels[row0 + 1, col0 + 1] * fcol
+        heights = (top * (1 - frow) + bottom * frow) / self.max_pixel_color * self.max_height
+        return self.origin[1] + np.where(inside, heights, 0)
+
+    def height_at(self, x, z):
+        """ bilinear interpolated world height at a single world x, z """
+        return float(self.heights_at(x, z))
+
+    @property
+    def pyramid(self):
+        """ min/max pyramid for ray queries, built on first use """
+        if self._pyramid is None:
+            self._pyramid = HeightPyramid(self)
+        return self._pyramid
+
+    def intersect_ray(self, origin, direction, max_distance=np.inf):
+        """ distance (in direction lengths) to the first terrain hit, None on a miss """
+        return self.pyramid.intersect(origin, direction, max_distance)
+
+    def intersect_rays(self, origins, directions, max_distance=np.inf):
+        """ intersect_ray for (n, 3) arrays of rays, inf where they miss """
+        return self.pyramid.intersect_many(origins, directions, max_distance)
+
+
+# -------------- Min/max pyramid for ray queries ------------------------------
+class HeightPyramid:
+    """ Hierarchical min/max of a HeightField: level 0 holds the lowest and
+        highest corner of every pixel cell, level l + 1 the bounds of 2 x 2
+        cells of level l, up to a single cell over the whole map.
+        Rays march through it top down, skipping every cell they pass above
+        and only testing the bilinear surface of the level 0 cells they come
+        close to, so a query takes O(log n) steps on typical terrain.
+        Rays are solved in grid space: x, z in pixels, y in pixel values. A
+        ray hits where it first reaches or goes below the surface inside the
+        map (a ray starting underground hits at distance 0). """
+
+    def __init__(self, heightfield):
+        self.heightfield = heightfield
+        self.pixels = pixels = heightfield.pixels
+        self.cells = pixels.shape[0] - 1  # cells per side at level 0
+
+        def reduce(function, grid):  # 2 x 2 blocks of samples or cells
+            return function(function(grid[0::2, 0::2], grid[0::2, 1::2]), function(grid[1::2, 0::2], grid[1::2, 1::2]))
+
+        # level 0 cells are the 2 x 2 blocks of pixels starting at every pixel
+        low = np.minimum(np.minimum(pixels[:-1, :-1], pixels[:-1, 1:]), np.minimum(pixels[1:, :-1], pixels[1:, 1:]))
+        high = np.maximum(np.maximum(pixels[:-1, :-1], pixels[:-1, 1:]), np.maximum(pixels[1:, :-1], pixels[1:, 1:]))
+        self.mins, self.maxs = [low], [high]
+        while low.shape[0] > 1:
+            pad = low.shape[0] % 2  # odd sides repeat their last cell
+            low = reduce(np.minimum, np.pad(low, (0, pad), mode='edge'))
+            high = reduce(np.maximum, np.pad(high, (0, pad), mode='edge'))
+            self.mins.append(low)
+            self.maxs.append(high)
+        self.top = len(self.maxs) - 1
+
+        # every level flattened back to back, for the batched queries
+        self.counts = np.array([level.shape[0] for level in self.maxs])
+        self.offsets = np.concatenate(([0], np.cumsum(self.counts ** 2)[:-1]))
+        self.flat_maxs = np.concatenate([level.ravel() for level in self.maxs])
+
+    def to_grid(self, origins, directions):
+        """ world space rays to grid space, the ray parameter is unchanged """
+        field = self.heightfield
+        scale = np.array([1 / field.spacing, field.max_pixel_color / field.max_height, 1 / field.spacing])
+        return (np.asarray(origins, np.float64) - field.origin) * scale, np.asarray(directions, np.float64) * scale
+
+    def clip(self, origins, directions, max_distance):
+        """ [enter, leave] ray parameters over the map, above its lowest point
+            (the surface is hit by then) and below its highest one """
+        low = np.array([0, self.mins[-1][0, 0], 0], np.float64)
+        high = np.array([self.cells, self.maxs[-1][0, 0], self.cells], np.float64)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            near, far = (low - origins) / directions, (high - origins) / directions
+        enter, leave = np.minimum(near, far), np.maximum(near, far)
+        # axes the ray is parallel to: all or nothing, depending on the origin
+        inside = (origins >= low) & (origins <= high)
+        enter = np.where(directions == 0, np.where(inside, -np.inf, np.inf), enter)
+        leave = np.where(directions == 0, np.where(inside, np.inf, -np.inf), leave)
+        # rays starting below the lowest point are underground wherever they enter the map
+        below = origins[..., 1] < low[1]
+        enter[..., 1] = np.where(below, -np.inf, enter[..., 1])
+        leave[..., 1] = np.where(below & (directions[..., 1] <= 0), np.inf, leave[..., 1])
+        return np.maximum(enter.max(axis=-1), 0), np.minimum(leave.min(axis=-1), max_distance)
+
+    def surface_hit(self, row, col, origins, directions, start, length):
+        """ First parameter in [0, length] after start where rays reach the
+            bilinear surface of cell (row, col), nan if they stay above it.
+            Along a ray that surface is a quadratic of the parameter. """
+        h00, h01, h10, h11 = (self.pixels[row + i, col + j].astype(np.float64)
+                              for i, j in ((0, 0), (0, 1), (1, 0), (1, 1)))
+        slope_u, slope_v, twist = h01 - h00, h10 - h00, h00 - h01 - h10 + h11
+        u = origins[..., 0] + start * directions[..., 0] - col
+        v = origins[..., 2] + start * directions[..., 2] - row
+        y = origins[..., 1] + start * directions[..., 1]
+        du, dv, dy = directions[..., 0], directions[..., 2], directions[..., 1]
+
+        # ray height - surface height = a s^2 + b s + c
+        a = -twist * du * dv
+        b = dy - slope_u * du - slope_v * dv - twist * (u * dv + v * du)
+        c = y - h00 - slope_u * u - slope_v * v - twist * u * v
+        with np.errstate(divide='ignore', invalid='ignore'):
+            # both roots of the quadratic (cancellation free form), or the line's when a = 0
+            q = -0.5 * (b + np.copysign(np.sqrt(b * b - 4 * a * c), b))
+            first = np.where(np.abs(a) > 1e-12, q / a, -c / b)
+            second = np.where(np.abs(a) > 1e-12, c / q, np.nan)
+        first = np.where((first >= 0) & (first <= length), first, np.nan)
+        second = np.where((second >= 0) & (second <= length), second, np.nan)
+        hit = np.fmin(first, second)
+        return np.where(c <= 0, 0.0, hit)
+
+    def cell_exit(self, origin, direction, index, size):
+        """ parameter where a ray leaves cell `index` (of `size` pixels) along one axis """
+        if direction > 0:
+            return (min((index + 1) * size, self.cells) - origin) / direction
+        if direction < 0:
+            return (index * size - origin) / direction
+        return np.inf
+
+    def intersect(self, origin, direction, max_distance=np.inf):
+        """ distance (in direction lengths) from origin to the first terrain
+            hit of one ray, None if it misses the map """
+        grid_origin, grid_direction = self.to_grid(origin, direction)
+        assert np.any(grid_direction), 'ray direction must not be zero'
+        start, leave = self.clip(grid_origin, grid_direction, max_distance)
+        (ox, oy, oz), (dx, dy, dz) = grid_origin.tolist(), grid_direction.tolist()
+        start, leave = float(start), float(leave)
+
+        level = self.top
+        while start <= leave:
+            size, count = 1 << level, int(self.counts[level])
+            cells = []
+            for axis_origin, axis_direction in ((ox, dx), (oz, dz)):
+                position = axis_origin + start * axis_direction
+                if abs(position - round(position)) < 1e-6:
+                    position = round(position)  # on a cell border, pick the cell ahead
+                index = math.floor(position / size) if axis_direction >= 0 else math.ceil(position / size) - 1
+                cells.append(min(max(index, 0), count - 1))
+            col, row = cells
+            end = min(leave, self.cell_exit(ox, dx, col, size), self.cell_exit(oz, dz, row, size))
+            end = max(end, start + 1e-9)  # always move forward, despite rounding
+
+            if min(oy + start * dy, oy + end * dy) > self.maxs[level][row, col]:
+                start, level = end, min(level + 1, self.top)  # passes above, try a larger step
+            elif level > 0:
+                level -= 1
+            else:
+                hit = float(self.surface_hit(row, col, grid_origin, grid_direction, start, end - start))
+                if not np.isnan(hit):
+                    return start + hit
+                start, level = end, min(level + 1, self.top)
+        return None
+
+    def intersect_many(self, origins, directions, max_distance=np.inf):
+        """ intersect for (n, 3) arrays of rays at once, all of them
+            marching together level by level: (n,) distances, inf on misses """
+        grid_origins, grid_directions = self.to_grid(origins, directions)
+        starts, leaves = self.clip(grid_origins, grid_directions, max_distance)
+        hits = np.full(len(grid_origins), np.inf)
+        levels = np.full(len(grid_origins), self.top)
+        active = np.flatnonzero(starts <= leaves)
+
+        while active.size:
+            o, d, start = grid_origins[active], grid_directions[active], starts[active]
+            level = levels[active]
+            size, count = (1 << level).astype(np.float64), self.counts[level]
+            position = o[:, (0, 2)] + start[:, None] * d[:, (0, 2)]
+            rounded = np.round(position)
+            position = np.where(np.abs(position - rounded) < 1e-6, rounded, position)
+            index = np.where(d[:, (0, 2)] >= 0, np.floor(position / size[:, None]),
+                             np.ceil(position / size[:, None]) - 1)
+            index = np.clip(index, 0, count[:, None] - 1).astype(np.intp)
+            col, row = index[:, 0], index[:, 1]
+
+            axis_directions, cell_sizes = d[:, (0, 2)], size[:, None]
+            far = np.where(axis_directions > 0, np.minimum((index + 1) * cell_sizes, self.cells), index * cell_sizes)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                exits = np.where(axis_directions != 0, (far - o[:, (0, 2)]) / axis_directions, np.inf)
+            end = np.maximum(np.minimum(leaves[active], exits.min(axis=1)), start + 1e-9)
+
+            high = self.flat_maxs[self.offsets[level] + row * count + col]
+            above = np.minimum(o[:, 1] + start * d[:, 1], o[:, 1] + end * d[:, 1]) > high
+            leaf = ~above & (level == 0)
+            levels[active[~above & (level > 0)]] -= 1
+
+            hit = np.full(active.size, np.nan)
+            hit[leaf] = self.surface_hit(row[leaf], col[leaf], o[leaf], d[leaf], start[leaf],
+                                         end[leaf] - start[leaf])
+            found = ~np.isnan(hit)
+            hits[active[found]] = start[found] + hit[found]
+
+            step = above | (leaf & ~found)  # move on to the next cell, trying a larger one
+            starts[active[step]] = end[step]
+            levels[active[step]] = np.minimum(level[step] + 1, self.top)
+            active = active[~found & (starts[active] <= leaves[active])]
+        return hits
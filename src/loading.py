@@ -0,0 +1,167 @@
+"""
+Parallel scene loading.
+
+Builders run on a thread pool so file I/O, image decoding, assimp imports
+and terrain generation overlap, while every OpenGL call they make is
+handed to the thread owning the context: functions decorated with
+on_gl_thread queue themselves there and wait for their result, the main
+thread runs them from GL_THREAD.serve() until all builders are done.
+GL objects garbage collected on other threads are released the same way
+(releases_gl), without waiting, by the next serve() or rendered frame.
+Each builder adds its nodes to its own Node, those are added to the
+viewer in builder order afterwards, so the scene graph is the same as
+when building one builder after another.
+"""
+# Python built-in modules
+import contextlib
+import functools
+import os
+import queue
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+
+# External, non built-in modules
+from node import Node
+
+
+class GLThread:
+    """ Queue of calls to run on the OpenGL context thread (the main one) """
+
+    def __init__(self):
+        self.thread = threading.main_thread()
+        self.calls = queue.Queue()
+        self.lock = threading.Lock()  # accepting changes vs calls queued for it
+        self.accepting = False
+
+    def call(self, function, *args, **kwargs):
+        """ function(*args, **kwargs) run on the GL thread, from any thread.
+            Off it, only while it accepts calls: RuntimeError otherwise,
+            rather than waiting forever for a call nobody runs """
+        if threading.current_thread() is self.thread:
+            return function(*args, **kwargs)
+        future = Future()
+        with self.lock:
+            if not self.accepting:
+                raise RuntimeError('%s called off the GL thread while it accepts no calls' % function.__qualname__)
+            self.calls.put((future, function, args, kwargs))
+        return future.result()
+
+    def release(self, function, *args):
+        """ function(*args) deleting GL objects, run now on the GL thread,
+            queued for its next serve() or run_queued() from other threads,
+            without waiting for it """
+        if threading.current_thread() is self.thread:
+            function(*args)
+        else:
+            self.calls.put((None, function, args, {}))
+
+    def run(self, future, function, args, kwargs):
+        """ run a queued call, its outcome goes to its future if any """
+        try:
+            result = function(*args, **kwargs)
+        except BaseException as exception:
+            if future is None:
+                print('WARNING: %s failed on the GL thread: %r' % (function.__qualname__, exception))
+            else:
+                future.set_exception(exception)
+        else:
+            if future is not None:
+                future.set_result(result)
+
+    def run_queued(self):
+        """ run the calls queued so far, from the GL thread """
+        while True:
+            try:
+                self.run(*self.calls.get_nowait())
+            except queue.Empty:
+                return
+
+    @contextlib.contextmanager
+    def accepting_calls(self):
+        """ context in which other threads may queue calls, those still
+            queued when it ends are run """
+        with self.lock:
+            self.accepting = True
+        try:
+            yield self
+        finally:
+            with self.lock:
+                self.accepting = False
+            self.run_queued()
+
+    def serve(self, futures, poll=0.01):
+        """ run queued calls until all futures are done, then re-raise the
+            error of the first failed one: the others are served until they
+            finish too, so none is left waiting on a call """
+        pending = futures
+        while pending:
+            _, pending = wait(pending, timeout=0)
+            try:
+                self.run(*self.calls.get(timeout=poll))
+            except queue.Empty:
+                continue
+        for future in futures:
+            future.result()
+
+
+GL_THREAD = GLThread()
+
+
+def on_gl_thread(function):
+    """ decorator for functions making OpenGL calls, so loader threads can call them """
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        return GL_THREAD.call(function, *args, **kwargs)
+    return wrapper
+
+
+def releases_gl(function):
+    """ decorator for __del__ methods deleting OpenGL objects: garbage
+        collection may run them on any thread, off the GL thread they are
+        queued for it instead of waiting """
+    @functools.wraps(function)
+    def wrapper(*args):
+        GL_THREAD.release(function, *args)
+    return wrapper
+
+
+class SingleFlight:
+    """ Concurrent calls with the same key run the function once, the other
+        callers wait for and share its result """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def do(self, key, function, *args):
+        """ (result, whether this call ran function) """
+        with self.lock:
+            future = self.calls.get(key)
+            owner = future is None
+            if owner:
+                future = self.calls[key] = Future()
+        if not owner:
+            return future.result(), False
+        try:
+            result = function(*args)
+            future.set_result(result)
+            return result, True
+        except BaseException as exception:
+            future.set_exception(exception)
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+
+
+def run_builders(viewer, builders, workers=None):
+    """ Run (builder, keyword arguments) pairs, called as
+        builder(viewer, **arguments), concurrently on a thread pool while
+        this (GL) thread serves their OpenGL calls. The nodes of each
+        builder are then added to viewer, in the order of builders. """
+    scenes = [Node() for _ in builders]
+    with ThreadPoolExecutor(workers or os.cpu_count()) as pool, GL_THREAD.accepting_calls():
+        futures = [pool.submit(builder, scene, **arguments) for scene, (builder, arguments) in zip(scenes, builders)]
+        GL_THREAD.serve(futures)
+    for scene in scenes:
+        viewer.add(*scene.children)
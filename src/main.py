@@ -12,6 +12,15 @@ from core import build_terrain, build_tree, build_houses,\
     add_characters, add_animations, add_lamps, build_graveyard,\
     build_castle, build_church
 from skybox import Skybox
+from heightfield import HeightField
+from loading import run_builders
+from texture import TEXTURES
+from renderqueue import RENDER_QUEUE
+from culling import compute_bounds, CULLING
+from vertexarray import GEOMETRY
+from meshopt import MESHES
+from batching import StaticBatcher
+from texturepack import TexturePacker
 
 import config
 
@@ -19,24 +28,48 @@ import config
 def main():
     """ create a window, add scene objects, then run rendering loop """
 
+    # Heightmap shared by the terrain and the camera (ground following),
+    # the terrain node sits at (-500, -1, -500) and spans 1000 units
+    heightfield = HeightField("./../resources/map/hmap_2_mounds_4096px.png",
+                              extent=1000, origin=(-500, -1, -500))
+
     # Define all the shaders
-    viewer = Viewer(width=1920, height=1080)
-    terrain_shader = Shader("shaders/terrain.vert", "shaders/terrain.frag")
+    viewer = Viewer(width=1920, height=1080, heightfield=heightfield)
+    if config.streamed_terrain:
+        terrain_shader = Shader("shaders/terrain.vert", "shaders/terrain.frag")
+    else:
+        terrain_shader = Shader("shaders/terrain_heights.vert", "shaders/terrain.frag")
     # cube_shader = Shader("shaders/texture.vert", "shaders/texture.frag")
     phong_shader = Shader("shaders/phong.vert", "shaders/phong.frag")
     lambertian_shader = Shader("shaders/lambertian.vert", "shaders/lambertian.frag")
+    # same, drawing InstancedMeshes (per instance model matrix attribute)
+    phong_instanced_shader = Shader("shaders/phong_instanced.vert", "shaders/phong.frag")
+    lambertian_instanced_shader = Shader("shaders/lambertian_instanced.vert", "shaders/lambertian.frag")
     skinning_shader = Shader("shaders/skinning.vert", "shaders/skinning.frag")
 
-    # Add all the elements of the scene ony by one
-    build_terrain(viewer, shader=terrain_shader)
-    build_tree(viewer, shader=phong_shader)
-    build_graveyard(viewer, shader=phong_shader)
-    build_houses(viewer, shader=phong_shader, lamb_shader=lambertian_shader)
-    build_castle(viewer, shader=phong_shader)
-    build_church(viewer, shader=phong_shader)
-    add_characters(viewer, shader=skinning_shader)
-    add_animations(viewer, shader=phong_shader)
-    add_lamps(viewer, shader=phong_shader)
+    # Add all the elements of the scene, builders load their assets in parallel
+    # and are added to the viewer in this order
+    run_builders(viewer, [(build_terrain, dict(shader=terrain_shader, heightfield=heightfield)),
+                          (build_tree, dict(shader=phong_shader, instanced_shader=phong_instanced_shader)),
+                          (build_graveyard, dict(shader=phong_shader)),
+                          (build_houses, dict(shader=phong_shader, lamb_shader=lambertian_shader)),
+                          (build_castle, dict(shader=phong_shader, instanced_shader=phong_instanced_shader)),
+                          (build_church, dict(shader=phong_shader)),
+                          (add_characters, dict(shader=skinning_shader)),
+                          (add_animations, dict(shader=phong_shader, instanced_shader=phong_instanced_shader)),
+                          (add_lamps, dict(shader=phong_shader, instanced_shader=phong_instanced_shader))])
+    print(TEXTURES.report())
+    print(GEOMETRY.report())
+    print(MESHES.report())
+    if config.texture_arrays:
+        array_shaders = {phong_shader: Shader("shaders/phong.vert", "shaders/phong_array.frag"),
+                         phong_instanced_shader: Shader("shaders/phong_instanced.vert", "shaders/phong_array.frag"),
+                         lambertian_shader: Shader("shaders/lambertian.vert", "shaders/lambertian_array.frag"),
+                         lambertian_instanced_shader: Shader("shaders/lambertian_instanced.vert",
+                                                             "shaders/lambertian_array.frag")}
+        print(TexturePacker(array_shaders).pack(viewer).report())
+    if config.static_batching:
+        print(StaticBatcher().batch(viewer).report())
 
     # -------------------------------------------------
 
@@ -44,6 +77,9 @@ def main():
     shader_skybox = Shader(vertex_source="./shaders/skybox.vert", fragment_source="./shaders/skybox.frag")
     viewer.add(Skybox(shader_skybox=shader_skybox))
 
+    # bounding volumes of the static subtrees, for frustum culling
+    compute_bounds(viewer)
+
     # Start playing ambient audio in background
     if config.sound==True:
         wave_obj = config.sa.WaveObject.from_wave_file("./../resources/audio/amb_we_1-3.wav")
@@ -66,6 +102,8 @@ def main():
 
     # start rendering loop
     viewer.run()
+    print(RENDER_QUEUE.report())  # of the last frame
+    print(CULLING.report())
 
 
 if __name__ == '__main__':
@@ -1,9 +1,14 @@
+import ctypes
+
 import OpenGL.GL as GL
 import numpy as np
 import glfw
 
-from vertexarray import VertexArray
+from vertexarray import VertexArray, GEOMETRY, LAYER_LOCATION
+from loading import on_gl_thread, releases_gl
 from node import Node
+from renderqueue import Drawable
+from culling import vertex_bounds, union
 import config
 
 
@@ -11,18 +16,17 @@ import config
 class Mesh:
     """ Basic mesh class with attributes passed as constructor arguments """
 
+    @on_gl_thread
     def __init__(self, shader, attributes, index=None):
         self.shader = shader
-        self.names = ['view', 'projection', 'model']
-        self.loc = {n: GL.glGetUniformLocation(shader.glid, n) for n in self.names}
         self.vertex_array = VertexArray(attributes, index)
 
     def draw(self, projection, view, model, primitives=GL.GL_TRIANGLES):
         GL.glUseProgram(self.shader.glid)
 
-        GL.glUniformMatrix4fv(self.loc['view'], 1, True, view)
-        GL.glUniformMatrix4fv(self.loc['projection'], 1, True, projection)
-        GL.glUniformMatrix4fv(self.loc['model'], 1, True, model)
+        self.shader.set_uniform('view', view)
+        self.shader.set_uniform('projection', projection)
+        self.shader.set_uniform('model', model)
 
         # draw triangle as GL_TRIANGLE vertex array, draw array call
         self.vertex_array.execute(primitives)
@@ -30,15 +34,20 @@ class Mesh:
 
 # -------------- Texture based Phong rendered Mesh class -------------------------
 
-class TexturedPhongMesh(Node):
+class TexturedPhongMesh(Drawable, Node):
     def __init__(self, shader, tex, attributes, faces,
                  light_dir=None, k_a=(1, 1, 1), k_d=(1, 1, 0), k_s=(1, 1, 0),
-                 s=64.):
+                 s=64., key=None, layout=None):
         # super().__init__(shader, tex, attributes, faces)
         super().__init__()
         # setup texture and upload it to GPU
         self.texture = tex
-        self.vertex_array = VertexArray(attributes=attributes, index=faces)
+        # meshes given the same key share one vertex array (see vertexarray.GEOMETRY),
+        # a layout packs and interleaves the attributes (see vertexarray.FORMATS)
+        self.vertex_array = VertexArray(attributes=attributes, index=faces, layout=layout) if key is None else \
+            GEOMETRY.get(key, attributes, faces, layout)
+        self.attributes, self.faces = attributes, faces  # kept for static batching (see batching)
+        self.bounds = vertex_bounds(attributes[0])  # for frustum culling (see culling)
         self.shader = shader
 
         self.k_a = k_a
@@ -47,47 +56,25 @@ class TexturedPhongMesh(Node):
         self.s = s
         # ----------------
 
-    def draw(self, projection, view, model, primitives=GL.GL_TRIANGLES):
-        GL.glUseProgram(self.shader.glid)
-
-        # projection geometry
-        names = ['view', 'projection', 'model',
-                 'diffuseMap', 'k_a', 'k_d', 'k_s', 's',
-                 'fog_colour', 'w_camera_position']
-        loc = {n: GL.glGetUniformLocation(self.shader.glid, n) for n in names}
-
-        # Iterate over all the light sources and send (to shader) their properties.
-        for i in range(0, config.fog_colour.num_light_src):
-            light_pos_loc = GL.glGetUniformLocation(self.shader.glid, 'light_position[%d]' % i)
-            GL.glUniform3fv(light_pos_loc, 1, config.fog_colour.light_pos[i])
-
-            atten_loc = GL.glGetUniformLocation(self.shader.glid, 'atten_factor[%d]' % i)
-            GL.glUniform3fv(atten_loc, 1, config.fog_colour.get_atten()[i])
+    def render(self, projection, view, model, primitives=GL.GL_TRIANGLES):
+        # program and texture are bound by the render queue (see renderqueue)
+        # projection geometry, camera, fog and lights are in the Frame uniform block (see frame)
+        self.shader.set_uniform('model', model)
 
-        GL.glUniformMatrix4fv(loc['view'], 1, True, view)
-        GL.glUniformMatrix4fv(loc['projection'], 1, True, projection)
-        GL.glUniformMatrix4fv(loc['model'], 1, True, model)
-
-        GL.glUniform3fv(loc['k_a'], 1, self.k_a)
-        GL.glUniform3fv(loc['k_d'], 1, self.k_d)
-        GL.glUniform3fv(loc['k_s'], 1, self.k_s)
-        GL.glUniform1f(loc['s'], max(self.s, 0.001))
-        GL.glUniform3fv(loc['fog_colour'], 1, config.fog_colour.get_colour())
-
-        # world camera position for Phong illumination specular component
-        w_camera_position = np.linalg.inv(view)[:, 3]
-        GL.glUniform3fv(loc['w_camera_position'], 1, w_camera_position)
+        self.shader.set_uniform('k_a', self.k_a)
+        self.shader.set_uniform('k_d', self.k_d)
+        self.shader.set_uniform('k_s', self.k_s)
+        self.shader.set_uniform('s', max(self.s, 0.001))
 
         # ----------------
         # texture access setups
-        GL.glActiveTexture(GL.GL_TEXTURE0)
-        GL.glBindTexture(GL.GL_TEXTURE_2D, self.texture.glid)
-        GL.glUniform1i(loc['diffuseMap'], 0)
-        self.vertex_array.execute(primitives)
+        # texture is a Texture, or a TextureLayer for the *_array.frag shaders
+        self.shader.set_uniform('diffuseMap', 0)
+        GL.glVertexAttrib1f(LAYER_LOCATION, self.texture.layer)  # unless given per vertex
+        self.execute(primitives)
 
-        # leave clean state for easier debugging
-        GL.glBindTexture(GL.GL_TEXTURE_2D, 0)
-        GL.glUseProgram(0)
+    def execute(self, primitives):
+        self.vertex_array.execute(primitives)
 
     def key_handler(self, key):
         # Some day-night toggling functions
@@ -101,14 +88,90 @@ class TexturedPhongMesh(Node):
             config.fog_colour.toggle_value = 8
 
 
-class TexturedPhongMeshSkinned(Node):
+# -------------- Hardware instanced copies of a Phong mesh ------------------------
+INSTANCE_LOCATION = 3  # mat4 instance_model attribute of the *_instanced.vert shaders, 4 locations
+
+
+class InstancedMesh(TexturedPhongMesh):
+    """ TexturedPhongMesh drawn once per instance transform in a single
+        instanced draw call, model matrices multiplied by the instance
+        ones. Needs a shader reading the per instance instance_model matrix
+        (shaders/phong_instanced.vert, shaders/lambertian_instanced.vert). """
+
+    def __init__(self, shader, tex, attributes, faces, transforms, **kwargs):
+        super().__init__(shader, tex, attributes, faces, **kwargs)
+        # column major matrices, as mat4 attributes read them, transforms is a
+        # view of the instances in storage, which doubles when full like the GL buffer
+        self.storage = np.array([np.transpose(transform) for transform in transforms], np.float32).reshape(-1, 4, 4)
+        self.transforms = self.storage
+        self.capacity = 0  # instances the GL buffer holds
+        self.dirty = None  # (first, last + 1) instances changed since the last upload
+        self.buffer = self.create_buffer()
+        if self.bounds is not None:  # of all instances, transforms are stored transposed
+            self.bounds = union([self.bounds.transformed(transform.T) for transform in self.transforms])
+
+    @on_gl_thread
+    def create_buffer(self):
+        return GL.glGenBuffers(1)
+
+    def set_transform(self, index, transform):
+        """ change the transform of instance index, uploaded at next draw """
+        self.transforms[index] = np.transpose(transform)
+        self.bounds = None  # moving instances are always drawn
+        first, end = self.dirty or (index, index + 1)
+        self.dirty = min(first, index), max(end, index + 1)
+
+    def add_instance(self, transform):
+        """ add an instance, returns its index """
+        index = len(self.transforms)
+        if index == len(self.storage):
+            self.storage = np.empty((max(2 * index, 1), 4, 4), np.float32)
+            self.storage[:index] = self.transforms
+        self.transforms = self.storage[:index + 1]
+        self.set_transform(index, transform)
+        return index
+
+    def upload(self):
+        """ send changed instance transforms: whole buffer when it grew, else the changed range """
+        GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self.buffer)
+        if self.capacity < len(self.transforms):
+            self.capacity = max(len(self.transforms), 2 * self.capacity)
+            GL.glBufferData(GL.GL_ARRAY_BUFFER, self.capacity * 64, None, GL.GL_DYNAMIC_DRAW)
+            self.dirty = 0, len(self.transforms)
+        if self.dirty:
+            first, end = self.dirty
+            GL.glBufferSubData(GL.GL_ARRAY_BUFFER, first * 64, (end - first) * 64, self.transforms[first:end])
+            self.dirty = None
+
+    def execute(self, primitives):
+        if not len(self.transforms):
+            return
+        GL.glBindVertexArray(self.vertex_array.glid)
+        self.upload()
+        # instance matrix columns, per instance, pointed again as vertex arrays may be shared
+        for column in range(4):
+            GL.glEnableVertexAttribArray(INSTANCE_LOCATION + column)
+            GL.glVertexAttribPointer(INSTANCE_LOCATION + column, 4, GL.GL_FLOAT, False, 64,
+                                     ctypes.c_void_p(16 * column))
+            GL.glVertexAttribDivisor(INSTANCE_LOCATION + column, 1)
+        self.vertex_array.execute_instanced(primitives, len(self.transforms))
+
+    @releases_gl
+    def __del__(self):
+        GL.glDeleteBuffers(1, [self.buffer])
+
+
+class TexturedPhongMeshSkinned(Drawable, Node):
     def __init__(self, shader, tex, attributes, faces, bone_nodes, bone_offsets,
-                 k_a=(1, 1, 1), k_d=(1, 1, 0), k_s=(1, 1, 0), s=64.):
+                 k_a=(1, 1, 1), k_d=(1, 1, 0), k_s=(1, 1, 0), s=64., key=None, layout=None):
         super().__init__()
 
         # setup texture and upload it to GPU
         self.texture = tex
-        self.vertex_array = VertexArray(attributes=attributes, index=faces)
+        # meshes given the same key share one vertex array (see vertexarray.GEOMETRY),
+        # a layout packs and interleaves the attributes (see vertexarray.FORMATS)
+        self.vertex_array = VertexArray(attributes=attributes, index=faces, layout=layout) if key is None else \
+            GEOMETRY.get(key, attributes, faces, layout)
         self.shader = shader
         # self.fog_colour = FogColour()
 
@@ -120,50 +183,61 @@ class TexturedPhongMeshSkinned(Node):
         self.bone_nodes = bone_nodes
         self.bone_offsets = np.array(bone_offsets, np.float32)
 
-    def draw(self, projection, view, model, primitives=GL.GL_TRIANGLES):
-        GL.glUseProgram(self.shader.glid)
+    def render(self, projection, view, model, primitives=GL.GL_TRIANGLES):
+        # program and texture are bound by the render queue (see renderqueue)
+        # projection geometry, camera, fog and lights are in the Frame uniform block (see frame)
+        self.shader.set_uniform('model', model)
 
-        # projection geometry
-        names = ['view', 'projection', 'model', 'diffuseMap', 'k_a', 'k_d', 'k_s', 's',
-                 'fog_colour', 'w_camera_position']
-        loc = {n: GL.glGetUniformLocation(self.shader.glid, n) for n in names}
+        self.shader.set_uniform('k_a', self.k_a)
+        self.shader.set_uniform('k_d', self.k_d)
+        self.shader.set_uniform('k_s', self.k_s)
+        self.shader.set_uniform('s', max(self.s, 0.001))
 
-        GL.glUniformMatrix4fv(loc['view'], 1, True, view)
-        GL.glUniformMatrix4fv(loc['projection'], 1, True, projection)
-        GL.glUniformMatrix4fv(loc['model'], 1, True, model)
+        # bone world transform matrices need to be passed for skinning, all in one upload
+        world_transforms = [node.world_transform for node in self.bone_nodes]
+        self.shader.set_uniform('bone_matrix', world_transforms @ self.bone_offsets)
 
-        GL.glUniform3fv(loc['k_a'], 1, self.k_a)
-        GL.glUniform3fv(loc['k_d'], 1, self.k_d)
-        GL.glUniform3fv(loc['k_s'], 1, self.k_s)
-        GL.glUniform1f(loc['s'], max(self.s, 0.001))
-        GL.glUniform3fv(loc['fog_colour'], 1, config.fog_colour.get_colour())
+        # ----------------
+        # texture access setups
+        self.shader.set_uniform('diffuseMap', 0)
+        self.vertex_array.execute(primitives)
 
-        # bone world transform matrices need to be passed for skinning
-        for bone_id, node in enumerate(self.bone_nodes):
-            bone_matrix = node.world_transform @ self.bone_offsets[bone_id]
 
-            bone_loc = GL.glGetUniformLocation(self.shader.glid, 'bone_matrix[%d]' % bone_id)
-            GL.glUniformMatrix4fv(bone_loc, len(self.bone_nodes), True, bone_matrix)
+# -------------- Distance based level of detail switching -----------------------
+LOD_SCREEN_ERROR = 0.003  # largest projected level error, in NDC units (2 / 720: a pixel at 720p)
+LOD_HYSTERESIS = 0.25  # switch only once past the threshold by this fraction, so levels don't flicker
 
-        # Iterate over all the light sources and send (to shader) their properties.
-        for i in range(0, config.fog_colour.num_light_src):
-            light_pos_loc = GL.glGetUniformLocation(self.shader.glid, 'light_position[%d]' % i)
-            GL.glUniform3fv(light_pos_loc, 1, config.fog_colour.light_pos[i])
 
-            atten_loc = GL.glGetUniformLocation(self.shader.glid, 'atten_factor[%d]' % i)
-            GL.glUniform3fv(atten_loc, 1, config.fog_colour.get_atten()[i])
+class LODMesh(Node):
+    """ Draws one of several meshes of the same object, finest first, given
+        the error bounds of the coarser ones (see meshopt.lod_levels): the
+        coarsest level whose error, projected at the distance of the
+        bounding sphere (center, radius), stays under LOD_SCREEN_ERROR """
 
-        # world camera position for Phong illumination specular component
-        w_camera_position = np.linalg.inv(view)[:, 3]
-        GL.glUniform3fv(loc['w_camera_position'], 1, w_camera_position)
+    def __init__(self, levels, errors, center, radius):
+        super().__init__()
+        self.levels = levels
+        self.errors = [0.] + list(errors)
+        self.center = np.array([*center, 1], np.float32)
+        self.radius = radius
+        self.level = 0
+        self.bounds = levels[0].bounds
+
+    def select(self, projection, view, model):
+        """ level to draw from the screen size of one model space unit """
+        scale = np.linalg.norm(model[:3, :3], axis=0).max()
+        distance = max(np.linalg.norm((view @ model @ self.center)[:3]) - self.radius * scale, 1e-6)
+        unit_size = scale * projection[1, 1] / distance
+        wanted = max(level for level, error in enumerate(self.errors) if error * unit_size <= LOD_SCREEN_ERROR)
+        if wanted > self.level and self.errors[wanted] * unit_size > LOD_SCREEN_ERROR * (1 - LOD_HYSTERESIS):
+            return self.level  # coarser, but not yet by enough
+        if wanted < self.level and self.errors[self.level] * unit_size < LOD_SCREEN_ERROR * (1 + LOD_HYSTERESIS):
+            return self.level  # finer, but not yet by enough
+        return wanted
 
-        # ----------------
-        # texture access setups
-        GL.glActiveTexture(GL.GL_TEXTURE0)
-        GL.glBindTexture(GL.GL_TEXTURE_2D, self.texture.glid)
-        GL.glUniform1i(loc['diffuseMap'], 0)
-        self.vertex_array.execute(primitives)
+    def draw(self, projection, view, model, primitives=GL.GL_TRIANGLES):
+        self.level = self.select(projection, view, model)
+        self.levels[self.level].draw(projection, view, model, primitives)
 
-        # leave clean state for easier debugging
-        GL.glBindTexture(GL.GL_TEXTURE_2D, 0)
-        GL.glUseProgram(0)
+    def key_handler(self, key):
+        self.levels[0].key_handler(key)
@@ -0,0 +1,253 @@
+"""
+Offline mesh optimization, run on assimp imports before they are cached.
+
+Models reach the GPU the way the exporters wrote them: one vertex per face
+corner and triangles in authoring order. optimize_mesh() welds identical
+vertices, reorders triangles for the post-transform vertex cache (Tipsify,
+Sander et al. 2007) and vertices by first use for fetch locality. ACMR,
+the average number of vertices transformed per triangle with a FIFO cache
+of CACHE_SIZE entries, measures the result: 3 is the worst, 0.5 the best
+a regular grid can get.
+
+lod_levels() decimates big meshes into coarser levels of detail by vertex
+clustering with quadric error placement (Lindstrom 2000): vertices are
+merged per cell of a grid, the merged vertex put where the summed planes
+of its faces' quadrics are closest, degenerate triangles dropped. Unlike
+greedy edge collapses it runs in a few vectorized passes, so every level
+is built with the import cache entry.
+"""
+# Python built-in modules
+from collections import deque
+
+# External, non built-in modules
+import numpy as np
+
+CACHE_SIZE = 16  # conservative post-transform cache size, in vertices
+LOD_RATIOS = (0.4, 0.15, 0.05)  # triangle count of each coarser level, relative to the full mesh
+LOD_MIN_TRIANGLES = 2000  # smaller meshes are not decimated
+
+
+def weld(attributes, faces):
+    """ Merge vertices whose attribute rows are all identical. Returns
+        (attributes, faces, remap) with remap[old vertex] = new vertex,
+        vertices kept in order of first occurrence. """
+    rows = np.column_stack([np.asarray(data, np.float32) for data in attributes]) + np.float32(0)
+    rows = np.ascontiguousarray(rows)  # + 0 above turns -0.0 into 0.0, so they weld
+    keys = rows.view(np.dtype((np.void, rows.dtype.itemsize * rows.shape[1]))).ravel()
+    _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    order = np.argsort(first)
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    remap = rank[inverse.ravel()]
+    return [np.asarray(data)[first[order]] for data in attributes], remap[faces], remap
+
+
+def optimize_vertex_cache(faces, vertex_count, cache_size=CACHE_SIZE):
+    """ Triangle order of faces (T, 3) for post-transform cache reuse, by
+        the Tipsify algorithm: fan around the most recently cached vertex
+        still having triangles left, jump to a dead-end vertex otherwise.
+        Returns the permutation of triangle indices. """
+    faces = np.asarray(faces)
+    corners = faces.ravel()
+    live = np.bincount(corners, minlength=vertex_count)
+    starts = np.concatenate(([0], np.cumsum(live)))
+    adjacency = (np.argsort(corners, kind='stable') // 3).tolist()  # triangles of each vertex, back to back
+    starts, live, triangles = starts.tolist(), live.tolist(), faces.tolist()
+    time_stamps = [0] * vertex_count
+    emitted = [False] * len(triangles)
+    dead_ends, order = [], []
+    stamp, cursor, fan = cache_size + 1, 0, 0 if len(triangles) else -1
+
+    while fan >= 0:
+        candidates = set()
+        for triangle in adjacency[starts[fan]:starts[fan + 1]]:
+            if emitted[triangle]:
+                continue
+            emitted[triangle] = True
+            order.append(triangle)
+            for vertex in triangles[triangle]:
+                dead_ends.append(vertex)
+                candidates.add(vertex)
+                live[vertex] -= 1
+                if stamp - time_stamps[vertex] > cache_size:  # cache miss
+                    time_stamps[vertex] = stamp
+                    stamp += 1
+
+        # next fan: cached candidate still in cache after its remaining triangles
+        fan, best = -1, -1
+        for vertex in candidates:
+            if live[vertex] > 0:
+                age = stamp - time_stamps[vertex]
+                priority = age if age + 2 * live[vertex] <= cache_size else 0
+                if priority > best:
+                    fan, best = vertex, priority
+        while fan < 0 and dead_ends:
+            vertex = dead_ends.pop()
+            if live[vertex] > 0:
+                fan = vertex
+        while fan < 0 and cursor < vertex_count:
+            if live[cursor] > 0:
+                fan = cursor
+            cursor += 1
+    return np.array(order, np.intp)
+
+
+def optimize_vertex_fetch(faces, vertex_count):
+    """ Vertex remap putting vertices in order of first use by faces,
+        unused vertices get -1. Returns (remap, order of kept vertices). """
+    used, first = np.unique(np.asarray(faces).ravel(), return_index=True)
+    order = used[np.argsort(first)]
+    remap = np.full(vertex_count, -1, np.intp)
+    remap[order] = np.arange(len(order))
+    return remap, order
+
+
+def acmr(faces, cache_size=CACHE_SIZE):
+    """ average cache miss ratio of faces through a FIFO vertex cache """
+    cache, cached, misses = deque(), set(), 0
+    for vertex in np.asarray(faces).ravel().tolist():
+        if vertex not in cached:
+            misses += 1
+            cache.append(vertex)
+            cached.add(vertex)
+            if len(cache) > cache_size:
+                cached.discard(cache.popleft())
+    return misses / max(len(faces), 1)
+
+
+def optimize_mesh(attributes, faces, cache_size=CACHE_SIZE):
+    """ Weld, cache and fetch reorder a triangle mesh given per vertex
+        attribute arrays and (T, 3) faces. Returns (attributes, faces,
+        remap, stats): remap[old vertex] = new vertex or -1 (to carry per
+        vertex data stored elsewhere, e.g. bone weights), stats a dict of
+        (before, after) 'vertices' and 'acmr' pairs and 'triangles'. """
+    faces = np.asarray(faces)
+    vertex_count = len(attributes[0])
+    acmr_before = acmr(faces, cache_size)
+
+    attributes, faces, remap = weld(attributes, faces)
+    faces = faces[optimize_vertex_cache(faces, len(attributes[0]), cache_size)]
+    fetch_remap, order = optimize_vertex_fetch(faces, len(attributes[0]))
+    attributes = [data[order] for data in attributes]
+    faces = fetch_remap[faces].astype(np.uint32)
+    remap = fetch_remap[remap]
+
+    stats = dict(vertices=(vertex_count, len(order)), triangles=len(faces),
+                 acmr=(acmr_before, acmr(faces, cache_size)))
+    return attributes, faces, remap, stats
+
+
+# -------------- Level of detail decimation ----------------------------------
+def cluster_faces(faces, clusters):
+    """ faces mapped to vertex clusters, degenerate and duplicate ones removed """
+    faces = clusters[faces]
+    faces = faces[(faces[:, 0] != faces[:, 1]) & (faces[:, 1] != faces[:, 2]) & (faces[:, 2] != faces[:, 0])]
+    _, first = np.unique(np.sort(faces, axis=1), axis=0, return_index=True)
+    return faces[np.sort(first)]
+
+
+def grid_clusters(positions, resolution):
+    """ cluster id of every vertex, cells of a resolution^3 grid over the bounds """
+    low, high = positions.min(axis=0), positions.max(axis=0)
+    cells = np.floor((positions - low) / np.maximum(high - low, 1e-12) * resolution).astype(np.int64)
+    cells = np.minimum(cells, resolution - 1)
+    _, clusters = np.unique(cells @ np.array([1, resolution, resolution ** 2]), return_inverse=True)
+    return clusters.ravel(), (high - low).max() / resolution
+
+
+def simplify(attributes, faces, target_triangles):
+    """ Decimation of [positions, other attributes...] and faces to about
+        target_triangles, by vertex clustering on the coarsest grid keeping
+        that many. Merged vertices are placed at the minimum of their
+        summed face quadrics and take the other attributes of the cluster
+        vertex nearest to it. Returns (attributes, faces, error), error the
+        grid cell size, a bound on how far the surface moved. """
+    positions = np.asarray(attributes[0], np.float64)
+    faces = np.asarray(faces, np.intp)
+
+    # coarsest grid with enough triangles left (their count grows with resolution)
+    low, high = 1, 1024
+    while low < high:
+        middle = (low + high) // 2
+        if len(cluster_faces(faces, grid_clusters(positions, middle)[0])) >= target_triangles:
+            high = middle
+        else:
+            low = middle + 1
+    clusters, error = grid_clusters(positions, low)
+    count = clusters.max() + 1
+
+    # face plane quadrics, area weighted, summed per cluster of their vertices
+    corners = positions[faces]
+    normals = np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])  # length: 2 * area
+    planes = np.column_stack((normals, -np.einsum('ij,ij->i', normals, corners[:, 0])))
+    planes /= np.sqrt(np.maximum(np.linalg.norm(normals, axis=1, keepdims=True), 1e-30))
+    quadrics = np.einsum('ij,ik->ijk', planes, planes).reshape(-1, 16)
+    sums = np.zeros((count, 16))
+    for corner in range(3):
+        np.add.at(sums, clusters[faces[:, corner]], quadrics)
+    sums = sums.reshape(-1, 4, 4)
+
+    # minimum of each quadric, regularized towards the cluster mean where it is flat
+    means = np.zeros((count, 3))
+    np.add.at(means, clusters, positions)
+    means /= np.bincount(clusters, minlength=count)[:, None]
+    regularization = (1e-3 * np.trace(sums[:, :3, :3], axis1=1, axis2=2) / 3 + 1e-12)[:, None]
+    matrices = sums[:, :3, :3] + regularization[:, :, None] * np.eye(3)
+    targets = -sums[:, :3, 3] + regularization * means
+    optimal = np.linalg.solve(matrices, targets[:, :, None])[:, :, 0]
+    cluster_low, cluster_high = np.full((count, 3), np.inf), np.full((count, 3), -np.inf)
+    np.minimum.at(cluster_low, clusters, positions)
+    np.maximum.at(cluster_high, clusters, positions)
+    optimal = np.clip(optimal, cluster_low, cluster_high)
+
+    # other attributes from the vertex nearest the optimal point
+    distances = np.linalg.norm(positions - optimal[clusters], axis=1)
+    nearest = np.lexsort((distances, clusters))
+    nearest = nearest[np.concatenate(([True], np.diff(clusters[nearest]) != 0))]
+    attributes = [optimal.astype(np.asarray(attributes[0]).dtype)] + [np.asarray(data)[nearest]
+                                                                     for data in attributes[1:]]
+    return attributes, cluster_faces(faces, clusters), error
+
+
+def lod_levels(attributes, faces, ratios=LOD_RATIOS, min_triangles=LOD_MIN_TRIANGLES):
+    """ Coarser levels of detail of a mesh, each simplified to a ratio of
+        its triangle count and cache optimized, as (attributes, faces,
+        error) tuples. Meshes under min_triangles get none, a level not
+        removing a fifth of the previous one's triangles ends the list. """
+    levels, triangle_count = [], len(faces)
+    if triangle_count < min_triangles:
+        return levels
+    previous = triangle_count
+    for ratio in ratios:
+        decimated, decimated_faces, error = simplify(attributes, faces, max(int(triangle_count * ratio), 1))
+        if len(decimated_faces) > 0.8 * previous or not len(decimated_faces):
+            break
+        decimated, decimated_faces, _, _ = optimize_mesh(decimated, decimated_faces)
+        levels.append((decimated, decimated_faces, error))
+        previous = len(decimated_faces)
+    return levels
+
+
+class OptimizationStats:
+    """ Per model optimize_mesh stats, as imported, for a summary line """
+
+    def __init__(self):
+        self.models = {}  # model name -> list of per mesh stats
+
+    def add(self, name, mesh_stats):
+        self.models[name] = mesh_stats
+
+    def report(self):
+        lines = ['Meshes: %d models optimized' % len(self.models)]
+        for name, mesh_stats in sorted(self.models.items()):
+            if not sum(stats['triangles'] for stats in mesh_stats):
+                continue
+            vertices = np.sum([stats['vertices'] for stats in mesh_stats], axis=0)
+            triangles = np.array([stats['triangles'] for stats in mesh_stats])
+            before, after = (np.array([stats['acmr'][i] for stats in mesh_stats]) @ triangles / triangles.sum()
+                             for i in (0, 1))
+            lines.append('  %-28s %7d -> %7d vertices  ACMR %.2f -> %.2f' % (name, *vertices, before, after))
+        return '\n'.join(lines)
+
+
+MESHES = OptimizationStats()  # filled by modelcache.import_scene
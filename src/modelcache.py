@@ -0,0 +1,220 @@
+"""
+On-disk cache of assimp imports.
+
+assimpcy.aiImportFile on the big FBX/OBJ models dominates startup, so the
+loaders go through import_scene() instead: the post-processed scene is
+flattened once into the arrays the loaders actually read (vertices, uvs,
+normals, faces, bone weights, node tree and animation keys) plus a small
+JSON description, saved with cache.save_arrays and memory mapped on later
+runs without touching assimp. Meshes are optimized (see meshopt) before
+being cached, big static ones along with their coarser levels of detail. Entries are keyed by the model file's mtime
+and size and by the import flags. Imports themselves run in a process pool,
+so loader threads importing different models do so in parallel.
+"""
+# Python built-in modules
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from types import SimpleNamespace
+
+# External, non built-in modules
+import assimpcy
+import numpy as np
+
+from cache import ArrayCache, cache_key
+from loading import SingleFlight
+from meshopt import optimize_mesh, lod_levels, MESHES
+
+KEY_TYPES = ('position', 'rotation', 'scaling')
+IMPORTS = SingleFlight()  # threads loading the same model share one import
+# workers are only started by the first cache miss, spawned rather than
+# forked from a process already running loader threads and a GL context
+IMPORT_POOL = ProcessPoolExecutor(mp_context=multiprocessing.get_context('spawn'))
+
+
+def import_arrays(file, flags, optimize=True):
+    """ assimp import of file flattened by pack_scene, run in a worker process """
+    return pack_scene(assimpcy.aiImportFile(file, flags), optimize)
+
+
+def import_in_pool(file, flags, optimize=True):
+    """ import_arrays run by the import process pool """
+    return IMPORT_POOL.submit(import_arrays, file, flags, optimize).result()
+
+
+def import_scene(file, flags, optimize=True):
+    """ Scene of file imported with the assimp post-processing flags, from
+        the cache when the file did not change. The returned scene mirrors
+        the assimp attributes the loaders use (mMeshes, mMaterials,
+        mRootNode, mAnimations...), except for bone weights, stored as
+        vertex_ids / weights arrays, animation keys, as (times, values)
+        arrays, and the mesh bounds (center, radius) and lods, coarser
+        levels of detail with their error (see meshopt.lod_levels).
+        Meshes are welded and reordered by meshopt.optimize_mesh unless
+        optimize is False, their stats are added to meshopt.MESHES.
+        Raises assimpcy.all.AssimpError like aiImportFile. """
+    try:
+        status = os.stat(file)
+    except OSError:  # let assimp report the missing file, as the loaders expect
+        return unpack_scene(pack_scene(assimpcy.aiImportFile(file, flags), optimize))
+    name = os.path.splitext(os.path.basename(file))[0]
+    cache = ArrayCache('Model-%s-%s' % (name, cache_key(os.path.abspath(file), int(flags), optimize)[:8]))
+    key = cache_key(status.st_mtime_ns, status.st_size)
+    arrays, _ = IMPORTS.do(cache.path(key), cache.get, key, lambda: import_in_pool(file, flags, optimize))
+    scene = unpack_scene(arrays)
+    if optimize:
+        MESHES.add(name, [mesh.optimization for mesh in scene.mMeshes])
+    return scene
+
+
+def text(value):
+    """ assimp names as str, whether the binding gives str or bytes """
+    return value.decode() if isinstance(value, bytes) else value
+
+
+def channel(data, vertex_count):
+    """ per vertex attribute channel of an assimp mesh as an array, zeros
+        when the file has none (e.g. obj files without vt lines): what the
+        shaders read from a disabled attribute, which VertexArray made of
+        None channels before meshes were packed """
+    if data is None:
+        return np.zeros((vertex_count, 3), np.float32)  # assimp stores uvs as 3D vectors too
+    return np.asarray(data)
+
+
+def pack_scene(scene, optimize=True):
+    """ flatten an assimp scene to a dict of arrays (the layout is
+        described by the JSON in arrays['structure']), meshes optimized
+        by meshopt.optimize_mesh unless optimize is False """
+    arrays = {}
+    structure = dict(materials=[text(mat.properties.get('TEXTURE_BASE')) for mat in scene.mMaterials],
+                     meshes=[], nodes=[], animations=[])
+
+    for mesh_id, mesh in enumerate(scene.mMeshes):
+        prefix = 'mesh%d_' % mesh_id
+        vertices = np.asarray(mesh.mVertices)
+        uvs = mesh.mTextureCoords[0] if mesh.mTextureCoords is not None and len(mesh.mTextureCoords) else None
+        attributes = [vertices, channel(mesh.mNormals, len(vertices)), channel(uvs, len(vertices))]
+        faces = np.asarray(mesh.mFaces)
+        bones = mesh.mBones or []
+        bone_ids = [np.array([entry.mVertexId for entry in bone.mWeights], np.intp) for bone in bones]
+        bone_weights = [np.array([entry.mWeight for entry in bone.mWeights], np.float32) for bone in bones]
+        description = dict(material=int(mesh.mMaterialIndex), bones=[text(bone.mName) for bone in bones])
+
+        if optimize:
+            if bones:  # coincident vertices may be skinned differently, only weld identical influences
+                influences = np.zeros((len(attributes[0]), len(bones)), np.float32)
+                for bone, (ids, weights) in enumerate(zip(bone_ids, bone_weights)):
+                    influences[ids, bone] = weights
+                attributes.append(influences)
+            attributes, faces, remap, description['optimization'] = optimize_mesh(attributes, faces)
+            if bones:
+                *attributes, influences = attributes
+                bone_ids = [np.flatnonzero(influences[:, bone]) for bone in range(len(bones))]
+                bone_weights = [influences[ids, bone] for bone, ids in enumerate(bone_ids)]
+        arrays[prefix + 'vertices'], arrays[prefix + 'normals'], arrays[prefix + 'uvs'] = attributes
+        arrays[prefix + 'faces'] = faces
+
+        # levels of detail of static meshes, with the bounding sphere used to pick them
+        positions = np.asarray(attributes[0], np.float64)
+        center = (positions.min(axis=0) + positions.max(axis=0)) / 2 if len(positions) else np.zeros(3)
+        description['bounds'] = center.tolist(), float(np.linalg.norm(positions - center, axis=1).max(initial=0))
+        description['lods'] = []
+        levels = lod_levels(attributes, faces) if optimize and not bones else []
+        for level, (lod, lod_faces, error) in enumerate(levels):
+            lod_prefix = '%slod%d_' % (prefix, level)
+            arrays[lod_prefix + 'vertices'], arrays[lod_prefix + 'normals'], arrays[lod_prefix + 'uvs'] = lod
+            arrays[lod_prefix + 'faces'] = lod_faces
+            description['lods'].append(float(error))
+
+        # weights of all bones back to back, bone_counts entries per bone
+        arrays[prefix + 'bone_ids'] = np.concatenate(bone_ids + [np.empty(0, np.intp)]).astype(np.uint32)
+        arrays[prefix + 'bone_weights'] = np.concatenate(bone_weights + [np.empty(0, np.float32)])
+        arrays[prefix + 'bone_counts'] = np.array([len(ids) for ids in bone_ids], np.uint32)
+        offsets = np.array([bone.mOffsetMatrix for bone in bones], np.float32)
+        arrays[prefix + 'bone_offsets'] = offsets.reshape(-1, 4, 4)
+        structure['meshes'].append(description)
+
+    # node tree in depth first order, children given as indices
+    transforms = []
+
+    def add_tree(assimp_node):
+        index = len(structure['nodes'])
+        structure['nodes'].append(dict(name=text(assimp_node.mName), meshes=[int(i) for i in assimp_node.mMeshes]))
+        transforms.append(assimp_node.mTransformation)
+        structure['nodes'][index]['children'] = [add_tree(child) for child in assimp_node.mChildren]
+        return index
+
+    add_tree(scene.mRootNode)
+    arrays['node_transforms'] = np.array(transforms, np.float32).reshape(-1, 4, 4)
+
+    for anim_id, anim in enumerate(scene.mAnimations or []):
+        structure['animations'].append(dict(ticks_per_second=float(anim.mTicksPerSecond),
+                                            channels=[text(channel.mNodeName) for channel in anim.mChannels]))
+        for key_type in KEY_TYPES:
+            prefix = 'anim%d_%s_' % (anim_id, key_type)
+            channel_keys = [getattr(channel, 'm%sKeys' % key_type.capitalize()) for channel in anim.mChannels]
+            arrays[prefix + 'times'] = np.array([key.mTime for keys in channel_keys for key in keys], np.float64)
+            arrays[prefix + 'values'] = np.array([key.mValue for keys in channel_keys for key in keys], np.float32)
+            arrays[prefix + 'counts'] = np.array([len(keys) for keys in channel_keys], np.uint32)
+
+    arrays['structure'] = np.frombuffer(json.dumps(structure).encode(), np.uint8)
+    return arrays
+
+
+def split(array, counts):
+    """ consecutive slices of array, of the given lengths """
+    return np.split(array, np.cumsum(counts)[:-1]) if len(counts) else []
+
+
+def unpack_scene(arrays):
+    """ assimp like scene from the arrays of pack_scene """
+    structure = json.loads(bytes(arrays['structure']).decode())
+
+    materials = [SimpleNamespace(properties={} if texture is None else {'TEXTURE_BASE': texture})
+                 for texture in structure['materials']]
+
+    meshes = []
+    for mesh_id, description in enumerate(structure['meshes']):
+        prefix = 'mesh%d_' % mesh_id
+        counts = arrays[prefix + 'bone_counts']
+        bones = [SimpleNamespace(mName=name, mOffsetMatrix=offset, vertex_ids=ids, weights=weights)
+                 for name, offset, ids, weights in zip(description['bones'], arrays[prefix + 'bone_offsets'],
+                                                       split(arrays[prefix + 'bone_ids'], counts),
+                                                       split(arrays[prefix + 'bone_weights'], counts))]
+        lods = [SimpleNamespace(mVertices=arrays['%slod%d_vertices' % (prefix, level)],
+                                mNormals=arrays['%slod%d_normals' % (prefix, level)],
+                                mTextureCoords=[arrays['%slod%d_uvs' % (prefix, level)]],
+                                mFaces=arrays['%slod%d_faces' % (prefix, level)], error=error)
+                for level, error in enumerate(description['lods'])]
+        faces = arrays[prefix + 'faces']
+        meshes.append(SimpleNamespace(mVertices=arrays[prefix + 'vertices'], mNormals=arrays[prefix + 'normals'],
+                                      mTextureCoords=[arrays[prefix + 'uvs']],
+                                      mFaces=faces, mNumFaces=len(faces),
+                                      mNumVertices=len(arrays[prefix + 'vertices']),
+                                      mMaterialIndex=description['material'], mBones=bones,
+                                      optimization=description.get('optimization'),
+                                      bounds=description['bounds'], lods=lods))
+
+    nodes = [SimpleNamespace(mName=node['name'], mTransformation=transform, mMeshes=node['meshes'])
+             for node, transform in zip(structure['nodes'], arrays['node_transforms'])]
+    for node, description in zip(nodes, structure['nodes']):
+        node.mChildren = [nodes[child] for child in description['children']]
+
+    animations = []
+    for anim_id, description in enumerate(structure['animations']):
+        keys = {}
+        for key_type in KEY_TYPES:
+            prefix = 'anim%d_%s_' % (anim_id, key_type)
+            counts = arrays[prefix + 'counts']
+            keys[key_type] = zip(split(arrays[prefix + 'times'], counts), split(arrays[prefix + 'values'], counts))
+        channels = [SimpleNamespace(mNodeName=name, position_keys=position, rotation_keys=rotation,
+                                    scaling_keys=scaling)
+                    for name, position, rotation, scaling in zip(description['channels'], keys['position'],
+                                                                 keys['rotation'], keys['scaling'])]
+        animations.append(SimpleNamespace(mTicksPerSecond=description['ticks_per_second'], mChannels=channels))
+
+    return SimpleNamespace(mMaterials=materials, mNumMaterials=len(materials), mMeshes=meshes,
+                           mNumMeshes=len(meshes), mRootNode=nodes[0], mAnimations=animations,
+                           mNumAnimations=len(animations))
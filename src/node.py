@@ -1,9 +1,11 @@
+from culling import CULLING
 from transform import identity
 
 
 # ------------  Node is the core drawable for hierarchical scene graphs -------
 class Node:
     """ Scene graph transform and parameter broadcast node """
+    bounds = None  # culling.Bounds of what it draws, in its parent's frame, None: always drawn
 
     def __init__(self, children=(), transform=identity()):
         self.transform = transform
@@ -14,9 +16,12 @@ class Node:
         self.children.extend(drawables)
 
     def draw(self, projection, view, model):
-        """ Recursive draw, passing down updated model matrix. """
+        """ Recursive draw, passing down updated model matrix, skipping
+            children outside the view frustum (see culling) """
+        model = model @ self.transform  # TP3: hierarchical update
         for child in self.children:
-            child.draw(projection, view, model @ self.transform)  # TP3: hierarchical update
+            if CULLING.visible(child, model):
+                child.draw(projection, view, model)
 
     def key_handler(self, key):
         """ Dispatch keyboard events to children """
@@ -21,3 +21,21 @@ class ProceduralAnimation(Node):
                                            self.direction)
         super().draw(projection, view, model)
 
+
+
+class ProceduralInstances(Node):
+    """ ProceduralAnimation of many copies at once: instance i of the
+        InstancedMesh children is placed every frame by
+        anim_func(*instance_arguments[i]) """
+
+    def __init__(self, anim_func, instance_arguments):
+        super().__init__()
+        self.gen_keyframe = anim_func
+        self.instance_arguments = instance_arguments
+
+    def draw(self, projection, view, model):
+        for index, arguments in enumerate(self.instance_arguments):
+            transform = self.gen_keyframe(*arguments)
+            for child in self.children:
+                child.set_transform(index, transform)
+        super().draw(projection, view, model)
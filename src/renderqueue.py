@@ -0,0 +1,112 @@
+"""
+State sorted render queue.
+
+Drawing the scene graph in insertion order switches programs and textures
+between terrain, phong, lambertian, skinning and skybox objects all the
+time. While the Viewer records a frame, Drawable leaves submit themselves
+to RENDER_QUEUE instead of drawing; flush() then sorts the items by a
+packed integer key, most significant first:
+
+    pass (4 bits) | shader (12 bits) | texture (16 bits) | depth (32 bits)
+
+so items sharing a program, then a texture, are drawn back to back, front
+to back within a state for early depth rejection, and the sky pass after
+all opaque geometry. Programs and textures are only bound when they
+change, the counters tell how many switches this saved.
+"""
+# External, non built-in modules
+import OpenGL.GL as GL
+import numpy as np
+
+OPAQUE, SKY = 0, 1  # render passes, drawn in this order
+SHADER_SHIFT, TEXTURE_SHIFT, PASS_SHIFT = 48, 32, 60
+MAX_SHADERS, MAX_TEXTURES = 1 << 12, 1 << 16
+
+
+class Drawable:
+    """ Scene graph leaf drawn through RENDER_QUEUE when it records a frame,
+        right away otherwise. Subclasses have a shader and a texture bound
+        on unit 0 for them (None if they bind their own textures), and a
+        render(projection, view, model, primitives) method drawing with
+        both already bound. """
+    render_pass = OPAQUE
+    texture = None
+
+    def draw(self, projection, view, model, primitives=GL.GL_TRIANGLES):
+        if RENDER_QUEUE.recording:
+            RENDER_QUEUE.submit(self, projection, view, model, primitives)
+        else:
+            RENDER_QUEUE.draw_items([(0, self, projection, view, model, primitives)])
+
+
+class RenderQueue:
+    """ Draw items of a frame, sorted by state and depth before drawing """
+
+    def __init__(self):
+        self.items, self.recording = [], False
+        self.shader_ranks, self.texture_ranks = {}, {}
+        self.draws = self.shader_binds = self.shader_skips = self.texture_binds = self.texture_skips = 0
+
+    def begin(self):
+        """ start recording the draws of a frame """
+        self.items.clear()
+        self.recording = True
+        self.draws = self.shader_binds = self.shader_skips = self.texture_binds = self.texture_skips = 0
+
+    def rank(self, ranks, state, limit):
+        """ small integer of a shader or texture, in first seen order """
+        return ranks.setdefault(state, len(ranks) % limit)
+
+    def submit(self, drawable, projection, view, model, primitives=GL.GL_TRIANGLES):
+        """ queue drawable, keyed by its pass, state and view depth """
+        texture = drawable.texture
+        depth = max(-(view[2, :3] @ model[:3, 3] + view[2, 3]), 0)  # distance in front of the camera
+        key = (drawable.render_pass << PASS_SHIFT |
+               self.rank(self.shader_ranks, drawable.shader, MAX_SHADERS) << SHADER_SHIFT |
+               (0 if texture is None else self.rank(self.texture_ranks, texture.glid, MAX_TEXTURES)) << TEXTURE_SHIFT |
+               int(np.float32(depth).view(np.uint32)))  # positive floats order like their bits
+        self.items.append((key, drawable, projection, view, model, primitives))
+
+    def flush(self):
+        """ stop recording and draw the frame's items in key order """
+        self.recording = False
+        self.items.sort(key=lambda item: item[0])
+        self.draw_items(self.items)
+        self.items.clear()
+
+    def draw_items(self, items):
+        shader, bound = None, None  # texture (target, glid) bound on unit 0, None if unknown
+        for _, drawable, projection, view, model, primitives in items:
+            if drawable.shader is not shader:
+                shader = drawable.shader
+                GL.glUseProgram(shader.glid)
+                self.shader_binds += 1
+            else:
+                self.shader_skips += 1
+            texture = drawable.texture
+            if texture is not None:
+                if (texture.target, texture.glid) != bound:
+                    if bound is not None and bound[0] != texture.target:
+                        GL.glBindTexture(bound[0], 0)
+                    bound = texture.target, texture.glid
+                    GL.glActiveTexture(GL.GL_TEXTURE0)
+                    GL.glBindTexture(*bound)
+                    self.texture_binds += 1
+                else:
+                    self.texture_skips += 1
+            drawable.render(projection, view, model, primitives)
+            if texture is None:  # it bound its own textures
+                bound = None
+            self.draws += 1
+
+        # leave clean state for easier debugging
+        if bound is not None:
+            GL.glBindTexture(bound[0], 0)
+        GL.glUseProgram(0)
+
+    def report(self):
+        return 'Render queue: %d draws, %d program switches (%d avoided), %d texture binds (%d avoided)' % (
+            self.draws, self.shader_binds, self.shader_skips, self.texture_binds, self.texture_skips)
+
+
+RENDER_QUEUE = RenderQueue()  # process wide queue recorded by the Viewer
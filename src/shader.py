@@ -1,11 +1,42 @@
 import os
 import sys
 import OpenGL.GL as GL
+import numpy as np
+
+
+def matrix_setter(setter):
+    """ glUniformMatrix*fv setter taking numpy's row major matrices """
+    return lambda location, count, value: setter(location, count, True, value)
+
+
+# uniform type: (components per element, numpy dtype, glUniform*v setter)
+UNIFORM_TYPES = {
+    GL.GL_FLOAT: (1, np.float32, GL.glUniform1fv),
+    GL.GL_FLOAT_VEC2: (2, np.float32, GL.glUniform2fv),
+    GL.GL_FLOAT_VEC3: (3, np.float32, GL.glUniform3fv),
+    GL.GL_FLOAT_VEC4: (4, np.float32, GL.glUniform4fv),
+    GL.GL_INT: (1, np.int32, GL.glUniform1iv),
+    GL.GL_INT_VEC2: (2, np.int32, GL.glUniform2iv),
+    GL.GL_INT_VEC3: (3, np.int32, GL.glUniform3iv),
+    GL.GL_INT_VEC4: (4, np.int32, GL.glUniform4iv),
+    GL.GL_BOOL: (1, np.int32, GL.glUniform1iv),
+    GL.GL_SAMPLER_2D: (1, np.int32, GL.glUniform1iv),
+    GL.GL_SAMPLER_2D_ARRAY: (1, np.int32, GL.glUniform1iv),
+    GL.GL_SAMPLER_3D: (1, np.int32, GL.glUniform1iv),
+    GL.GL_SAMPLER_CUBE: (1, np.int32, GL.glUniform1iv),
+    GL.GL_FLOAT_MAT3: (9, np.float32, matrix_setter(GL.glUniformMatrix3fv)),
+    GL.GL_FLOAT_MAT4: (16, np.float32, matrix_setter(GL.glUniformMatrix4fv)),
+}
+
+# binding points of uniform blocks, set by every Shader declaring them
+UNIFORM_BLOCKS = {'Frame': 0}  # see frame.FrameUniforms
 
 
 # ------------ low level OpenGL object wrappers ----------------------------
 class Shader:
-    """ Helper class to create and automatically destroy shader program """
+    """ Helper class to create and automatically destroy shader program.
+        Its active uniforms are looked up once after linking, set_uniform
+        then uploads values by name, skipping those already held. """
 
     @staticmethod
     def _compile_shader(src, shader_type):
@@ -27,6 +58,7 @@ class Shader:
     def __init__(self, vertex_source, fragment_source):
         """ Shader can be initialized with raw strings or source file names """
         self.glid = None
+        self.uniforms, self.values, self.arrays = {}, {}, {}
         vert = self._compile_shader(vertex_source, GL.GL_VERTEX_SHADER)
         frag = self._compile_shader(fragment_source, GL.GL_FRAGMENT_SHADER)
         if vert and frag:
@@ -40,6 +72,54 @@ class Shader:
             if not status:
                 print(GL.glGetProgramInfoLog(self.glid).decode('ascii'))
                 sys.exit(1)
+            self.introspect()
+
+    def introspect(self):
+        """ uniforms of the linked program by name: (location, components,
+            dtype, setter), arrays under their name, 'name[0]' and every
+            'name[i]' element, all listed in arrays[name]. Uniform blocks of
+            UNIFORM_BLOCKS are bound to their binding points. """
+        for block, binding in UNIFORM_BLOCKS.items():
+            index = GL.glGetUniformBlockIndex(self.glid, block)
+            if index != GL.GL_INVALID_INDEX:
+                GL.glUniformBlockBinding(self.glid, index, binding)
+        for index in range(GL.glGetProgramiv(self.glid, GL.GL_ACTIVE_UNIFORMS)):
+            name, size, uniform_type = GL.glGetActiveUniform(self.glid, index)
+            name = name.decode('ascii') if isinstance(name, bytes) else name
+            location = GL.glGetUniformLocation(self.glid, name)
+            if location < 0:  # member of a uniform block
+                continue
+            if uniform_type not in UNIFORM_TYPES:
+                print('WARNING: uniform %s has unsupported type %s, set_uniform ignores it' % (name, uniform_type))
+                continue
+            components, dtype, setter = UNIFORM_TYPES[uniform_type]
+            self.uniforms[name] = location, components, dtype, setter
+            if name.endswith('[0]'):
+                base = name[:-3]
+                self.uniforms[base] = self.uniforms[name]
+                self.arrays[base] = [base] + ['%s[%d]' % (base, i) for i in range(size)]
+                for element in self.arrays[base][2:]:
+                    self.uniforms[element] = (GL.glGetUniformLocation(self.glid, element), components, dtype, setter)
+                for element in self.arrays[base]:
+                    self.arrays[element] = self.arrays[base]
+
+    def set_uniform(self, name, value):
+        """ upload value (scalar, vector, row major matrix, or several of
+            them for an array) to uniform name of the program, which must
+            be in use. Does nothing if the uniform already holds value or
+            is not active in the program. """
+        uniform = self.uniforms.get(name)
+        if uniform is None:
+            return
+        location, components, dtype, setter = uniform
+        value = np.ascontiguousarray(value, dtype)
+        previous = self.values.get(name)
+        if previous is not None and np.array_equal(previous, value):
+            return
+        for alias in self.arrays.get(name, ()):  # other names of the array now hold other values
+            self.values.pop(alias, None)
+        self.values[name] = value.copy()
+        setter(location, max(value.size // components, 1), value)
 
     def __del__(self):
         GL.glUseProgram(0)
@@ -2,6 +2,15 @@
 
 const int NUM_LIGHT_SRC = 4;
 
+// camera, fog and light state of the frame, shared by all shaders (see frame.py)
+layout(std140, row_major) uniform Frame {
+    mat4 view, projection;
+    vec3 w_camera_position;
+    vec3 fog_colour;
+    vec3 light_position[NUM_LIGHT_SRC];
+    vec3 atten_factor[NUM_LIGHT_SRC];
+};
+
 uniform sampler2D diffuse_map;
 in vec2 frag_uv;
 
@@ -16,13 +25,6 @@ uniform vec3 k_a;
 uniform vec3 k_s;
 uniform float s;
 
-// Fog and light properties
-uniform vec3 fog_colour;
-uniform vec3 atten_factor[NUM_LIGHT_SRC];
-
-// world camera position
-uniform vec3 w_camera_position;
-
 out vec4 out_color;
 
 
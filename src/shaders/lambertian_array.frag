@@ -0,0 +1,61 @@
+#version 330 core
+
+const int NUM_LIGHT_SRC = 4;
+
+// camera, fog and light state of the frame, shared by all shaders (see frame.py)
+layout(std140, row_major) uniform Frame {
+    mat4 view, projection;
+    vec3 w_camera_position;
+    vec3 fog_colour;
+    vec3 light_position[NUM_LIGHT_SRC];
+    vec3 atten_factor[NUM_LIGHT_SRC];
+};
+
+uniform sampler2DArray diffuse_map;  // texture.TextureArray, layer given per mesh or vertex
+in vec2 frag_uv;
+flat in float frag_layer;
+
+// fragment position and normal of the fragment, in WORLD coordinates
+in vec3 w_position, w_normal;
+in float visibility;
+in vec3 to_light_vector[NUM_LIGHT_SRC];
+
+// material properties
+uniform vec3 k_d;
+uniform vec3 k_a;
+uniform vec3 k_s;
+uniform float s;
+
+out vec4 out_color;
+
+
+void main() {
+
+    vec3 n = normalize(w_normal);
+    vec3 v = normalize(w_camera_position - w_position);
+
+    vec3 total_diffuse = vec3(0.0);
+    vec3 total_specular = vec3(0.0);
+
+    for(int i = 0; i < NUM_LIGHT_SRC; i++)
+    {
+        float d = length(to_light_vector[i]);
+
+        // 2nd order equation for calculating attenuation factor based on distance
+        float atten = (atten_factor[i].x) + (atten_factor[i].y * d) + (atten_factor[i].z * d * d);
+
+        vec3 unit_light_vector = normalize(to_light_vector[i]);
+        vec3 r = reflect(-unit_light_vector, n);
+
+        // The Phong model parameters
+        vec3 diffuse_color = k_d * max(dot(n, unit_light_vector), 0) * vec3(texture(diffuse_map, vec3(frag_uv, frag_layer)));
+        vec3 specular_color = k_s * pow(max(dot(r, v), 0), s) * vec3(texture(diffuse_map, vec3(frag_uv, frag_layer)));
+
+        // Point Light
+        total_diffuse = total_diffuse + diffuse_color / (atten);
+    }
+
+    out_color = vec4(total_diffuse, 1);
+    out_color = mix(vec4(fog_colour, 1), out_color, visibility);
+
+}
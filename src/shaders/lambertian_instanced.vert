@@ -0,0 +1,63 @@
+#version 330 core
+
+const int NUM_LIGHT_SRC = 4;
+
+// camera, fog and light state of the frame, shared by all shaders (see frame.py)
+layout(std140, row_major) uniform Frame {
+    mat4 view, projection;
+    vec3 w_camera_position;
+    vec3 fog_colour;
+    vec3 light_position[NUM_LIGHT_SRC];
+    vec3 atten_factor[NUM_LIGHT_SRC];
+};
+
+// Fog visibility variables
+const float density = 0.007;
+const float gradient = 1.5;
+
+layout(location = 0) in vec3 position;
+layout(location = 1) in vec2 uvs;
+layout(location = 2) in vec3 normal;
+layout(location = 7) in float layer;  // texture array layer (see texture.TextureLayer)
+layout(location = 3) in mat4 instance_model;  // per instance (see mesh.InstancedMesh)
+
+uniform mat4 model;
+
+// position and normal for the fragment shader, in WORLD coordinates
+out vec3 w_position, w_normal;
+
+out vec2 frag_uv;
+flat out float frag_layer;
+
+out float visibility;
+out vec3 to_light_vector[NUM_LIGHT_SRC];
+
+
+void main() {
+
+    mat4 instance_world = model * instance_model;
+    vec4 worldPosition = instance_world * vec4(position, 1.0);
+    vec4 positionRelativeToCam = view * worldPosition;
+
+    //vec4 w_position4 = model * vec4(position, 1.0);
+    gl_Position = projection * positionRelativeToCam;
+    frag_uv = vec2(uvs.x, uvs.y);
+    frag_layer = layer;
+
+    // compute the vertex position and normal in world or view coordinates
+    w_position =  worldPosition.xyz / worldPosition.w;
+
+    // fragment normal in world coordinates
+    mat3 nit_matrix = transpose(inverse(mat3(instance_world)));
+    w_normal = normalize(nit_matrix * normal);
+
+    // Get the light for all lights' position
+    for(int i = 0;i < NUM_LIGHT_SRC; i++)
+    {
+        to_light_vector[i] = light_position[i] - worldPosition.xyz;
+    }
+
+    float distance = length(positionRelativeToCam.xyz);
+    visibility = exp(-pow((distance * density), gradient));
+    visibility = clamp(visibility, 0.0, 1.0);
+}
@@ -2,6 +2,15 @@
 
 const int NUM_LIGHT_SRC = 4;
 
+// camera, fog and light state of the frame, shared by all shaders (see frame.py)
+layout(std140, row_major) uniform Frame {
+    mat4 view, projection;
+    vec3 w_camera_position;
+    vec3 fog_colour;
+    vec3 light_position[NUM_LIGHT_SRC];
+    vec3 atten_factor[NUM_LIGHT_SRC];
+};
+
 // Fog visibility variables
 const float density = 0.007;
 const float gradient = 1.5;
@@ -9,13 +18,14 @@ const float gradient = 1.5;
 layout(location = 0) in vec3 position;
 layout(location = 1) in vec2 uvs;
 layout(location = 2) in vec3 normal;
+layout(location = 7) in float layer;  // texture array layer (see texture.TextureLayer)
 
-uniform mat4 model, view, projection;
-uniform vec3 light_position[NUM_LIGHT_SRC];
+uniform mat4 model;
 
 // position and normal for the fragment shader, in WORLD coordinates
 out vec3 w_position, w_normal;
 out vec2 frag_uv;
+flat out float frag_layer;
 out float visibility;
 out vec3 to_light_vector[NUM_LIGHT_SRC];
 out vec3 surface_normal;
@@ -28,6 +38,7 @@ void main() {
 
     gl_Position = projection * positionRelativeToCam;
     frag_uv = vec2(uvs.x, uvs.y);
+    frag_layer = layer;
 
     // compute the vertex position and normal in world or view coordinates
     w_position =  worldPosition.xyz / worldPosition.w;
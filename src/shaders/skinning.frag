@@ -2,6 +2,15 @@
 
 const int NUM_LIGHT_SRC = 4;
 
+// camera, fog and light state of the frame, shared by all shaders (see frame.py)
+layout(std140, row_major) uniform Frame {
+    mat4 view, projection;
+    vec3 w_camera_position;
+    vec3 fog_colour;
+    vec3 light_position[NUM_LIGHT_SRC];
+    vec3 atten_factor[NUM_LIGHT_SRC];
+};
+
 // receiving interpolated color for fragment shader
 in vec3 fragment_color;
 in vec2 frag_uv;
@@ -12,9 +21,6 @@ in vec3 w_position, w_normal;
 in vec3 to_light_vector[NUM_LIGHT_SRC];
 in float visibility;
 
-// world camera position
-uniform vec3 w_camera_position;
-
 // material properties
 uniform vec3 k_d, k_a, k_s;
 uniform float s;
@@ -24,10 +30,6 @@ uniform sampler2D diffuse_map;
 // output fragment color for OpenGL
 out vec4 out_color;
 
-// Fog and light properties
-uniform vec3 fog_colour;
-uniform vec3 atten_factor[NUM_LIGHT_SRC];
-
 
 void main() {
     vec3 n = normalize(w_normal);
@@ -2,13 +2,21 @@
 
 const int NUM_LIGHT_SRC = 4;
 
+// camera, fog and light state of the frame, shared by all shaders (see frame.py)
+layout(std140, row_major) uniform Frame {
+    mat4 view, projection;
+    vec3 w_camera_position;
+    vec3 fog_colour;
+    vec3 light_position[NUM_LIGHT_SRC];
+    vec3 atten_factor[NUM_LIGHT_SRC];
+};
+
 // Fog visibility variables
 const float density = 0.007;
 const float gradient = 1.5;
 
 // ---- camera geometry
-uniform mat4 projection, view, model;
-uniform vec3 light_position[NUM_LIGHT_SRC];
+uniform mat4 model;
 
 // ---- skinning globals and attributes
 const int MAX_VERTEX_BONES=4, MAX_BONES=128;
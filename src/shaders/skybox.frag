@@ -1,4 +1,16 @@
 #version 330 core
+
+const int NUM_LIGHT_SRC = 4;
+
+// camera, fog and light state of the frame, shared by all shaders (see frame.py)
+layout(std140, row_major) uniform Frame {
+    mat4 view, projection;
+    vec3 w_camera_position;
+    vec3 fog_colour;
+    vec3 light_position[NUM_LIGHT_SRC];
+    vec3 atten_factor[NUM_LIGHT_SRC];
+};
+
 out vec4 FragColor;
 
 in vec3 TexCoords;
@@ -7,7 +19,6 @@ in float visibility;
 uniform samplerCube skybox;
 uniform samplerCube skybox2;
 
-uniform vec3 sky_color;
 uniform float blend_factor;
 
 const float lower_limit = 0.0;
@@ -24,8 +35,8 @@ void main()
 
     float factor = (TexCoords.y - lower_limit) / (upper_limit - lower_limit);
     factor = clamp(factor, 0.0, 1.0);
-    FragColor = mix(vec4(sky_color, 1), final_color, factor);
+    FragColor = mix(vec4(fog_colour, 1), final_color, factor);
 
-    FragColor = mix(FragColor, vec4(sky_color, 1), visibility);
+    FragColor = mix(FragColor, vec4(fog_colour, 1), visibility);
 
 }
\ No newline at end of file
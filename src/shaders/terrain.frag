@@ -2,11 +2,19 @@
 
 const int NUM_LIGHT_SRC = 4;
 
+// camera, fog and light state of the frame, shared by all shaders (see frame.py)
+layout(std140, row_major) uniform Frame {
+    mat4 view, projection;
+    vec3 w_camera_position;
+    vec3 fog_colour;
+    vec3 light_position[NUM_LIGHT_SRC];
+    vec3 atten_factor[NUM_LIGHT_SRC];
+};
+
 uniform sampler2D diffuse_map;
 uniform sampler2D blue_texture;
 uniform sampler2D red_texture;
 uniform sampler2D blendmap;
-uniform vec3 fog_colour;
 
 in vec2 frag_tex_coords;
 
@@ -15,7 +23,6 @@ out vec4 out_color;
 // Fog variable
 in float visibility;
 in vec3 to_light_vector[NUM_LIGHT_SRC];
-uniform vec3 atten_factor[NUM_LIGHT_SRC];
 
 
 void main() {
@@ -2,9 +2,16 @@
 
 const int NUM_LIGHT_SRC = 4;
 
+// camera, fog and light state of the frame, shared by all shaders (see frame.py)
+layout(std140, row_major) uniform Frame {
+    mat4 view, projection;
+    vec3 w_camera_position;
+    vec3 fog_colour;
+    vec3 light_position[NUM_LIGHT_SRC];
+    vec3 atten_factor[NUM_LIGHT_SRC];
+};
+
 uniform mat4 model;
-uniform mat4 view;
-uniform mat4 projection;
 
 // Terrain attributes
 // (vertices, tex coordinates and normals)
@@ -24,7 +31,6 @@ out vec3 to_light_vector[NUM_LIGHT_SRC];
 //out vec3 surfaceNormal;
 //out vec3 toLightVector;
 //out vec3 toCameraVector;
-uniform vec3 light_position[NUM_LIGHT_SRC];
 
 void main() {
 
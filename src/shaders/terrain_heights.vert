@@ -0,0 +1,58 @@
+#version 330 core
+
+const int NUM_LIGHT_SRC = 4;
+
+// camera, fog and light state of the frame, shared by all shaders (see frame.py)
+layout(std140, row_major) uniform Frame {
+    mat4 view, projection;
+    vec3 w_camera_position;
+    vec3 fog_colour;
+    vec3 light_position[NUM_LIGHT_SRC];
+    vec3 atten_factor[NUM_LIGHT_SRC];
+};
+
+uniform mat4 model;
+
+// Height only terrain: no vertex attributes, gl_VertexID is the vertex
+// row * grid_size + col in the height grid, positions, tex coordinates and
+// normals are rebuilt from it and the heights texture
+uniform sampler2D heightmap;
+uniform int grid_size;
+uniform float spacing;  // world units between two grid vertices
+uniform float extent;   // world units covered by the blend map
+
+out vec2 frag_tex_coords;
+
+// Fog variables
+const float density = 0.010;
+const float gradient = 1.0;
+out float visibility;
+out vec3 to_light_vector[NUM_LIGHT_SRC];
+
+// Lighting effects variables (Unused)
+//out vec3 surfaceNormal;
+
+float height(ivec2 cell) {
+    // same clamping as the padded grid border
+    return texelFetch(heightmap, clamp(cell, ivec2(0), ivec2(grid_size - 1)), 0).r;
+}
+
+void main() {
+    ivec2 cell = ivec2(gl_VertexID % grid_size, gl_VertexID / grid_size);  // (col, row)
+    vec3 position = vec3(cell.x * spacing, height(cell), cell.y * spacing);
+
+    vec4 worldPosition = model * vec4(position, 1.0);
+    vec4 positionRelativeToCam = view * worldPosition;
+
+    gl_Position = projection * positionRelativeToCam;
+    frag_tex_coords = position.xz / extent;
+
+    for(int i = 0;i < NUM_LIGHT_SRC; i++)
+    {
+        to_light_vector[i] = light_position[i] - worldPosition.xyz;
+    }
+
+    float distance = length(positionRelativeToCam.xyz);
+    visibility = exp(-pow((distance * density), gradient));
+    visibility = clamp(visibility, 0.0, 1.0);
+}
@@ -11,6 +11,42 @@ MAX_VERTEX_BONES = 4
 MAX_BONES = 128
 
 
+def vertex_bones(bones, vertex_count, max_vertex_bones=MAX_VERTEX_BONES):
+    """ Per vertex bone ids and weights, from per bone (vertex_ids, weights)
+        pairs (see modelcache). Weights are gathered sparsely, only the
+        max_vertex_bones highest of each vertex are kept (argpartition) and
+        renormalized to sum to 1. Ids are uint8, or uint16 past 256 bones,
+        uploaded as is and read as floats by skinning.vert.
+        Returns (vertex_count, max_vertex_bones) ids and float32 weights. """
+    bones = bones[:MAX_BONES]
+    counts = [len(bone.vertex_ids) for bone in bones]
+    vertex_ids = np.concatenate([bone.vertex_ids for bone in bones] + [np.empty(0, np.intp)]).astype(np.intp)
+    weights = np.concatenate([bone.weights for bone in bones] + [np.empty(0, np.float32)]).astype(np.float32)
+    bone_ids = np.repeat(np.arange(len(bones)), counts)
+
+    # slot of every entry within its vertex, vertices getting as many slots as they have bones
+    order = np.argsort(vertex_ids, kind='stable')
+    vertex_ids, weights, bone_ids = vertex_ids[order], weights[order], bone_ids[order]
+    per_vertex = np.bincount(vertex_ids, minlength=vertex_count)
+    slots = np.arange(len(vertex_ids)) - np.repeat(np.cumsum(per_vertex) - per_vertex, per_vertex)
+    width = max(int(per_vertex.max(initial=0)), max_vertex_bones)
+    dense_weights = np.zeros((vertex_count, width), np.float32)
+    dense_ids = np.zeros((vertex_count, width), np.intp)
+    dense_weights[vertex_ids, slots] = weights
+    dense_ids[vertex_ids, slots] = bone_ids
+
+    # keep the highest weights, then renormalize what is left
+    if width > max_vertex_bones:
+        keep = np.argpartition(-dense_weights, max_vertex_bones - 1, axis=1)[:, :max_vertex_bones]
+        dense_weights = np.take_along_axis(dense_weights, keep, axis=1)
+        dense_ids = np.take_along_axis(dense_ids, keep, axis=1)
+    total = dense_weights.sum(axis=1, keepdims=True)
+    dense_weights = np.divide(dense_weights, total, out=dense_weights, where=total > 0)
+
+    id_type = np.uint8 if len(bones) <= 256 else np.uint16
+    return dense_ids.astype(id_type), dense_weights
+
+
 class SkinnedMesh(Mesh):
     """class of skinned mesh nodes in scene graph """
 
@@ -28,8 +64,7 @@ class SkinnedMesh(Mesh):
         # bone world transform matrices need to be passed for skinning
         world_transforms = [node.world_transform for node in self.bone_nodes]
         bone_matrix = world_transforms @ self.bone_offsets
-        loc = GL.glGetUniformLocation(self.shader.glid, 'bone_matrix')
-        GL.glUniformMatrix4fv(loc, len(self.bone_nodes), True, bone_matrix)
+        self.shader.set_uniform('bone_matrix', bone_matrix)
 
         super().draw(projection, view, model)
 
@@ -5,11 +5,12 @@ Skybox
 import glfw
 import OpenGL.GL as GL
 import numpy as np
-from PIL import Image
 
+from texcache import image_levels
 from vertexarray import VertexArray
 from transform import rotate
 from node import Node
+from renderqueue import Drawable, SKY
 import config
 
 # Skybox vertices
@@ -63,31 +64,31 @@ face_list = [
     "front.jpg", "back.jpg"
 ]
 
+DAY_SKYBOX = "./../resources/skybox/skybox2/"
+NIGHT_SKYBOX = "./../resources/skybox/skybox3/"
+SKYBOXES = (DAY_SKYBOX, NIGHT_SKYBOX)  # baked by texcache
+
+
+class Skybox(Drawable, Node):
+    render_pass = SKY  # drawn after all opaque geometry
 
-class Skybox(Node):
     def __init__(self, shader_skybox):
         super().__init__()
         self.rotation = 0
 
         self.ROTATION_SPEED = 1
-        self.shader_skybox = shader_skybox
+        self.shader = self.shader_skybox = shader_skybox
         self.time = 0
         # self.fog_colour = FogColour()
 
-        day_skybox = "./../resources/skybox/skybox2/"
-        night_skybox = "./../resources/skybox/skybox3/"
-
-        self.day_skybox_texture = self.load_cubemap(texture_file=day_skybox, tex_num=GL.GL_TEXTURE0)
-        self.night_skybox_texture = self.load_cubemap(texture_file=night_skybox, tex_num=GL.GL_TEXTURE1)
+        self.day_skybox_texture = self.load_cubemap(texture_file=DAY_SKYBOX, tex_num=GL.GL_TEXTURE0)
+        self.night_skybox_texture = self.load_cubemap(texture_file=NIGHT_SKYBOX, tex_num=GL.GL_TEXTURE1)
 
         # create vertex array object, bind it
         # Create VBO, bind the new VBO, upload its data to GPU, declare size and type
         # (using the VertexArray class)
         self.vertex_array = VertexArray([skyboxVertices])
 
-        # Get Uniform location of shader program
-        names = ['view', 'projection', 'model', 'blend_factor', 'skybox', 'skybox2', 'sky_color']
-        self.loc = {n: GL.glGetUniformLocation(self.shader_skybox.glid, n) for n in names}
 
     def load_cubemap(self, texture_file, tex_num):
         # Create a cubemap texture, and bind it to proper texture target
@@ -96,11 +97,11 @@ class Skybox(Node):
         GL.glActiveTexture(tex_num)
         GL.glBindTexture(GL.GL_TEXTURE_CUBE_MAP, texture_cubemap)
 
-        # Read all the faces one by one
+        # Read all the faces one by one, raw RGB from the texture cache
         # Specify a 2D texture image for each
         face_list_urls = [texture_file + s for s in face_list]
         for index, face_url in enumerate(face_list_urls):
-            face = np.array(Image.open(face_url))
+            face = image_levels(face_url, mode='RGB', mipmaps=False)[0]
             GL.glTexImage2D(GL.GL_TEXTURE_CUBE_MAP_POSITIVE_X + index, 0, GL.GL_RGB, face.shape[1],
                             face.shape[0], 0, GL.GL_RGB, GL.GL_UNSIGNED_BYTE, face)
             # print("Loaded: ", face_url)
@@ -115,9 +116,7 @@ class Skybox(Node):
         return texture_cubemap
         # --------------------------------------------------------------------------------
 
-    def draw(self, projection, view, model):
-        GL.glUseProgram(self.shader_skybox.glid)
-
+    def render(self, projection, view, model, primitives=GL.GL_TRIANGLES):
         # change depth function so depth test passes when values are equal to depth buffer's content
         GL.glDepthFunc(GL.GL_LEQUAL)
 
@@ -137,9 +136,7 @@ class Skybox(Node):
 
         model = rotate(axis=(0, 1, 0), angle=self.rotation)
 
-        GL.glUniformMatrix4fv(self.loc['view'], 1, True, view)
-        GL.glUniformMatrix4fv(self.loc['projection'], 1, True, projection)
-        GL.glUniformMatrix4fv(self.loc['model'], 1, True, model)
+        self.shader_skybox.set_uniform('model', model)  # view and projection are in the Frame block
 
         # Bind the skybox's VAO
         GL.glBindVertexArray(self.vertex_array.glid)
@@ -194,10 +191,9 @@ class Skybox(Node):
         # Bind the cubemaps' texture
         GL.glActiveTexture(GL.GL_TEXTURE0)
         GL.glBindTexture(GL.GL_TEXTURE_CUBE_MAP, texture1)
-        GL.glUniform1i(self.loc['skybox'], 0)
+        self.shader_skybox.set_uniform('skybox', 0)
         GL.glActiveTexture(GL.GL_TEXTURE1)
         GL.glBindTexture(GL.GL_TEXTURE_CUBE_MAP, texture2)
-        GL.glUniform1i(self.loc['skybox2'], 1)
+        self.shader_skybox.set_uniform('skybox2', 1)
 
-        GL.glUniform1f(self.loc['blend_factor'], blend_factor)
-        GL.glUniform3fv(self.loc['sky_color'], 1, config.fog_colour.get_colour())
+        self.shader_skybox.set_uniform('blend_factor', blend_factor)
@@ -0,0 +1,166 @@
+import math
+import queue
+import threading
+import weakref
+from collections import OrderedDict
+
+import numpy as np
+import OpenGL.GL as GL
+
+from node import Node
+from renderqueue import Drawable
+from texturedplane import TerrainTextures, grid_vertices, grid_normals, grid_indices
+from vertexarray import VertexArray
+
+
+# -------------- Tile generation (worker thread, no GL calls) -----------------
+def generate_tile(heightfield, tile_size, tile_quads, tile_x, tile_z):
+    """ World space vertex attributes of the tile_size wide tile (tile_x, tile_z),
+        sampled from the heightfield. Normals use one extra ring of samples so
+        they are continuous across tile borders. Uvs address the blend map
+        over the heightfield extent, like TexturedPlane's. """
+    spacing = tile_size / tile_quads
+    x0, z0 = tile_x * tile_size, tile_z * tile_size
+    steps = np.arange(-1, tile_quads + 2) * spacing
+    xs, zs = np.meshgrid(x0 + steps, z0 + steps)
+    ring = heightfield.heights_at(xs, zs)
+
+    side = tile_quads + 1
+    vertices, _ = grid_vertices(ring[1:-1, 1:-1], extent=tile_size)
+    vertices[:, 0] += x0
+    vertices[:, 2] += z0
+    texture_coords = np.stack(((vertices[:, 0] - heightfield.origin[0]) / heightfield.extent,
+                               (vertices[:, 2] - heightfield.origin[2]) / heightfield.extent), axis=1)
+    normals = grid_normals(ring.T).reshape(side + 2, side + 2, 3)[1:-1, 1:-1].reshape(-1, 3)
+    return dict(vertices=vertices, texture_coords=texture_coords.astype(np.float32), normals=normals,
+                indices=grid_indices(side))
+
+
+def generate_tiles(terrain_ref, requests, ready):
+    """ worker loop: generate the requested tiles the terrain still wants,
+        until None is requested or the terrain is gone. The terrain is only
+        held while generating, so dropping it stops the worker (see
+        StreamedTerrain.__del__) """
+    while True:
+        key = requests.get()
+        terrain = terrain_ref()
+        if key is None or terrain is None:
+            return
+        arrays = None
+        if key in terrain.wanted:  # camera may have moved on since the request
+            arrays = generate_tile(terrain.heightfield, terrain.tile_size, terrain.tile_quads, *key)
+        del terrain
+        while True:  # blocks while the render thread catches up
+            try:
+                ready.put((key, arrays), timeout=0.1)
+                break
+            except queue.Full:
+                if terrain_ref() is None:
+                    return
+
+
+class TerrainTile:
+    """ A resident tile: its GPU buffers and their size in bytes """
+
+    def __init__(self, key, arrays):
+        self.key = key
+        self.vertex_array = VertexArray([arrays['vertices'], arrays['texture_coords'], arrays['normals']],
+                                        arrays['indices'])
+        self.nbytes = sum(array.nbytes for array in arrays.values())
+
+
+# -------------- Terrain streamed in tiles around the camera ------------------
+class StreamedTerrain(TerrainTextures, Drawable, Node):
+    """ Terrain for worlds larger than one plane: tile_size wide tiles within
+        radius of the camera are generated by a worker thread and handed
+        back through a bounded queue, the render thread uploads at most
+        uploads_per_frame of them per frame so crossing tile borders never
+        stalls. Resident tiles are kept in LRU order, tiles out of radius are
+        evicted (least recently drawn first) once memory_budget bytes of
+        vertex data are in use. The worker stops with stop(), or once the
+        terrain is garbage collected. Tiles are in the heightfield's world
+        coordinates, moved by the node transforms like any mesh: the camera
+        position is mapped back to them to pick the tiles. Drawn instead of
+        the ChunkedTerrain when config.streamed_terrain is set. """
+
+    def __init__(self, background_texture_file, road_texture_file, road2_texture_file, blendmap_file, shader,
+                 heightfield, tile_size=100, tile_quads=64, radius=300, memory_budget=32 << 20,
+                 queue_size=4, uploads_per_frame=2):
+        super().__init__()
+        self.shader = shader
+        self.heightfield = heightfield
+        self.tile_size = tile_size
+        self.tile_quads = tile_quads
+        self.radius = radius
+        self.memory_budget = memory_budget
+        self.uploads_per_frame = uploads_per_frame
+
+        self.setup_textures(shader, background_texture_file, road_texture_file, road2_texture_file, blendmap_file)
+
+        self.tiles = OrderedDict()  # resident tiles, least recently drawn first
+        self.nbytes = 0
+        self.wanted = frozenset()  # tiles in radius, replaced (never mutated) every frame
+        self.requested = set()  # tiles queued or being generated, render thread only
+        self.requests = queue.Queue()
+        self.ready = queue.Queue(maxsize=queue_size)
+        self.worker = threading.Thread(target=generate_tiles, args=(weakref.ref(self), self.requests, self.ready),
+                                       daemon=True)
+        self.worker.start()
+
+    def stop(self):
+        """ stop the worker thread, tiles requested so far are dropped """
+        self.requests.put(None)
+
+    def __del__(self):
+        self.stop()
+
+    def tiles_in_radius(self, position):
+        """ tile keys whose center lies within radius, nearest first """
+        x, z = position[0] / self.tile_size - 0.5, position[2] / self.tile_size - 0.5
+        reach = int(math.ceil(self.radius / self.tile_size))
+        candidates = [(tile_x, tile_z) for tile_x in range(math.floor(x) - reach, math.floor(x) + reach + 2)
+                      for tile_z in range(math.floor(z) - reach, math.floor(z) + reach + 2)]
+        distances = {key: math.hypot(key[0] - x, key[1] - z) * self.tile_size for key in candidates}
+        return sorted((key for key in candidates if distances[key] <= self.radius), key=distances.get)
+
+    def update_tiles(self, position):
+        """ request missing tiles around position (in terrain coordinates),
+            upload finished ones, evict over budget """
+        wanted = self.tiles_in_radius(position)
+        self.wanted = frozenset(wanted)
+        for key in wanted:
+            if key in self.tiles:
+                self.tiles.move_to_end(key)
+            elif key not in self.requested:
+                self.requested.add(key)
+                self.requests.put(key)
+
+        for _ in range(self.uploads_per_frame):
+            try:
+                key, arrays = self.ready.get_nowait()
+            except queue.Empty:
+                break
+            self.requested.discard(key)
+            if arrays is not None and key not in self.tiles:
+                tile = self.tiles[key] = TerrainTile(key, arrays)
+                self.nbytes += tile.nbytes
+
+        for key in list(self.tiles):
+            if self.nbytes <= self.memory_budget:
+                break
+            if key not in self.wanted:
+                self.nbytes -= self.tiles.pop(key).nbytes
+
+    def render(self, projection, view, model, primitives=GL.GL_TRIANGLES):
+        model = model @ self.transform
+        self.update_tiles((np.linalg.inv(model) @ np.linalg.inv(view)[:, 3])[:3])  # camera in terrain coordinates
+
+        # texture access setups
+        self.bind_textures()
+        self.connect_texture_units()
+
+        self.shader.set_uniform('model', model)
+
+        for key, tile in self.tiles.items():
+            if key in self.wanted:
+                tile.vertex_array.execute(primitives)
@@ -0,0 +1,330 @@
+import ctypes
+
+import numpy as np
+import OpenGL.GL as GL
+
+from culling import Bounds, CULLING, box_outside
+from loading import on_gl_thread, releases_gl
+from texturedplane import TexturedPlane, grid_vertices, grid_normals
+
+# tile edges, in the bit order used by the stitched index variants
+NORTH, EAST, SOUTH, WEST = 1, 2, 4, 8
+
+
+# -------------- Geomipmapping index sets -------------------------------------
+def tile_indices(tile_quads, step, coarser_edges=0, stride=None):
+    """ Triangles of one (tile_quads + 1)^2 vertex tile sampled every `step`
+        vertices. Edges flagged in coarser_edges border a tile one level
+        coarser: their odd vertices collapse onto the previous even one, so
+        the edge matches the neighbour's and no crack opens along the seam.
+        Vertex (row, col) is row * stride + col, stride defaulting to the
+        tile side (tile major vertices) """
+    stride = stride or tile_quads + 1
+    rows, cols = np.meshgrid(np.arange(0, tile_quads, step), np.arange(0, tile_quads, step), indexing='ij')
+    r, c = rows.reshape(-1, 1), cols.reshape(-1, 1)
+    # same (tl, bl, tr), (tr, bl, br) winding as the full resolution grid
+    tri_rows = np.hstack((r, r + step, r, r, r + step, r + step))
+    tri_cols = np.hstack((c, c, c + step, c + step, c, c + step))
+
+    def odd(values):
+        return (values // step) % 2 == 1
+
+    if coarser_edges & NORTH:
+        tri_cols[(tri_rows == 0) & odd(tri_cols)] -= step
+    if coarser_edges & SOUTH:
+        tri_cols[(tri_rows == tile_quads) & odd(tri_cols)] -= step
+    if coarser_edges & WEST:
+        tri_rows[(tri_cols == 0) & odd(tri_rows)] -= step
+    if coarser_edges & EAST:
+        tri_rows[(tri_cols == tile_quads) & odd(tri_rows)] -= step
+
+    # drop the triangles the collapse flattened (zero area in the grid plane)
+    tri_rows, tri_cols = tri_rows.reshape(-1, 3), tri_cols.reshape(-1, 3)
+    area = ((tri_cols[:, 1] - tri_cols[:, 0]) * (tri_rows[:, 2] - tri_rows[:, 0]) -
+            (tri_cols[:, 2] - tri_cols[:, 0]) * (tri_rows[:, 1] - tri_rows[:, 0]))
+    return (tri_rows * stride + tri_cols)[area != 0].astype(np.int32).ravel()
+
+
+# -------------- Quadtree over the terrain tiles ------------------------------
+class TerrainQuad:
+    """ Quadtree node over a rectangle of tiles, leaves are single tiles.
+        Tiles are numbered in tree order, so every node covers the
+        contiguous range [first, last) of the tile arrays """
+
+    def __init__(self, tz0, tx0, tz1, tx1, order):
+        self.first = len(order)
+        self.children = []
+        if tz1 - tz0 == 1 and tx1 - tx0 == 1:
+            order.append((tz0, tx0))
+        else:
+            tz_mid, tx_mid = (tz0 + tz1 + 1) // 2, (tx0 + tx1 + 1) // 2
+            for z_range in ((tz0, tz_mid), (tz_mid, tz1)):
+                for x_range in ((tx0, tx_mid), (tx_mid, tx1)):
+                    if z_range[0] < z_range[1] and x_range[0] < x_range[1]:
+                        self.children.append(TerrainQuad(z_range[0], x_range[0], z_range[1], x_range[1], order))
+        self.last = len(order)
+        self.bounds = None
+
+    def compute_bounds(self, tile_bounds):
+        """ axis aligned (min, max) corners, from the per tile bounds """
+        self.bounds = (tile_bounds[0][self.first:self.last].min(axis=0),
+                       tile_bounds[1][self.first:self.last].max(axis=0))
+        for child in self.children:
+            child.compute_bounds(tile_bounds)
+
+
+def build_quadtree(tiles_per_side):
+    """ quadtree root over a square of tiles, and the (row, col) of each tile in tree order """
+    order = []
+    root = TerrainQuad(0, 0, tiles_per_side, tiles_per_side, order)
+    return root, np.array(order)
+
+
+def tile_bounds(heights, tile_grid, tile_quads, spacing):
+    """ (min, max) corners of every tile of a padded height grid, in tile order """
+    low, high = np.empty((len(tile_grid), 3), np.float32), np.empty((len(tile_grid), 3), np.float32)
+    for tile, (tz, tx) in enumerate(tile_grid):
+        block = heights[tz * tile_quads:(tz + 1) * tile_quads + 1, tx * tile_quads:(tx + 1) * tile_quads + 1]
+        low[tile] = tx * tile_quads * spacing, block.min(), tz * tile_quads * spacing
+        high[tile] = (tx + 1) * tile_quads * spacing, block.max(), (tz + 1) * tile_quads * spacing
+    return low, high
+
+
+# -------------- Height only terrain vertex data ------------------------------
+class HeightTexture:
+    """ Single channel float texture of a height grid, fetched texel by texel
+        (no filtering) by shaders/terrain_heights.vert """
+
+    @on_gl_thread
+    def __init__(self, heights):
+        self.glid = GL.glGenTextures(1)
+        self.shape = heights.shape
+        GL.glBindTexture(GL.GL_TEXTURE_2D, self.glid)
+        GL.glTexImage2D(GL.GL_TEXTURE_2D, 0, GL.GL_R32F, heights.shape[1], heights.shape[0], 0,
+                        GL.GL_RED, GL.GL_FLOAT, np.ascontiguousarray(heights, np.float32))
+        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_WRAP_S, GL.GL_CLAMP_TO_EDGE)
+        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_WRAP_T, GL.GL_CLAMP_TO_EDGE)
+        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MAG_FILTER, GL.GL_NEAREST)
+        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MIN_FILTER, GL.GL_NEAREST)
+
+    def update(self, heights):
+        """ replace the heights in place, the grid size can not change """
+        assert heights.shape == self.shape, 'height grid is %s, got %s' % (self.shape, heights.shape)
+        GL.glBindTexture(GL.GL_TEXTURE_2D, self.glid)
+        GL.glTexSubImage2D(GL.GL_TEXTURE_2D, 0, 0, 0, heights.shape[1], heights.shape[0],
+                           GL.GL_RED, GL.GL_FLOAT, np.ascontiguousarray(heights, np.float32))
+
+    @releases_gl
+    def __del__(self):  # delete GL texture from GPU when object dies
+        GL.glDeleteTextures(self.glid)
+
+
+# -------------- Chunked terrain with distance based LOD ----------------------
+class ChunkedTerrain(TexturedPlane):
+    """ TexturedPlane split into tiles of tile_quads^2 quads. All tiles share
+        one vertex buffer (tile after tile) and one index buffer holding the
+        geomipmap index sets of every (level, stitched edges) variant, so the
+        terrain is a single glMultiDrawElementsBaseVertex call per frame.
+        Level l samples every 2^l vertices and is used from
+        lod_distance * 2^(l-1) units away from the camera.
+        With height_only, no vertex buffer is uploaded at all: the padded
+        height grid goes to a float texture (4 bytes per vertex instead of
+        32) and the shader (shaders/terrain_heights.vert) rebuilds
+        positions, uvs and normals from gl_VertexID, which index sets and
+        base vertices make the row * grid_size + col of the grid vertex. """
+
+    def __init__(self, background_texture_file, road_texture_file, road2_texture_file, blendmap_file, shader,
+                 heightfield, resolution=None, tile_quads=64, lod_distance=None, height_only=False):
+        assert tile_quads & (tile_quads - 1) == 0, 'tile_quads must be a power of two'
+        self.tile_quads = tile_quads
+        self.tile_side = tile_quads + 1
+        self.max_lod = int(np.log2(tile_quads))
+        self.lod_distance = lod_distance
+        self.height_only = height_only
+        self.triangles_drawn = 0
+
+        super().__init__(background_texture_file, road_texture_file, road2_texture_file, blendmap_file, shader,
+                         heightfield, resolution)
+
+        if height_only:
+            self.height_texture = HeightTexture(self.heights)
+
+    def cache_parameters(self):
+        return super().cache_parameters() + (self.tile_quads, self.height_only)
+
+    def setup_attributes(self, arrays):
+        super().setup_attributes(arrays)
+        self.tiles_per_side = -(-(self.HMAP_SIZE - 1) // self.tile_quads)
+        self.grid_size = self.tiles_per_side * self.tile_quads + 1
+        self.spacing = self.size / (self.HMAP_SIZE - 1)
+        self.quadtree, self.tile_grid = build_quadtree(self.tiles_per_side)
+        self.quadtree.compute_bounds((arrays['tile_min'], arrays['tile_max']))
+        if self.lod_distance is None:
+            self.lod_distance = 2 * self.tile_quads * self.spacing
+
+        # every index variant is stored back to back, looked up by lod * 16 + coarser edges
+        self.variant_counts = np.array(arrays['variant_counts'])
+        self.variant_offsets = (np.cumsum(self.variant_counts) - self.variant_counts) * np.dtype(np.int32).itemsize
+
+        # first vertex of each tile: its offset in the tile major buffer, or
+        # its corner in the height grid for height only tiles
+        if self.height_only:
+            self.heights = arrays['heights']
+            corners = self.tile_grid * self.tile_quads
+            self.base_vertices = (corners[:, 0] * self.grid_size + corners[:, 1]).astype(np.int32)
+        else:
+            self.base_vertices = np.arange(len(self.tile_grid), dtype=np.int32) * self.tile_side ** 2
+
+    def vertex_attributes(self, arrays):
+        return [] if self.height_only else super().vertex_attributes(arrays)
+
+    def create_attributes(self, heights):
+        return self.create_tiles(heights, extent=self.size)
+
+    def pad_heights(self, heights):
+        """ heights padded (repeating the map border) up to a whole number of tiles """
+        tiles_per_side = -(-(heights.shape[0] - 1) // self.tile_quads)
+        grid_size = tiles_per_side * self.tile_quads + 1
+        return np.pad(heights, (0, grid_size - heights.shape[0]), mode='edge')
+
+    def create_tiles(self, heights, extent=1000):
+        """ tile major vertex attributes (or the padded height grid when
+            height_only), tile bounds and the index variants of all levels """
+        size = heights.shape[0]
+        spacing = extent / (size - 1)
+        padded = self.pad_heights(heights)
+        grid_size = padded.shape[0]
+        tiles_per_side = (grid_size - 1) // self.tile_quads
+
+        if self.height_only:
+            _, tile_grid = build_quadtree(tiles_per_side)
+            tile_min, tile_max = tile_bounds(padded, tile_grid, self.tile_quads, spacing)
+            variants = [tile_indices(self.tile_quads, 2 ** lod, edges if lod < self.max_lod else 0, grid_size)
+                        for lod in range(self.max_lod + 1) for edges in range(16)]
+            return dict(heights=padded.astype(np.float32), indices=np.concatenate(variants),
+                        variant_counts=np.array([indices.size for indices in variants], np.int32),
+                        tile_min=tile_min, tile_max=tile_max)
+
+        vertices, texture_coords = grid_vertices(padded, extent=spacing * (grid_size - 1))
+        texture_coords *= (grid_size - 1) / (size - 1)  # keep uvs in [0, 1] over the original map
+        normals = grid_normals(padded)
+
+        # tiles in quadtree order, each gathering its own copy of its vertices
+        _, tile_grid = build_quadtree(tiles_per_side)
+        local = np.arange(self.tile_side)
+        tile_rows = (tile_grid[:, :1] * self.tile_quads + local).repeat(self.tile_side, axis=1)
+        tile_cols = np.tile(tile_grid[:, 1:] * self.tile_quads + local, self.tile_side)
+        tile_ids = (tile_rows * grid_size + tile_cols).ravel()
+        vertices, texture_coords, normals = vertices[tile_ids], texture_coords[tile_ids], normals[tile_ids]
+        tile_vertices = vertices.reshape(len(tile_grid), -1, 3)
+
+        variants = [tile_indices(self.tile_quads, 2 ** lod, edges if lod < self.max_lod else 0)
+                    for lod in range(self.max_lod + 1) for edges in range(16)]
+
+        return dict(vertices=vertices, texture_coords=texture_coords, normals=normals,
+                    indices=np.concatenate(variants),
+                    variant_counts=np.array([indices.size for indices in variants], np.int32),
+                    tile_min=tile_vertices.min(axis=1), tile_max=tile_vertices.max(axis=1))
+
+    def set_heights(self, heights):
+        """ Swap in a new HMAP_SIZE^2 grid of heights at runtime (height_only
+            terrain): one texture upload, tile bounds are recomputed for LOD
+            selection, index buffers are unchanged """
+        assert self.height_only, 'only height_only terrain can swap its heights'
+        self.heights = self.pad_heights(np.asarray(heights, np.float32))
+        self.height_texture.update(self.heights)
+        self.quadtree.compute_bounds(tile_bounds(self.heights, self.tile_grid, self.tile_quads, self.spacing))
+        self.bounds = Bounds(*self.quadtree.bounds)
+
+    def geometry_bounds(self, arrays):
+        return Bounds(*self.quadtree.bounds)
+
+    def visible_tiles(self, planes):
+        """ mask of the tiles intersecting the frustum planes (in terrain
+            coordinates, see culling.frustum_planes), walking down the
+            quadtree only where its nodes straddle a plane """
+        if planes is None:
+            return np.ones(len(self.tile_grid), bool)
+        visible = np.zeros(len(self.tile_grid), bool)
+        stack = [self.quadtree]
+        while stack:
+            node = stack.pop()
+            low, high = node.bounds
+            center, extent = (low + high) / 2, (high - low) / 2
+            if box_outside(planes, center, extent):
+                continue
+            inside = np.all(planes[:, :3] @ center + planes[:, 3] - np.abs(planes[:, :3]) @ extent >= 0)
+            if inside or not node.children:
+                visible[node.first:node.last] = True
+            else:
+                stack.extend(node.children)
+        CULLING.tiles_drawn += int(visible.sum())
+        CULLING.tiles_culled += len(visible) - int(visible.sum())
+        return visible
+
+    def lod_at(self, distance):
+        """ geomipmap level to use at a given distance from the camera """
+        if distance < self.lod_distance:
+            return 0
+        return min(int(np.log2(distance / self.lod_distance)) + 1, self.max_lod)
+
+    def select_lods(self, camera_position):
+        """ Level of every tile: quadtree nodes whose nearest and farthest
+            points fall in the same level are resolved at once, then levels
+            are relaxed so that neighbouring tiles differ by at most one """
+        lods = np.empty(len(self.tile_grid), np.int32)
+        stack = [self.quadtree]
+        while stack:
+            node = stack.pop()
+            low, high = node.bounds
+            near = np.linalg.norm(np.maximum(np.maximum(low - camera_position, camera_position - high), 0))
+            far = np.linalg.norm(np.maximum(np.abs(low - camera_position), np.abs(high - camera_position)))
+            lod = self.lod_at(near)
+            if not node.children or lod == self.max_lod or lod == self.lod_at(far):
+                lods[node.first:node.last] = lod
+            else:
+                stack.extend(node.children)
+
+        grid = np.empty((self.tiles_per_side, self.tiles_per_side), np.int32)
+        grid[self.tile_grid[:, 0], self.tile_grid[:, 1]] = lods
+        for _ in range(self.max_lod):
+            padded = np.pad(grid, 1, mode='constant', constant_values=self.max_lod)
+            limit = np.minimum(np.minimum(padded[:-2, 1:-1], padded[2:, 1:-1]),
+                               np.minimum(padded[1:-1, :-2], padded[1:-1, 2:])) + 1
+            relaxed = np.minimum(grid, limit)
+            if np.array_equal(relaxed, grid):
+                break
+            grid = relaxed
+
+        padded = np.pad(grid, 1, mode='constant', constant_values=-1)  # map border never needs stitching
+        coarser = ((padded[:-2, 1:-1] > grid) * NORTH | (padded[1:-1, 2:] > grid) * EAST |
+                   (padded[2:, 1:-1] > grid) * SOUTH | (padded[1:-1, :-2] > grid) * WEST)
+        tz, tx = self.tile_grid[:, 0], self.tile_grid[:, 1]
+        return grid[tz, tx], coarser[tz, tx]
+
+    def render(self, projection, view, model, primitives=GL.GL_TRIANGLES):
+        # texture access setups
+        self.bind_textures()
+        self.connect_texture_units()
+
+        self.shader.set_uniform('model', model)
+        if self.height_only:
+            GL.glActiveTexture(GL.GL_TEXTURE4)
+            GL.glBindTexture(GL.GL_TEXTURE_2D, self.height_texture.glid)
+            self.shader.set_uniform('heightmap', 4)
+            self.shader.set_uniform('grid_size', self.grid_size)
+            self.shader.set_uniform('spacing', self.spacing)
+            self.shader.set_uniform('extent', self.size)
+
+        # camera position in terrain coordinates picks the level of each tile
+        camera_position = (np.linalg.inv(model) @ np.linalg.inv(view)[:, 3])[:3]
+        lods, coarser = self.select_lods(camera_position)
+        visible = self.visible_tiles(None if CULLING.planes is None else CULLING.planes @ model)
+        variants = (lods * 16 + coarser)[visible]
+        counts = self.variant_counts[variants]
+        offsets = (ctypes.c_void_p * len(variants))(*self.variant_offsets[variants].tolist())
+        self.triangles_drawn = int(counts.sum()) // 3
+
+        GL.glBindVertexArray(self.vertex_array.glid)
+        GL.glMultiDrawElementsBaseVertex(primitives, counts, GL.GL_UNSIGNED_INT, offsets, len(variants),
+                                         np.ascontiguousarray(self.base_vertices[visible]))
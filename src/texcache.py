@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+On-disk cache of decoded textures.
+
+Decoding the JPEG/PNG/TGA files with PIL and letting the driver build
+their mipmaps dominates texture loading, so Texture and the Skybox go
+through image_levels() instead: the image is decoded once, converted to
+the uploaded pixel format, its mip chain built (2x2 box filter, as
+glGenerateMipmap does) and every level saved raw with cache.save_arrays.
+Later runs memory map the levels and upload them one by one, without
+decoding anything. Entries are keyed by the image file's mtime and size.
+Running this module bakes the cache of every image of the resources:
+
+    python3 texcache.py [files or directories...]
+"""
+# Python built-in modules
+import os
+import sys
+
+# External, non built-in modules
+import numpy as np
+from PIL import Image
+
+from cache import ArrayCache, cache_key
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.tga', '.bmp')
+RESOURCES = "./../resources"
+AUTO_MODES = ('L', 'RGB', 'RGBA')  # smallest first, see fitting_mode
+
+
+def fitting_mode(image, modes):
+    """ first of the PIL modes able to hold image without loss ('L' if it
+        is opaque grey, 'RGB' if opaque) with the image pixels in it """
+    rgba = np.asarray(image.convert('RGBA'))
+    opaque = (rgba[..., 3] == 255).all()
+    grey = opaque and (rgba[..., 0] == rgba[..., 1]).all() and (rgba[..., 0] == rgba[..., 2]).all()
+    for mode in modes:
+        if mode == 'RGBA' or (mode == 'RGB' and opaque) or (mode == 'L' and grey):
+            return mode, rgba[..., :len(mode)]
+    return modes[-1], np.asarray(image.convert(modes[-1]))
+
+
+def mip_chain(image):
+    """ image (height, width, channels) followed by its successive halvings
+        down to 1x1, each texel the rounded mean of the 2x2 (or 2x1 on a
+        single row or column) texels below it """
+    levels = [image]
+    while max(levels[-1].shape[:2]) > 1:
+        level, count = levels[-1].astype(np.uint16), 1
+        if level.shape[0] > 1:
+            rows = level.shape[0] // 2 * 2
+            level, count = level[0:rows:2] + level[1:rows:2], count * 2
+        if level.shape[1] > 1:
+            columns = level.shape[1] // 2 * 2
+            level, count = level[:, 0:columns:2] + level[:, 1:columns:2], count * 2
+        levels.append(((level + count // 2) // count).astype(np.uint8))
+    return levels
+
+
+def image_levels(tex_file, mode='RGBA', mipmaps=True):
+    """ Pixels of tex_file converted to PIL mode, or to the first of a
+        tuple of modes holding them losslessly (see fitting_mode), as a
+        list of (height, width, channels) uint8 levels: the full image then
+        its mip chain if mipmaps. Memory mapped from the cache unless the
+        file changed. Raises FileNotFoundError if there is no such file. """
+    status = os.stat(tex_file)
+    name = os.path.splitext(os.path.basename(tex_file))[0]
+    cache = ArrayCache('Texture-%s-%s' % (name, cache_key(os.path.abspath(tex_file), mode, mipmaps)[:8]))
+
+    def decode():
+        image = Image.open(tex_file)
+        image = fitting_mode(image, mode)[1] if isinstance(mode, tuple) else np.asarray(image.convert(mode))
+        image = image.reshape(image.shape[0], image.shape[1], -1)
+        return {'level%d' % level: pixels for level, pixels in enumerate(mip_chain(image) if mipmaps else [image])}
+
+    arrays = cache.get(cache_key(status.st_mtime_ns, status.st_size), decode)
+    return [arrays['level%d' % level] for level in range(len(arrays))]
+
+
+def image_files(paths):
+    """ image files given or found below the directories given """
+    for path in paths:
+        if os.path.isdir(path):
+            for directory, _, names in os.walk(path, followlinks=True):
+                yield from (os.path.join(directory, name) for name in sorted(names)
+                            if name.lower().endswith(IMAGE_EXTENSIONS))
+        else:
+            yield path
+
+
+def main():
+    """ bake the cache of the images named on the command line, or of all
+        the resources: textures (smallest format, with mipmaps) and skybox faces """
+    from skybox import SKYBOXES, face_list  # only needed here
+    files = list(image_files(sys.argv[1:] or [RESOURCES]))
+    for index, tex_file in enumerate(files):
+        levels = image_levels(tex_file, AUTO_MODES)
+        print('%4d/%d  %-70s %dx%d %s, %d levels' % (index + 1, len(files), tex_file, levels[0].shape[1],
+                                                      levels[0].shape[0], AUTO_MODES[levels[0].shape[2] // 2],
+                                                      len(levels)))
+    for skybox in SKYBOXES:
+        for face in face_list:
+            image_levels(skybox + face, mode='RGB', mipmaps=False)
+
+
+if __name__ == '__main__':
+    main()
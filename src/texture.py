@@ -1,29 +1,192 @@
+import os
+import weakref
+
 import OpenGL.GL as GL
 import numpy as np
-from PIL import Image
+
+from loading import SingleFlight, on_gl_thread, releases_gl
+from texcache import image_levels, AUTO_MODES
+
+# ------------ pixel formats, by channel count ---------------------------------
+# (internal format, sRGB internal format, pixel format); single channel
+# images are swizzled to grey so shaders sample them like RGB ones
+FORMATS = {1: (GL.GL_R8, None, GL.GL_RED),
+           3: (GL.GL_RGB8, GL.GL_SRGB8, GL.GL_RGB),
+           4: (GL.GL_RGBA8, GL.GL_SRGB8_ALPHA8, GL.GL_RGBA)}
+FORMAT_NAMES = {1: 'R8', 3: 'RGB8', 4: 'RGBA8'}
+GREY_SWIZZLE = (GL.GL_RED, GL.GL_RED, GL.GL_RED, GL.GL_ONE)
+SRGB_MODES = AUTO_MODES[1:]  # there is no sRGB single channel format
+
+
+def texture_modes(srgb=False):
+    """ PIL modes a texture may be decoded to, smallest first """
+    return SRGB_MODES if srgb else AUTO_MODES
+
+
+def upload_formats(channels, srgb=False):
+    """ internal and pixel format of images with that many channels """
+    internal, srgb_internal, pixels = FORMATS[channels]
+    return srgb_internal if srgb else internal, pixels
+
+
+def set_swizzle(target, channels):
+    """ sample single channel textures as grey """
+    if channels == 1:
+        for parameter, source in zip((GL.GL_TEXTURE_SWIZZLE_R, GL.GL_TEXTURE_SWIZZLE_G,
+                                      GL.GL_TEXTURE_SWIZZLE_B, GL.GL_TEXTURE_SWIZZLE_A), GREY_SWIZZLE):
+            GL.glTexParameteri(target, parameter, source)
 
 
 class Texture:
-    """ Helper class to create and automatically destroy textures """
+    """ Helper class to create and automatically destroy textures, stored
+        in the smallest format holding the image: R8 for grey, RGB8 when
+        opaque, RGBA8 otherwise, sRGB ones if srgb """
+    target, layer = GL.GL_TEXTURE_2D, 0  # see TextureLayer
 
     def __init__(self, tex_file, wrap_mode=GL.GL_REPEAT, min_filter=GL.GL_LINEAR,
-                 mag_filter=GL.GL_LINEAR_MIPMAP_LINEAR):
-        self.glid = GL.glGenTextures(1)
+                 mag_filter=GL.GL_LINEAR_MIPMAP_LINEAR, srgb=False):
+        self.file, self.parameters = tex_file, (wrap_mode, min_filter, mag_filter, srgb)  # to pack it later
+        self.format, self.bytes, self.rgba_bytes = None, 0, 0
+        levels = None
         try:
-            # imports image as a numpy array in exactly right format
-            tex = np.asarray(Image.open(tex_file).convert('RGBA'))
+            # mip chain, memory mapped from the texture cache (on the calling thread)
+            levels = image_levels(tex_file, texture_modes(srgb))
+            self.format = FORMAT_NAMES[levels[0].shape[2]]
+            self.bytes = sum(level.nbytes for level in levels)
+            self.rgba_bytes = sum(level.shape[0] * level.shape[1] * 4 for level in levels)
+        except FileNotFoundError:
+            print("ERROR: unable to load texture file %s" % tex_file)
+        self.upload(levels, wrap_mode, min_filter, mag_filter, srgb)
+
+    @on_gl_thread
+    def upload(self, levels, wrap_mode, min_filter, mag_filter, srgb=False):
+        self.glid = GL.glGenTextures(1)
+        if levels is not None:
             GL.glBindTexture(GL.GL_TEXTURE_2D, self.glid)
-            GL.glTexImage2D(GL.GL_TEXTURE_2D, 0, GL.GL_RGBA, tex.shape[1],
-                            tex.shape[0], 0, GL.GL_RGBA, GL.GL_UNSIGNED_BYTE, tex)
+            GL.glPixelStorei(GL.GL_UNPACK_ALIGNMENT, 1)  # RGB and R8 rows are not 4 byte aligned
+            internal_format, pixel_format = upload_formats(levels[0].shape[2], srgb)
+            for level, tex in enumerate(levels):  # prebuilt mipmaps, no glGenerateMipmap
+                GL.glTexImage2D(GL.GL_TEXTURE_2D, level, internal_format, tex.shape[1],
+                                tex.shape[0], 0, pixel_format, GL.GL_UNSIGNED_BYTE, tex)
+            GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MAX_LEVEL, len(levels) - 1)
+            set_swizzle(GL.GL_TEXTURE_2D, levels[0].shape[2])
             GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_WRAP_S, wrap_mode)
             GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_WRAP_T, wrap_mode)
             GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MAG_FILTER, min_filter)
             GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MIN_FILTER, mag_filter)
-            GL.glGenerateMipmap(GL.GL_TEXTURE_2D)
             # message = 'Loaded texture %s\t(%s, %s, %s, %s)'
             # print(message % (tex_file, tex.shape, wrap_mode, min_filter, mag_filter))
-        except FileNotFoundError:
-            print("ERROR: unable to load texture file %s" % tex_file)
 
+    @releases_gl
     def __del__(self):  # delete GL texture from GPU when object dies
         GL.glDeleteTextures(self.glid)
+
+
+class TextureArray:
+    """ GL_TEXTURE_2D_ARRAY of same sized images with the same channels,
+        one layer each, formats picked like Texture does. Images are given
+        as their mip levels (see texcache.image_levels). """
+    target = GL.GL_TEXTURE_2D_ARRAY
+
+    def __init__(self, images, wrap_mode=GL.GL_REPEAT, min_filter=GL.GL_LINEAR,
+                 mag_filter=GL.GL_LINEAR_MIPMAP_LINEAR, srgb=False):
+        self.layers = len(images)
+        self.upload(images, wrap_mode, min_filter, mag_filter, srgb)
+
+    @on_gl_thread
+    def upload(self, images, wrap_mode, min_filter, mag_filter, srgb=False):
+        self.glid = GL.glGenTextures(1)
+        GL.glBindTexture(GL.GL_TEXTURE_2D_ARRAY, self.glid)
+        GL.glPixelStorei(GL.GL_UNPACK_ALIGNMENT, 1)
+        channels = images[0][0].shape[2]
+        internal_format, pixel_format = upload_formats(channels, srgb)
+        levels = min(len(layer_levels) for layer_levels in images)
+        for level in range(levels):  # prebuilt mipmaps, no glGenerateMipmap
+            height, width = images[0][level].shape[:2]
+            GL.glTexImage3D(GL.GL_TEXTURE_2D_ARRAY, level, internal_format, width, height, len(images), 0,
+                            pixel_format, GL.GL_UNSIGNED_BYTE, None)
+            for layer, layer_levels in enumerate(images):
+                GL.glTexSubImage3D(GL.GL_TEXTURE_2D_ARRAY, level, 0, 0, layer, width, height, 1,
+                                   pixel_format, GL.GL_UNSIGNED_BYTE, np.ascontiguousarray(layer_levels[level]))
+        GL.glTexParameteri(GL.GL_TEXTURE_2D_ARRAY, GL.GL_TEXTURE_MAX_LEVEL, levels - 1)
+        set_swizzle(GL.GL_TEXTURE_2D_ARRAY, channels)
+        GL.glTexParameteri(GL.GL_TEXTURE_2D_ARRAY, GL.GL_TEXTURE_WRAP_S, wrap_mode)
+        GL.glTexParameteri(GL.GL_TEXTURE_2D_ARRAY, GL.GL_TEXTURE_WRAP_T, wrap_mode)
+        GL.glTexParameteri(GL.GL_TEXTURE_2D_ARRAY, GL.GL_TEXTURE_MAG_FILTER, min_filter)  # same as Texture
+        GL.glTexParameteri(GL.GL_TEXTURE_2D_ARRAY, GL.GL_TEXTURE_MIN_FILTER, mag_filter)
+        GL.glBindTexture(GL.GL_TEXTURE_2D_ARRAY, 0)
+
+    @releases_gl
+    def __del__(self):
+        GL.glDeleteTextures(self.glid)
+
+
+class TextureLayer:
+    """ One layer of a TextureArray, used by meshes in place of a Texture:
+        they bind its target and pass its layer to the shader """
+    target = GL.GL_TEXTURE_2D_ARRAY
+
+    def __init__(self, array, layer):
+        self.array, self.layer = array, layer
+
+    @property
+    def glid(self):
+        return self.array.glid
+
+
+class TextureRegistry:
+    """ Textures shared by file and sampler parameters: a hit returns the
+        already uploaded Texture instead of decoding and uploading it again.
+        Entries are weak references, so a texture is still deleted from the
+        GPU once the last mesh using it dies. """
+
+    def __init__(self):
+        self.textures = weakref.WeakValueDictionary()
+        self.loading = SingleFlight()  # loader threads asking for a texture being loaded wait for it
+        self.hits, self.misses = 0, 0
+        self.formats = {}  # file: (format, bytes, RGBA8 bytes) of the textures loaded
+
+    def get(self, tex_file, wrap_mode=GL.GL_REPEAT, min_filter=GL.GL_LINEAR,
+            mag_filter=GL.GL_LINEAR_MIPMAP_LINEAR, srgb=False):
+        """ shared Texture for tex_file with these parameters, loaded on a miss """
+        key = (os.path.normpath(os.path.abspath(tex_file)), int(wrap_mode), int(min_filter), int(mag_filter),
+               bool(srgb))
+        texture = self.textures.get(key)
+        if texture is None:
+            texture, loaded = self.loading.do(key, self.load, key, tex_file, wrap_mode, min_filter, mag_filter,
+                                              srgb)
+            if loaded:
+                return texture
+        self.hits += 1
+        return texture
+
+    def load(self, key, *parameters):
+        texture = self.textures.get(key)  # loaded by another thread meanwhile
+        if texture is None:
+            self.misses += 1
+            texture = self.textures[key] = Texture(*parameters)
+            if texture.format:
+                self.formats[os.path.relpath(key[0])] = texture.format, texture.bytes, texture.rgba_bytes
+        else:
+            self.hits += 1
+        return texture
+
+    def report(self):
+        uploaded = sum(size for _, size, _ in self.formats.values())
+        saved = sum(rgba - size for _, size, rgba in self.formats.values())
+        lines = ['Textures: %d loaded, %d shared (%d alive), %.1f MB uploaded, %.1f MB saved over RGBA8' % (
+            self.misses, self.hits, len(self.textures), uploaded / 2 ** 20, saved / 2 ** 20)]
+        for file, (name, size, rgba) in sorted(self.formats.items()):
+            if rgba > size:
+                lines.append('  %-60s %-5s %7.1f KB saved (%d%%)' % (file, name, (rgba - size) / 2 ** 10,
+                                                                     100 * (rgba - size) // rgba))
+        return '\n'.join(lines)
+
+
+TEXTURES = TextureRegistry()  # process wide registry used by the loaders
+
+
+def load_texture(tex_file, wrap_mode=GL.GL_REPEAT, min_filter=GL.GL_LINEAR, mag_filter=GL.GL_LINEAR_MIPMAP_LINEAR,
+                 srgb=False):
+    """ Texture of tex_file, shared with every other user of the same file and parameters """
+    return TEXTURES.get(tex_file, wrap_mode, min_filter, mag_filter, srgb)
@@ -1,42 +1,76 @@
+import os
 from itertools import cycle
 
 import glfw
 import numpy as np
 import OpenGL.GL as GL
-from PIL import Image
 
+from cache import ArrayCache, cache_key
 from mesh import Mesh
-from texture import Texture
-from transform import normalized
+from texture import load_texture
 from node import Node
+from renderqueue import Drawable
+from culling import vertex_bounds
 import config
 
 
-# -------------- Example texture plane class ----------------------------------
-class TexturedPlane(Mesh, Node):
-    """ Simple first textured object """
-
-    def __init__(self, background_texture_file, road_texture_file, road2_texture_file,  blendmap_file, shader, size, hmap_file):
-
-        # Load heightmap file
-        hmap_tex = np.asarray(Image.open(hmap_file).convert('RGB'))
-
-        self.MAX_HEIGHT = 30
-        self.MIN_HEIGHT = 0
-        self.MAX_PIXEL_COLOR = 256
-        self.HMAP_SIZE = hmap_tex.shape[0]  # 256
+# -------------- Vectorized heightmap grid generation -------------------------
+def grid_vertices(heights, extent=1000):
+    """ (x, height, z) grid positions and uvs, row i of the map along z """
+    size = heights.shape[0]
+    steps = np.arange(size) / (size - 1)
+    vertices = np.empty((size * size, 3), np.float32)
+    vertices[:, 0] = np.tile(steps * extent, size)
+    vertices[:, 1] = heights.ravel()
+    vertices[:, 2] = np.repeat(steps * extent, size)
+    texture_coords = np.empty((size * size, 2), np.float32)
+    texture_coords[:, 0] = np.tile(steps, size)
+    texture_coords[:, 1] = np.repeat(steps, size)
+    return vertices, texture_coords
+
+
+def grid_normals(heights):
+    """ Central difference normals, heights are 0 outside the map borders.
+        Neighbours are sampled as image[x, z], i.e. on the transposed map,
+        which is what TexturedPlane.calculate_normal always did. """
+    padded = np.pad(heights.T, 1, mode='constant')
+    height_l, height_r = padded[1:-1, :-2], padded[1:-1, 2:]
+    height_d, height_u = padded[:-2, 1:-1], padded[2:, 1:-1]
+    n_x, n_z = (height_l - height_r).ravel(), (height_d - height_u).ravel()
+    norm = np.sqrt(n_x * n_x + 4.0 + n_z * n_z)  # same summation order as normalized()
+    normals = np.empty((n_x.size, 3), np.float32)
+    normals[:, 0] = n_x / norm
+    normals[:, 1] = 2.0 / norm
+    normals[:, 2] = n_z / norm
+    return normals
+
+
+def grid_indices(size):
+    """ Two triangles per grid quad: (tl, bl, tr) and (tr, bl, br) """
+    top_left = np.arange(size * size, dtype=np.int32).reshape(size, size)[:-1, :-1].ravel()
+    bottom_left = top_left + size
+    return np.stack((top_left, bottom_left, top_left + 1,
+                     top_left + 1, bottom_left, bottom_left + 1), axis=1)
+
+
+def grid_attributes(heights, extent=1000):
+    """ vertices, texture coords, normals and indices of a square heightfield,
+        as the float32/int32 arrays VertexArray uploads to the GPU """
+    vertices, texture_coords = grid_vertices(heights, extent)
+    return vertices, texture_coords, grid_normals(heights), grid_indices(heights.shape[0])
+
+
+# -------------- Blend mapped terrain textures --------------------------------
+class TerrainTextures:
+    """ Mixin holding the four blend mapped terrain textures and the
+        terrain shader uniforms, shared by every terrain flavour """
+
+    def setup_textures(self, shader, background_texture_file, road_texture_file, road2_texture_file,
+                       blendmap_file):
         self.background_texture_file = background_texture_file
         self.road_texture_file = road_texture_file
         self.road2_texture_file = road2_texture_file
         self.blendmap_file = blendmap_file
-        # self.fog_colour = FogColour()
-
-        vertices, texture_coords, normals, indices = self.create_attributes(self.HMAP_SIZE, hmap_tex=hmap_tex)
-
-        super().__init__(shader, [vertices, texture_coords, normals], indices)
-
-        self.names = ['diffuse_map', 'blue_texture', 'red_texture', 'blendmap', 'fog_colour']
-        self.loc1 = {n: GL.glGetUniformLocation(shader.glid, n) for n in self.names}
 
         # interactive toggles
         self.wrap = cycle([GL.GL_REPEAT, GL.GL_MIRRORED_REPEAT,
@@ -47,69 +81,10 @@ class TexturedPlane(Mesh, Node):
         self.wrap_mode, self.filter_mode = next(self.wrap), next(self.filter)
 
         # setup texture and upload it to GPU
-        self.background_texture = Texture(self.background_texture_file, self.wrap_mode, *self.filter_mode)
-        self.road_texture = Texture(self.road_texture_file, self.wrap_mode, *self.filter_mode)
-        self.road2_texture = Texture(self.road2_texture_file, self.wrap_mode, *self.filter_mode)
-        self.blendmap_texture = Texture(self.blendmap_file, self.wrap_mode, *self.filter_mode)
-
-    def create_attributes(self, size, hmap_tex):
-        vertices = []
-        normals = []
-        texture_coords = []
-
-        # Create vertices, normals, and texture coordinates
-        for i in range(0, size):
-            for j in range(0, size):
-                # Vertices - (x, y, z)
-                vertices.append([(j / (size - 1)) * 1000,
-                                 self.get_height(i, j, image=hmap_tex),
-                                 (i / (size - 1)) * 1000])
-                normals.append(self.calculate_normal(x=j, z=i, hmap_image=hmap_tex))
-                # normals.append([0, 1, 0])
-                texture_coords.append([j / (size - 1), i / (size - 1)])
-
-        # Convert to numpy array list
-        vertices = np.array(vertices)
-        normals = np.array(normals)
-        texture_coords = np.array(texture_coords)
-
-        indices = []
-        for gz in range(0, size - 1):
-            for gx in range(0, size - 1):
-                top_left = (gz * size) + gx
-                top_right = top_left + 1
-                bottom_left = ((gz + 1) * size) + gx
-                bottom_right = bottom_left + 1
-                indices.append([top_left, bottom_left, top_right, top_right, bottom_left, bottom_right])
-
-        indices = np.array(indices)
-
-        return vertices, texture_coords, normals, indices
-
-    def calculate_normal(self, x, z, hmap_image):
-        """
-        Calculate normals based on current point's neightbours.
-        :param x: x coordinate
-        :param z: z coordinate
-        :param hmap_image: the heightmap image
-        :return: normalized calculated normals
-        """
-        height_l = self.get_height(x-1, z, image=hmap_image)
-        height_r = self.get_height(x+1, z, hmap_image)
-        height_d = self.get_height(x, z-1, hmap_image)
-        height_u = self.get_height(x, z+1, hmap_image)
-        return normalized(np.array([height_l-height_r, 2.0, height_d-height_u]))
-
-    def get_height(self, x, z, image):
-        if x < 0 or x >= image.shape[0] or z < 0 or z >= image.shape[0]:
-            return 0
-        height = image[x, z, 0]
-        # [0 to 1] range
-        height /= self.MAX_PIXEL_COLOR
-        # [0 to MAX_HEIGHT] range
-        height *= self.MAX_HEIGHT
-
-        return height
+        self.background_texture = load_texture(self.background_texture_file, self.wrap_mode, *self.filter_mode)
+        self.road_texture = load_texture(self.road_texture_file, self.wrap_mode, *self.filter_mode)
+        self.road2_texture = load_texture(self.road2_texture_file, self.wrap_mode, *self.filter_mode)
+        self.blendmap_texture = load_texture(self.blendmap_file, self.wrap_mode, *self.filter_mode)
 
     def key_handler(self, key):
         # some day-night interactive elements
@@ -120,29 +95,11 @@ class TexturedPlane(Mesh, Node):
         if key == glfw.KEY_F8:
             config.fog_colour.toggle_value = 8
 
-    def draw(self, projection, view, model, primitives=GL.GL_TRIANGLES):
-        GL.glUseProgram(self.shader.glid)
-
-        # texture access setups
-        self.bind_textures()
-        self.connect_texture_units()
-        super().draw(projection, view, model, primitives)
-
     def connect_texture_units(self):
-        GL.glUniform1i(self.loc1['diffuse_map'], 0)
-        GL.glUniform1i(self.loc1['blue_texture'], 1)
-        GL.glUniform1i(self.loc1['red_texture'], 2)
-        GL.glUniform1i(self.loc1['blendmap'], 3)
-        GL.glUniform3fv(self.loc1['fog_colour'], 1, config.fog_colour.get_colour())
-
-        # print(self.fog_colour.get_atten()[0])
-        # atten_var = self.fog_colour.get_atten()
-        for i in range(0, config.fog_colour.num_light_src):
-            light_pos_loc = GL.glGetUniformLocation(self.shader.glid, 'light_position[%d]' % i)
-            GL.glUniform3fv(light_pos_loc, 1, config.fog_colour.light_pos[i])
-
-            atten_loc = GL.glGetUniformLocation(self.shader.glid, 'atten_factor[%d]' % i)
-            GL.glUniform3fv(atten_loc, 1, config.fog_colour.get_atten()[i])
+        self.shader.set_uniform('diffuse_map', 0)
+        self.shader.set_uniform('blue_texture', 1)
+        self.shader.set_uniform('red_texture', 2)
+        self.shader.set_uniform('blendmap', 3)
 
     def bind_textures(self):
         GL.glActiveTexture(GL.GL_TEXTURE0)
@@ -153,3 +110,62 @@ class TexturedPlane(Mesh, Node):
         GL.glBindTexture(GL.GL_TEXTURE_2D, self.road2_texture.glid)
         GL.glActiveTexture(GL.GL_TEXTURE3)
         GL.glBindTexture(GL.GL_TEXTURE_2D, self.blendmap_texture.glid)
+
+
+# -------------- Example texture plane class ----------------------------------
+class TexturedPlane(TerrainTextures, Drawable, Mesh, Node):
+    """ Simple first textured object """
+
+    def __init__(self, background_texture_file, road_texture_file, road2_texture_file,  blendmap_file, shader,
+                 heightfield, resolution=None):
+
+        # heightfield is shared with the camera (ground following) and object placement,
+        # resolution resamples it to a coarser grid for rendering
+        self.heightfield = heightfield
+        self.size = heightfield.extent  # world extent covered by the heightmap
+        self.HMAP_SIZE = resolution or heightfield.size
+        # self.fog_colour = FogColour()
+
+        # Generated mesh is cached on disk, keyed by the heightmap contents and
+        # generation parameters, a hit maps the arrays without touching the heightmap
+        name = os.path.splitext(os.path.basename(heightfield.hmap_file))[0]
+        cache = ArrayCache('%s-%s' % (type(self).__name__, name))
+        arrays = cache.get(cache_key(*self.cache_parameters()), self.generate_attributes)
+        self.setup_attributes(arrays)
+
+        super().__init__(shader, self.vertex_attributes(arrays), arrays['indices'])
+        self.bounds = self.geometry_bounds(arrays)  # for frustum culling (see culling)
+
+        self.setup_textures(shader, background_texture_file, road_texture_file, road2_texture_file, blendmap_file)
+
+    def cache_parameters(self):
+        """ everything the generated mesh arrays depend on """
+        return (type(self).__name__, self.heightfield.digest, self.heightfield.max_height,
+                self.heightfield.max_pixel_color, self.size, self.HMAP_SIZE)
+
+    def generate_attributes(self):
+        """ build the mesh arrays from the heightfield, on cache miss """
+        return self.create_attributes(self.heightfield.grid(self.HMAP_SIZE))
+
+    def setup_attributes(self, arrays):
+        """ state derived from the generated or cached arrays """
+
+    def geometry_bounds(self, arrays):
+        """ culling.Bounds of the generated or cached mesh """
+        return vertex_bounds(arrays['vertices'])
+
+    def vertex_attributes(self, arrays):
+        """ per vertex buffers to upload, in shader location order """
+        return [arrays['vertices'], arrays['texture_coords'], arrays['normals']]
+
+    def create_attributes(self, heights):
+        vertices, texture_coords, normals, indices = grid_attributes(heights, extent=self.size)
+        return dict(vertices=vertices, texture_coords=texture_coords, normals=normals, indices=indices)
+
+    def render(self, projection, view, model, primitives=GL.GL_TRIANGLES):
+        # texture access setups
+        self.bind_textures()
+        self.connect_texture_units()
+
+        self.shader.set_uniform('model', model)  # program bound by the render queue, camera in the Frame block
+        self.vertex_array.execute(primitives)
@@ -0,0 +1,68 @@
+"""
+Packing of mesh diffuse maps into texture arrays.
+
+Once the builders have run, TexturePacker.pack() gathers the textures of
+the scene's TexturedPhongMeshes, groups same sized ones (with the same
+sampler parameters) into GL_TEXTURE_2D_ARRAY layers and hands each mesh
+its TextureLayer, switching it to the array variant of its shader. Meshes
+of a group then all bind the same texture, and static batching (see
+batching) can merge them into one draw, the layer given per vertex.
+"""
+# External, non built-in modules
+from mesh import TexturedPhongMesh
+from texcache import image_levels
+from texture import Texture, TextureArray, TextureLayer, texture_modes
+
+MAX_LAYERS = 256  # layers per array, layer indices fit the uint8 vertex attribute
+
+
+def scene_meshes(node):
+    """ all TexturedPhongMeshes below node, levels of detail included """
+    for child in list(node.children) + list(getattr(node, 'levels', [])):
+        if isinstance(child, TexturedPhongMesh):
+            yield child
+        else:
+            yield from scene_meshes(child)
+
+
+class TexturePacker:
+    """ Packs the textures of meshes drawn with the keys of shaders into
+        arrays, the meshes then drawn with the matching values, shaders
+        sampling a sampler2DArray (shaders/phong_array.frag,
+        shaders/lambertian_array.frag) """
+
+    def __init__(self, shaders, max_layers=MAX_LAYERS):
+        self.shaders = shaders
+        self.max_layers = max_layers
+        self.textures, self.arrays = 0, 0
+
+    def pack(self, root):
+        meshes = [mesh for mesh in scene_meshes(root)
+                  if mesh.shader in self.shaders and type(mesh.texture) is Texture]
+
+        # distinct textures by image size and sampler parameters
+        groups, images = {}, {}
+        for texture in {mesh.texture for mesh in meshes}:
+            try:
+                images[texture] = image_levels(texture.file, texture_modes(texture.parameters[3]))
+            except FileNotFoundError:
+                continue
+            groups.setdefault((images[texture][0].shape, texture.parameters), []).append(texture)
+
+        layers = {}
+        for (_, parameters), textures in groups.items():
+            textures.sort(key=lambda texture: texture.file)
+            for start in range(0, len(textures) if len(textures) > 1 else 0, self.max_layers):
+                chunk = textures[start:start + self.max_layers]
+                array = TextureArray([images[texture] for texture in chunk], *parameters)
+                layers.update({texture: TextureLayer(array, layer) for layer, texture in enumerate(chunk)})
+                self.textures += len(chunk)
+                self.arrays += 1
+
+        for mesh in meshes:
+            if mesh.texture in layers:
+                mesh.texture, mesh.shader = layers[mesh.texture], self.shaders[mesh.shader]
+        return self
+
+    def report(self):
+        return 'Texture arrays: %d textures packed into %d arrays' % (self.textures, self.arrays)
@@ -1,26 +1,118 @@
+import ctypes
+import weakref
+
 import numpy as np
 import OpenGL.GL as GL
 
+from loading import on_gl_thread, releases_gl
+
+# small integer attributes (e.g. bone ids) are uploaded as is, shaders still
+# read them as (non normalized) floats, anything else is converted to float32
+INTEGER_TYPES = {np.dtype(np.uint8): GL.GL_UNSIGNED_BYTE, np.dtype(np.uint16): GL.GL_UNSIGNED_SHORT}
+
+# packed attribute formats of interleaved layouts: name -> (numpy type,
+# GL type, normalized), normalized formats scaled from [-1, 1] or [0, 1]
+FORMATS = {'float32': (np.float32, GL.GL_FLOAT, False),
+           'float16': (np.float16, GL.GL_HALF_FLOAT, False),
+           'snorm16': (np.int16, GL.GL_SHORT, True),
+           'snorm8': (np.int8, GL.GL_BYTE, True),
+           'unorm16': (np.uint16, GL.GL_UNSIGNED_SHORT, True),
+           'unorm8': (np.uint8, GL.GL_UNSIGNED_BYTE, True),
+           'uint16': (np.uint16, GL.GL_UNSIGNED_SHORT, False),
+           'uint8': (np.uint8, GL.GL_UNSIGNED_BYTE, False),
+           'snorm10': (np.uint32, GL.GL_INT_2_10_10_10_REV, True)}  # 3 or 4 components in 4 bytes
+
+HALF_UV_RANGE = 2  # half float uvs keep a 1/1024 step up to there
+LAYER_LOCATION = 7  # texture array layer attribute of the mesh shaders, per vertex or constant
+
+
+def pack_attribute(data, format_name):
+    """ attribute rows converted to a packed format, no copy if already in it """
+    dtype, _, normalized = FORMATS[format_name]
+    data = np.asarray(data)
+    if format_name == 'snorm10':  # x, y, z in 10 bit signed fields, w unused
+        fields = np.rint(np.clip(data[:, :3], -1, 1) * 511).astype(np.int32) & 1023
+        return (fields[:, 0] | fields[:, 1] << 10 | fields[:, 2] << 20).astype(np.uint32)[:, None]
+    if normalized and np.issubdtype(data.dtype, np.floating):
+        info = np.iinfo(dtype)
+        data = np.rint(np.clip(data, min(info.min, 0) / info.max, 1) * info.max)
+    return np.asarray(data, dtype)
+
+
+def mesh_layout(attributes):
+    """ packed layout of loader mesh attributes [position, uvs, normal(,
+        bone ids, bone weights)], or of batched ones with texture layers
+        at LAYER_LOCATION: uvs as half floats unless they tile further
+        than HALF_UV_RANGE, normals in 4 bytes """
+    uvs = 'float16' if np.abs(attributes[1]).max(initial=0) <= HALF_UV_RANGE else 'float32'
+    bone_ids = 'uint8' if len(attributes) < 4 or attributes[3] is None or \
+        np.asarray(attributes[3]).max(initial=0) < 256 else 'uint16'
+    formats = {0: 'float32', 1: uvs, 2: 'snorm10', 3: bone_ids, 4: 'unorm16', LAYER_LOCATION: 'uint8'}
+    return tuple(formats.get(loc) for loc in range(len(attributes)))
+
+
+def interleave(attributes, formats):
+    """ Single array of interleaved attributes (None ones skipped) packed to
+        formats, fields 4 byte aligned. Returns (vertices as a structured
+        array, [(location, components, GL type, normalized, byte offset)]) """
+    names, types, offsets, pointers, offset = [], [], [], [], 0
+    packed = [(loc, pack_attribute(data, format_name), format_name)
+              for loc, (data, format_name) in enumerate(zip(attributes, formats)) if data is not None]
+    for loc, data, format_name in packed:
+        _, gl_type, normalized = FORMATS[format_name]
+        components = 4 if format_name == 'snorm10' else data.shape[1]
+        names.append('attribute%d' % loc)
+        types.append((data.dtype, data.shape[1:]))
+        offsets.append(offset)
+        pointers.append((loc, components, gl_type, normalized, offset))
+        offset += -(-data.dtype.itemsize * data.shape[1] // 4) * 4
+    vertices = np.zeros(len(packed[0][1]), np.dtype(dict(names=names, formats=types, offsets=offsets,
+                                                          itemsize=offset)))
+    for name, (_, data, _) in zip(names, packed):
+        vertices[name] = data
+    return vertices, pointers
+
 
 class VertexArray:
     """ helper class to create and self destroy OpenGL vertex array objects."""
 
-    def __init__(self, attributes, index=None, usage=GL.GL_STATIC_DRAW):
+    @on_gl_thread
+    def __init__(self, attributes, index=None, usage=GL.GL_STATIC_DRAW, layout=None):
         """ Vertex array from attributes and optional index array. Vertex
-            Attributes should be list of arrays with one row per vertex. """
+            Attributes should be list of arrays with one row per vertex.
+            With a layout (one FORMATS name per attribute) they are packed
+            and interleaved in a single buffer, indices stored as uint16
+            when the vertex count allows. """
 
         # create vertex array object, bind it
         self.glid = GL.glGenVertexArrays(1)
         GL.glBindVertexArray(self.glid)
         self.buffers = []  # we will store buffers in a list
+        self.nbytes = 0  # GPU memory used by the buffers
         nb_primitives, size = 0, 0
 
+        if layout is not None:
+            # single interleaved vbo, one strided pointer per attribute
+            vertices, pointers = interleave(attributes, layout)
+            nb_primitives = len(vertices)
+            self.buffers.append(GL.glGenBuffers(1))
+            GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self.buffers[-1])
+            GL.glBufferData(GL.GL_ARRAY_BUFFER, vertices, usage)
+            self.nbytes += vertices.nbytes
+            for loc, components, gl_type, normalized, offset in pointers:
+                GL.glEnableVertexAttribArray(loc)
+                GL.glVertexAttribPointer(loc, components, gl_type, normalized, vertices.itemsize,
+                                         ctypes.c_void_p(offset))
+            attributes = []
+
         # load buffer per vertex attribute (in list with index = shader layout)
         for loc, data in enumerate(attributes):
             if data is not None:
                 # bind a new vbo, upload its data to GPU, declare size and type
                 self.buffers.append(GL.glGenBuffers(1))
-                data = np.array(data, np.float32, copy=False)  # ensure format
+                gl_type = INTEGER_TYPES.get(getattr(data, 'dtype', None), GL.GL_FLOAT)
+                if gl_type == GL.GL_FLOAT:
+                    data = np.asarray(data, np.float32)  # ensure format, no copy if already float32
                 # print(data.shape)
                 nb_primitives, size = data.shape
                 # print("nb_primitives:", nb_primitives)
@@ -28,18 +120,26 @@ class VertexArray:
                 GL.glEnableVertexAttribArray(loc)
                 GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self.buffers[-1])
                 GL.glBufferData(GL.GL_ARRAY_BUFFER, data, usage)
-                GL.glVertexAttribPointer(loc, size, GL.GL_FLOAT, False, 0, None)
+                self.nbytes += data.nbytes
+                GL.glVertexAttribPointer(loc, size, gl_type, False, 0, None)
 
         # optionally create and upload an index buffer for this object
         self.draw_command = GL.glDrawArrays
         self.arguments = (0, nb_primitives)
         if index is not None:
             self.buffers += [GL.glGenBuffers(1)]
-            index_buffer = np.array(index, np.int32, copy=False)  # good format
+            index = np.asarray(index)
+            if layout is not None and nb_primitives <= 2 ** 16:
+                index_buffer, index_type = index.astype(np.uint16), GL.GL_UNSIGNED_SHORT
+            elif index.dtype in (np.int32, np.uint32):  # assimp faces are uploaded as is
+                index_buffer, index_type = index, GL.GL_UNSIGNED_INT
+            else:
+                index_buffer, index_type = index.astype(np.int32), GL.GL_UNSIGNED_INT
             GL.glBindBuffer(GL.GL_ELEMENT_ARRAY_BUFFER, self.buffers[-1])
-            GL.glBufferData(GL.GL_ELEMENT_ARRAY_BUFFER, index_buffer, usage)
+            GL.glBufferData(GL.GL_ELEMENT_ARRAY_BUFFER, np.ascontiguousarray(index_buffer), usage)
+            self.nbytes += index_buffer.nbytes
             self.draw_command = GL.glDrawElements
-            self.arguments = (index_buffer.size, GL.GL_UNSIGNED_INT, None)
+            self.arguments = (index_buffer.size, index_type, None)
         # GL.glBindVertexArray(0)
 
     def execute(self, primitive):
@@ -47,6 +147,44 @@ class VertexArray:
         GL.glBindVertexArray(self.glid)
         self.draw_command(primitive, *self.arguments)
 
+    def execute_instanced(self, primitive, count):
+        """ draw count instances of the vertex array, bound by the caller """
+        if self.draw_command == GL.glDrawElements:
+            GL.glDrawElementsInstanced(primitive, *self.arguments, count)
+        else:
+            GL.glDrawArraysInstanced(primitive, *self.arguments, count)
+
+    @releases_gl
     def __del__(self):  # object dies => kill GL array and buffers from GPU
         GL.glDeleteVertexArrays(1, [self.glid])
         GL.glDeleteBuffers(len(self.buffers), self.buffers)
+
+
+class VertexArrayRegistry:
+    """ Vertex arrays shared by key (e.g. model file, import flags and mesh
+        index), so placing the same model again reuses its GPU buffers and
+        only adds a node transform. Entries are weak references, buffers are
+        still freed once the last mesh using them dies. """
+
+    def __init__(self):
+        self.vertex_arrays = weakref.WeakValueDictionary()
+        self.hits, self.misses, self.saved_bytes = 0, 0, 0
+
+    @on_gl_thread  # serializes lookups from loader threads
+    def get(self, key, attributes, index=None, layout=None):
+        """ VertexArray of key, uploading attributes and index on a miss """
+        vertex_array = self.vertex_arrays.get(key)
+        if vertex_array is None:
+            self.misses += 1
+            vertex_array = self.vertex_arrays[key] = VertexArray(attributes, index, layout=layout)
+        else:
+            self.hits += 1
+            self.saved_bytes += vertex_array.nbytes
+        return vertex_array
+
+    def report(self):
+        return 'Geometry: %d vertex arrays uploaded, %d shared (%.1f MB of GPU buffers saved)' % (
+            self.misses, self.hits, self.saved_bytes / 2 ** 20)
+
+
+GEOMETRY = VertexArrayRegistry()  # process wide registry used by the loaders
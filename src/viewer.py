@@ -5,18 +5,23 @@ import OpenGL.GL as GL
 from transform import Trackball, identity, lookat, perspective
 from node import Node
 from camera import Camera
+from frame import FrameUniforms
+from renderqueue import RENDER_QUEUE
+from culling import CULLING
+from loading import GL_THREAD
+import config
 
 
 # ------------  Viewer class & window management ------------------------------
 class Viewer(Node):
     """ GLFW viewer window, with classic initialization & graphics loop """
 
-    def __init__(self, width=640, height=480):
+    def __init__(self, width=640, height=480, heightfield=None):
         super().__init__()
 
         self.width = width
         self.height = height
-        self.camera = Camera()
+        self.camera = Camera(heightfield=heightfield)
         self.last_frame = 0.0
 
         # version hints: create GL window with >= OpenGL 3.3 and core profile
@@ -57,6 +62,9 @@ class Viewer(Node):
 
         self.model = identity()
 
+        # camera, fog and lights shared by all shaders, uploaded once per frame
+        self.frame = FrameUniforms()
+
     def run(self):
         """ Main render loop for this OpenGL window """
         while not glfw.window_should_close(self.win):
@@ -80,8 +88,13 @@ class Viewer(Node):
             # Update the projection matrix
             projection = perspective(fovy=self.camera.get_fov(), aspect=(self.width / self.height), near=0.1, far=500.0)
 
-            # draw our scene objects
+            # draw our scene objects, sorted by state through the render queue
+            self.frame.update(projection, view)
+            CULLING.begin(projection @ view if config.frustum_culling else None)
+            RENDER_QUEUE.begin()
             self.draw(projection, view, identity())
+            RENDER_QUEUE.flush()
+            GL_THREAD.run_queued()  # GL objects released by other threads
 
             # flush render commands, and swap draw buffers
             glfw.swap_buffers(self.win)